@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Iterable, Optional
+
+# Dùng chung cho crawler và streaming: script trong crawl/ import thẳng (from alias_resolver import AliasResolver),
+# streaming/main.ipynb gửi file này tới Spark bằng spark.sparkContext.addPyFile("<repo>/crawl/alias_resolver.py").
+# Vì được gửi lẻ một file nên chỉ dùng thư viện chuẩn (không import logger của crawl/),
+# có unidecode / rapidfuzz / fuzzywuzzy thì dùng cho nhanh và khớp kết quả cũ
+try:
+    from unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    try:
+        from fuzzywuzzy import fuzz
+    except ImportError:
+        fuzz = None
+
+DEFAULT_ALIASES_PATH = "./celebrity_aliases.json"
+DEFAULT_THRESHOLD = 90
+DEFAULT_MAX_CANDIDATES = 20
+NGRAM_SIZE = 3
+MEMO_SIZE = 100_000
+
+def strip_accents(text: str) -> str:
+    if unidecode is not None:
+        return unidecode(text)
+    # Đ/đ không tách được bằng NFD
+    text = text.replace("Đ", "D").replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+def normalize(text: str) -> str:
+    '''
+    Bỏ dấu, viết thường và gộp khoảng trắng: "Sơn  Tùng" -> "son tung".
+    '''
+    return re.sub(r"\s+", " ", strip_accents(text).lower()).strip()
+
+def ratio(a: str, b: str) -> float:
+    if fuzz is not None:
+        return fuzz.ratio(a, b)
+    from difflib import SequenceMatcher
+    return round(100 * SequenceMatcher(None, a, b).ratio())
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> set:
+    padded = f" {text} "
+    if len(padded) < n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class AliasResolver():
+    '''
+    Tra tên người nổi tiếng từ alias, dựng một lần từ celebrity_aliases.json:
+    dict alias đã chuẩn hoá -> tên gốc để khớp chính xác, và chỉ mục trigram để khi khớp mờ
+    chỉ tính fuzz.ratio trên vài alias có nhiều trigram chung thay vì toàn bộ alias.
+    '''
+    _resolvers = dict()
+    _resolvers_lock = threading.Lock()
+
+    def __init__(self, alias_dict: dict, threshold: int = DEFAULT_THRESHOLD,
+                 max_candidates: int = DEFAULT_MAX_CANDIDATES):
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.alias_to_name = dict()
+        for name, aliases in alias_dict.items():
+            self.alias_to_name.setdefault(normalize(name), name)
+            for alias in aliases:
+                self.alias_to_name.setdefault(normalize(alias), name)
+        self.alias_to_name.pop("", None)
+
+        # Các biến thể hoa/thường, có dấu/không dấu của một tên chỉ còn một alias sau chuẩn hoá
+        self._aliases = list(self.alias_to_name)
+        self._index = defaultdict(list)
+        for alias_id, alias in enumerate(self._aliases):
+            for gram in ngrams(alias):
+                self._index[gram].append(alias_id)
+        self._memo = dict()
+        self._memo_lock = threading.Lock()
+
+    @staticmethod
+    def load(path: str, **kwargs) -> "AliasResolver":
+        '''
+        Trả về AliasResolver dùng chung cho file path (mỗi process chỉ đọc và dựng chỉ mục một lần).
+        '''
+        key = (os.path.abspath(path), tuple(sorted(kwargs.items())))
+        with AliasResolver._resolvers_lock:
+            if key not in AliasResolver._resolvers:
+                with open(path, "r", encoding="utf-8") as f:
+                    AliasResolver._resolvers[key] = AliasResolver(json.load(f), **kwargs)
+            return AliasResolver._resolvers[key]
+
+    def canonical(self, text: str) -> Optional[str]:
+        return self.alias_to_name.get(normalize(text))
+
+    def candidates(self, normalized: str) -> list[str]:
+        # Đếm số trigram chung, giữ các alias chung nhiều nhất và có độ dài đủ gần để đạt ngưỡng
+        counts = defaultdict(int)
+        for gram in ngrams(normalized):
+            for alias_id in self._index.get(gram, ()):
+                counts[alias_id] += 1
+        min_share = self.threshold / 100
+        ranked = sorted(counts.items(), key=lambda item: -item[1])
+        result = []
+        for alias_id, _ in ranked:
+            alias = self._aliases[alias_id]
+            # ratio = 2*M/(len(a)+len(b)) <= 2*min/(len(a)+len(b))
+            if 2 * min(len(alias), len(normalized)) < min_share * (len(alias) + len(normalized)):
+                continue
+            result.append(alias)
+            if len(result) >= self.max_candidates:
+                break
+        return result
+
+    def resolve(self, entity: str) -> Optional[str]:
+        '''
+        Tên gốc của entity: khớp chính xác sau chuẩn hoá, không có thì alias gần nhất có
+        fuzz.ratio >= threshold trong các ứng viên của chỉ mục trigram.
+        '''
+        normalized = normalize(entity)
+        if not normalized:
+            return None
+        if normalized in self.alias_to_name:
+            return self.alias_to_name[normalized]
+        if normalized in self._memo:
+            return self._memo[normalized]
+
+        best_score, best_match = 0, None
+        for alias in self.candidates(normalized):
+            score = ratio(normalized, alias)
+            if score > best_score and score >= self.threshold:
+                best_score, best_match = score, self.alias_to_name[alias]
+
+        with self._memo_lock:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[normalized] = best_match
+        return best_match
+
+    def resolve_all(self, entities: Iterable[str]) -> list[str]:
+        '''
+        Đổi từng entity sang tên gốc (không khớp thì giữ nguyên), bỏ trùng và giữ thứ tự.
+        '''
+        resolved, seen = [], set()
+        for entity in entities:
+            name = self.resolve(entity) or entity
+            if name not in seen:
+                resolved.append(name)
+                seen.add(name)
+        return resolved
+
+    def replace_in_subjects(self, text: str, subjects: Iterable[str]) -> str:
+        '''
+        Thay các cụm chủ ngữ là alias bằng tên gốc, phần còn lại của câu giữ nguyên.
+        '''
+        for subject in subjects:
+            name = self.canonical(subject)
+            if name is not None:
+                text = text.replace(subject, name)
+        return text
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tra tên người nổi tiếng từ alias")
+    parser.add_argument("entities", nargs="*", help="Các tên cần tra, bỏ trống thì đọc từng dòng từ stdin")
+    parser.add_argument("--aliases", default=DEFAULT_ALIASES_PATH)
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    resolver = AliasResolver.load(args.aliases, threshold=args.threshold)
+    entities = args.entities or [line.strip() for line in sys.stdin if line.strip()]
+    for entity in entities:
+        print(f"{entity}\t{resolver.resolve(entity) or ''}")
@@ -0,0 +1,227 @@
+from logger import setup_logger
+from filelock import FileLock
+from typing import Optional
+import json
+import os
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_REGISTRY_PATH = "./api_info/api_info.json"
+DEFAULT_FLUSH_BATCH = 20
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_COMMENT_API_PATH = "./api_info/comment_api.json"
+# doc_id lâu hơn thế này chưa có response đúng thì nên chạy lại api_scraper.py
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+COMMENT_API_NAMES = [
+    "CommentListComponentsRootQuery",
+    "CommentsListComponentsPaginationQuery",
+    "Depth1CommentsListPaginationQuery",
+]
+
+def _read_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except json.JSONDecodeError as e:
+        logger.warning(f"File {path} hỏng, bỏ qua {e}")
+        return {}
+
+def _write_json_atomic(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+class ApiRegistry():
+    '''
+    Danh sách doc_id của các API GraphQL (tên API -> doc_id), giữ trong bộ nhớ và ghi xuống
+    api_info.json theo lô (ghi file tạm rồi đổi tên), dùng file lock để nhiều process cùng dùng.
+    Thời điểm mỗi doc_id được xác nhận lần cuối lưu ở file <tên>_verified_at.json bên cạnh,
+    api_info.json vẫn giữ dạng phẳng {tên API: doc_id} như cũ. Crawler lấy doc_id qua require()
+    (file export như comment_api.json được ưu tiên) và gọi mark_verified() khi response dùng
+    doc_id đó parse được.
+    '''
+    _shared = dict()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH, flush_batch: int = DEFAULT_FLUSH_BATCH,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.verified_path = f"{os.path.splitext(path)[0]}_verified_at.json"
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._file_lock = FileLock(f"{path}.lock")
+        self._lock = threading.RLock()
+        self._apis = dict()
+        self._verified_at = dict()
+        self._dirty = set()
+        # API chỉ được xác nhận lại, doc_id không đổi nên không ghi đè doc_id process khác vừa thêm
+        self._dirty_verified = set()
+        self._stale_warned = set()
+        # Nội dung file export đã đọc, theo đường dẫn -> (mtime, dữ liệu), đọc lại khi file đổi
+        self._sources = dict()
+        self._last_flush = time.monotonic()
+        self.reload()
+
+    @staticmethod
+    def shared(path: str = DEFAULT_REGISTRY_PATH) -> "ApiRegistry":
+        '''
+        Registry dùng chung cho mọi scraper/thread trong process, mỗi file chỉ có một instance.
+        '''
+        key = os.path.abspath(path)
+        with ApiRegistry._shared_lock:
+            if key not in ApiRegistry._shared:
+                ApiRegistry._shared[key] = ApiRegistry(path)
+            return ApiRegistry._shared[key]
+
+    def reload(self) -> None:
+        '''
+        Đọc lại file để thấy doc_id do process khác ghi, các thay đổi chưa flush vẫn được giữ.
+        '''
+        with self._lock, self._file_lock:
+            self._merge_from_disk()
+
+    def _merge_from_disk(self) -> None:
+        apis = _read_json(self.path)
+        verified_at = _read_json(self.verified_path)
+        for name, doc_id in apis.items():
+            if name not in self._dirty:
+                self._apis[name] = doc_id
+        for name, ts in verified_at.items():
+            self._verified_at[name] = max(ts, self._verified_at.get(name, 0))
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            return self._apis.get(name)
+
+    def has(self, names: list[str]) -> bool:
+        with self._lock:
+            return all(name in self._apis for name in names)
+
+    def require(self, names: list[str], source_path: Optional[str] = None,
+                max_age: float = DEFAULT_MAX_AGE) -> dict:
+        '''
+        Trả về {tên API: doc_id}. File export source_path (comment_api.json) có đủ các API thì lấy nguyên
+        bộ doc_id từ file đó, vì chúng được lấy cùng một lần chạy api_scraper.py; registry không ghi đè
+        và cũng không nhận các doc_id này. Không có file hoặc file thiếu API thì lấy cả bộ từ registry,
+        raise KeyError nếu registry cũng thiếu.
+        '''
+        source = self._read_source(source_path) if source_path else {}
+        from_source = bool(source) and all(name in source for name in names)
+        if from_source:
+            apis = {name: source[name] for name in names}
+            logger.debug(f"Lấy doc_id {names} từ {source_path}")
+        else:
+            if source_path:
+                logger.debug(f"{source_path} thiếu API {[name for name in names if name not in source]}, dùng registry {self.path}")
+            with self._lock:
+                if not self.has(names):
+                    self.reload()
+                missing = [name for name in names if name not in self._apis]
+                if missing:
+                    raise KeyError(f"Không có API {missing} trong registry {self.path}")
+                apis = {name: self._apis[name] for name in names}
+        self._warn_stale(apis, source_path if from_source else None, max_age)
+        return apis
+
+    def _read_source(self, path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._sources.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, _read_json(path))
+                self._sources[path] = cached
+            return cached[1]
+
+    def _warn_stale(self, apis: dict, source_path: Optional[str], max_age: float) -> None:
+        # doc_id trùng với registry thì dùng thời điểm xác nhận trong registry, không thì dùng lúc file export được ghi
+        now = time.time()
+        source_time = os.path.getmtime(source_path) if source_path else 0
+        with self._lock:
+            stale = []
+            for name, doc_id in apis.items():
+                checked_at = self._verified_at.get(name, 0) if self._apis.get(name) == doc_id else source_time
+                if now - checked_at > max_age and (name, doc_id) not in self._stale_warned:
+                    self._stale_warned.add((name, doc_id))
+                    stale.append(name)
+        if stale:
+            logger.warning(f"doc_id của {stale} chưa được xác nhận quá {max_age / 86400:.0f} ngày, nên chạy lại api_scraper.py")
+
+    def add(self, name: str, doc_id: str) -> None:
+        with self._lock:
+            if self._apis.get(name) != doc_id:
+                logger.debug(f"Cập nhật doc_id {name} = {doc_id}")
+            self._apis[name] = doc_id
+            self._verified_at[name] = time.time()
+            self._dirty.add(name)
+            self._maybe_flush()
+
+    def mark_verified(self, apis: dict) -> None:
+        '''
+        Gọi với {tên API: doc_id} khi request dùng doc_id đó trả về dữ liệu đúng, để biết doc_id nào
+        đã lâu chưa kiểm tra. Chỉ ghi nhận khi doc_id trùng với registry, doc_id lấy từ file export
+        khác với registry thì không làm thay đổi registry.
+        '''
+        with self._lock:
+            now = time.time()
+            for name, doc_id in apis.items():
+                if self._apis.get(name) == doc_id:
+                    self._verified_at[name] = now
+                    self._dirty_verified.add(name)
+            self._maybe_flush()
+
+    def verified_at(self, name: str) -> Optional[float]:
+        with self._lock:
+            return self._verified_at.get(name)
+
+    def stale(self, max_age: float) -> list[str]:
+        '''
+        Các API chưa được xác nhận trong max_age giây gần nhất, cần lấy lại doc_id.
+        '''
+        now = time.time()
+        with self._lock:
+            return [name for name in self._apis if now - self._verified_at.get(name, 0) > max_age]
+
+    def _maybe_flush(self) -> None:
+        if len(self._dirty | self._dirty_verified) >= self.flush_batch or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty and not self._dirty_verified:
+                return
+            with self._file_lock:
+                # Gộp với bản trên đĩa để không ghi đè doc_id mà process khác vừa thêm
+                self._merge_from_disk()
+                _write_json_atomic(self.path, self._apis)
+                _write_json_atomic(self.verified_path, self._verified_at)
+            logger.debug(f"Ghi {len(self._dirty)} doc_id, {len(self._dirty_verified)} lần xác nhận vào {self.path}")
+            self._dirty = set()
+            self._dirty_verified = set()
+            self._last_flush = time.monotonic()
+
+    def export(self, json_path: str, names: list[str]) -> bool:
+        '''
+        Ghi các API được chọn ra file riêng (post_api.json, comment_api.json), False nếu thiếu API nào.
+        '''
+        with self._lock:
+            missing = [name for name in names if name not in self._apis]
+            if missing:
+                logger.warning(f"Không có API {missing} trong registry")
+                return False
+            api_json = {name: self._apis[name] for name in names}
+        _write_json_atomic(json_path, api_json)
+        logger.debug(f"Export {names} vào {json_path}")
+        return True
+
+    def close(self) -> None:
+        self.flush()
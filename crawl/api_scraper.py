@@ -1,6 +1,6 @@
 from utils import Utils
-from driver_manager import ControllerDriver
-import time
+from driver_pool import DriverPool
+from typing import Optional
 from logger import setup_logger
 from selenium.webdriver.common.by import By
 import argparse
@@ -9,38 +9,50 @@ import logging
 
 logger = setup_logger(__name__, logging.DEBUG)
 class ApiScraper():
-    def __init__(self, cookies_path: str, api_path: str):
+    def __init__(self, cookies_path: str, api_path: str, driver_pool: Optional[DriverPool] = None):
         cookies_data = Utils.load_cookies(cookies_path)
         self.cookies = cookies_data["cookies"]
         self.api_path = api_path
+        # Không truyền pool thì tự tạo một pool 1 driver, giữ lại cho các lần lấy API sau
+        self.driver_pool = driver_pool
+        self._own_pool = driver_pool is None
+
+    def _get_driver_pool(self) -> DriverPool:
+        if self.driver_pool is None:
+            self.driver_pool = DriverPool(self.cookies, size=1, api_info_path=self.api_path)
+        return self.driver_pool
+
+    def close(self) -> None:
+        if self._own_pool and self.driver_pool is not None:
+            self.driver_pool.close()
+            self.driver_pool = None
     
     def _get_post_api(self, page_url_path: str) -> None:
         post_api_key = "ProfileCometTimelineFeedRefetchQuery"
 
-        driver = ControllerDriver()
-        driver.start_controller()
-
-        for _ in range(2):
-            if Utils.is_apis_in_source(self.api_path, [post_api_key]) == False:
-                url = Utils.get_random_url(page_url_path)
-                logger.debug(f"Đang truy cập url {url}")
-                driver.go_to_url(url)
-
-                driver.add_cookie(self.cookies)
-                logger.debug("Thêm cookie thành công")
-                driver.refresh()
-                driver.is_page_loaded()
-
-                driver.random_scroll(5)
-                
-        driver.stop_controller()
-        if Utils.is_apis_in_source(self.api_path, [post_api_key]) == False:
+        driver_pool = self._get_driver_pool()
+        with driver_pool.driver() as driver:
+            driver.reset_captured_apis()
+            for _ in range(2):
+                if not driver.has_apis([post_api_key]):
+                    url = Utils.get_random_url(page_url_path)
+                    logger.debug(f"Đang truy cập url {url}")
+                    # Driver trong pool đã có cookie, không cần add cookie và refresh lại
+                    driver.go_to_url(url)
+                    driver.wait_for_page_ready()
+
+                    # Dừng cuộn ngay khi DevTools bắt được request lấy post
+                    driver.random_scroll(5, stop_when=lambda: driver.has_apis([post_api_key]))
+            found = driver.has_apis([post_api_key])
+
+        if not found:
             logger.debug(f"Lấy {post_api_key} thất bại")
         else:
             logger.debug(f"Lấy {post_api_key} thành công")
 
             post_api_path = "./api_info/post_api.json"
-            Utils.export_api2json(self.api_path, post_api_path, [post_api_key])
+            driver_pool.api_registry.flush()
+            driver_pool.api_registry.export(post_api_path, [post_api_key])
 
 
     def _get_comment_api(self, post_url_path: str) -> None:
@@ -50,57 +62,55 @@ class ApiScraper():
             "CommentsListComponentsPaginationQuery"    
         ]
 
-        driver = ControllerDriver()
-        driver.start_controller()
-
-        for _ in range(2):
-            if Utils.is_apis_in_source(self.api_path, comment_apis) == False:
-                url = Utils.get_random_url(post_url_path)
-                logger.debug(f"Đang truy cập url {url}")
-                driver.go_to_url(url)
-                driver.add_cookie(self.cookies)
-                logger.debug("Thêm cookie thành công")
-                driver.refresh()
-                driver.is_page_loaded()
-
-                choice_comment_element = [
-                    {"by": By.XPATH, "selector": '//div[@role="button"]//span[text()="Phù hợp nhất"]'},
-                    {"by": By.XPATH, "selector": '//div[@role="button" and .//span[contains(text(), "Most relevant")]]'}
-                ]
-                choice_comment_button = driver.find_first_match(choice_comment_element)
-                if choice_comment_button is not None and driver.is_clickable(choice_comment_button):
-                    choice_comment_button.click()
-                
-                time.sleep(1)
-
-                choice_rank_element = [
-                    {"by": By.XPATH, "selector": '//div[@role="menuitem" and .//span[text()="All comments"]]'}
-                ]
-                choice_rank_button = driver.find_first_match(choice_rank_element)
-                if choice_rank_button is not None and driver.is_clickable(choice_rank_button):
-                    choice_rank_button.click()
-
-                scrollable_element = driver.get_first_scrollable_element()
-
-                logger.debug(f"Phần tử cuộn được {scrollable_element}")
-
-                for _ in range(2):
-                    if Utils.is_apis_in_source(self.api_path, [comment_apis[1]]) == False:
-                        if scrollable_element is not None:
-                            driver.scroll_element(scrollable_element, repeat=10) 
-
-        if Utils.is_apis_in_source(self.api_path, comment_apis) == False:
+        driver_pool = self._get_driver_pool()
+        with driver_pool.driver() as driver:
+            driver.reset_captured_apis()
+            for _ in range(2):
+                if not driver.has_apis(comment_apis):
+                    url = Utils.get_random_url(post_url_path)
+                    logger.debug(f"Đang truy cập url {url}")
+                    driver.go_to_url(url)
+                    driver.wait_for_page_ready()
+
+                    choice_comment_element = [
+                        {"by": By.XPATH, "selector": '//div[@role="button"]//span[text()="Phù hợp nhất"]'},
+                        {"by": By.XPATH, "selector": '//div[@role="button" and .//span[contains(text(), "Most relevant")]]'}
+                    ]
+                    choice_comment_button = driver.find_first_match(choice_comment_element)
+                    if choice_comment_button is not None and driver.is_clickable(choice_comment_button):
+                        choice_comment_button.click()
+
+                    # Chờ menu hiện ra thay vì ngủ cố định
+                    choice_rank_element = [
+                        {"by": By.XPATH, "selector": '//div[@role="menuitem" and .//span[text()="All comments"]]'}
+                    ]
+                    choice_rank_button = driver.wait_for_first_match(choice_rank_element, timeout=3)
+                    if choice_rank_button is not None:
+                        choice_rank_button.click()
+
+                    scrollable_element = driver.get_first_scrollable_element()
+
+                    logger.debug(f"Phần tử cuộn được {scrollable_element}")
+
+                    if scrollable_element is not None:
+                        driver.scroll_element(scrollable_element, repeat=20,
+                                              stop_when=lambda: driver.has_apis([comment_apis[1]]))
+                    driver.wait_for_apis(comment_apis, timeout=3)
+            found = driver.has_apis(comment_apis)
+
+        if not found:
             logger.debug(f"Lấy {comment_apis} thất bại")
         else:
             logger.debug(f"Lấy {comment_apis} thành công")
             comment_api_path = "./api_info/comment_api.json"
-            Utils.export_api2json(self.api_path, comment_api_path, comment_apis)
-
-        driver.stop_controller()
+            driver_pool.api_registry.flush()
+            driver_pool.api_registry.export(comment_api_path, comment_apis)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Chương trình lấy FACEBOOK API")
-    parser.add_argument("type_api", choices=["post_api", "comment_api"], help="Chọn loại Facebook API cần lấy\n post_api: Lấy api để lấy bài post\n comment_api: Lấy api để lấy bình luận")
+    parser.add_argument("type_api", choices=["post_api", "comment_api", "all"], help="Chọn loại Facebook API cần lấy\n post_api: Lấy api để lấy bài post\n comment_api: Lấy api để lấy bình luận\n all: Lấy cả hai với cùng một pool driver")
+    parser.add_argument("--pool-size", type=int, default=1, help="Số Chrome khởi động sẵn trong pool")
+    parser.add_argument("--show-browser", action="store_true", help="Mở Chrome có giao diện và tải đủ ảnh/CSS (để debug)")
 
     agrs = parser.parse_args()
     type_api = agrs.type_api
@@ -108,12 +118,15 @@ if __name__ == "__main__":
     cookie_path = "./chrome_profile/cookies/cookies.json"
     api_path = "./api_info/api_info.json"
 
-    api_scraper = ApiScraper(cookie_path, api_path) 
-
     post_url_path = "./facebook_urls/post_urls.txt"
     page_url_path = "./facebook_urls/page_urls.txt"
 
-    if type_api == "post_api":
-        api_scraper._get_post_api(page_url_path)
-    elif type_api == "comment_api":
-        api_scraper._get_comment_api(post_url_path)
+    cookies = Utils.load_cookies(cookie_path)["cookies"]
+    with DriverPool(cookies, size=agrs.pool_size, headless=not agrs.show_browser,
+                    block_resources=not agrs.show_browser, api_info_path=api_path) as driver_pool:
+        api_scraper = ApiScraper(cookie_path, api_path, driver_pool=driver_pool)
+
+        if type_api in ("post_api", "all"):
+            api_scraper._get_post_api(page_url_path)
+        if type_api in ("comment_api", "all"):
+            api_scraper._get_comment_api(post_url_path)
@@ -0,0 +1,451 @@
+from logger import setup_logger
+from requester import Requester, Ranking, GRAPHQL_URL
+from parser import Parser
+from facebook_scraper import FacebookScraper
+from utils import Utils
+from http_client import HttpClient
+from rate_limiter import RateLimiter, RETRY_STATUSES, backoff_delay
+from metrics import Metrics
+from image_downloader import ImageDownloader
+from image_store import ImageStore
+from bootstrap_cache import BootstrapCache
+from output_sink import JsonlSink
+from checkpoint_store import CheckpointStore
+from api_registry import ApiRegistry, COMMENT_API_NAMES, DEFAULT_COMMENT_API_PATH
+from typing import Optional
+import asyncio
+import aiohttp
+import argparse
+import os
+import re
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+# Số request tối đa được chạy đồng thời cho từng loại endpoint
+DEFAULT_ENDPOINT_LIMITS = {
+    "headers": 4,
+    "posts": 1,
+    "comments": 8,
+    "more_comments": 8,
+    "depth1_comments": 16,
+}
+
+class AsyncResponse():
+    '''
+    Response tối giản (status_code, text) để dùng lại được các hàm của Parser.
+    '''
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+class AsyncRequester():
+    def __init__(self, session: aiohttp.ClientSession, max_concurrency: int = 16,
+                 endpoint_limits: Optional[dict] = None):
+        limits = dict(DEFAULT_ENDPOINT_LIMITS)
+        limits.update(endpoint_limits or {})
+
+        self.session = session
+        self._global_semaphore = asyncio.Semaphore(max_concurrency)
+        self._endpoint_semaphores = {name: asyncio.Semaphore(limit) for name, limit in limits.items()}
+
+    async def _request(self, endpoint: str, method: str, url: str, max_retry: int = 3, **kwargs) -> Optional[AsyncResponse]:
+        for attempt in range(max_retry + 1):
+            # Chờ token của RateLimiter trước khi giữ slot để request đang chờ không chiếm chỗ
+            delay = RateLimiter.reserve(endpoint)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            start = time.perf_counter()
+            response = await self._send_once(endpoint, method, url, **kwargs)
+            if response is None:
+                Metrics.record_request(endpoint, "error", time.perf_counter() - start)
+                RateLimiter.on_error(endpoint)
+            else:
+                Metrics.record_request(endpoint, response.status_code, time.perf_counter() - start,
+                                       len(response.text.encode("utf-8")))
+                RateLimiter.on_response(endpoint, response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            if attempt < max_retry:
+                Metrics.record_retry(endpoint, response.status_code if response is not None else "error")
+                await asyncio.sleep(backoff_delay(attempt))
+        return response
+
+    async def _send_once(self, endpoint: str, method: str, url: str, **kwargs) -> Optional[AsyncResponse]:
+        # Giữ slot của endpoint trước rồi mới lấy slot toàn cục để một endpoint
+        # đang chờ không chiếm chỗ của các endpoint khác
+        async with self._endpoint_semaphores[endpoint]:
+            async with self._global_semaphore:
+                try:
+                    async with self.session.request(method, HttpClient.rewrite_url(url), **kwargs) as resp:
+                        text = await resp.text()
+                        if resp.status != 200:
+                            logger.warning(f"Lỗi khi request {endpoint} {resp.status}")
+                        return AsyncResponse(resp.status, text)
+                except Exception as e:
+                    logger.debug(f"Lỗi khi request {endpoint} {e}")
+                    return None
+
+    async def get_headers(self, pageurl: str) -> dict:
+        pageurl = re.sub('www', 'm', pageurl)
+        delay = RateLimiter.reserve("headers")
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with self._endpoint_semaphores["headers"]:
+            async with self._global_semaphore:
+                async with self.session.get(HttpClient.rewrite_url(pageurl)) as resp:
+                    cookies = {key: morsel.value for key, morsel in resp.cookies.items()}
+
+        logger.debug("Lấy headers thành công")
+        return Requester._build_headers(cookies)
+
+    async def get_comments(self, headers: dict, post_id: str, ranking: Ranking, get_post_api: str) -> Optional[AsyncResponse]:
+        data = Requester._build_comments_data(post_id, ranking, get_post_api)
+        return await self._request("comments", "POST", GRAPHQL_URL, data=data, headers=headers)
+
+    async def get_more_comments(self, headers: dict, post_id: str, ranking: Ranking, get_post_api: str, end_cursor: str) -> Optional[AsyncResponse]:
+        data = Requester._build_more_comments_data(post_id, ranking, get_post_api, end_cursor)
+        return await self._request("more_comments", "POST", GRAPHQL_URL, data=data, headers=headers)
+
+    async def get_comments_depth1(self, headers: dict, comment_id: str, expansion_token: str, get_comment_api: str, end_cursor: str = "") -> Optional[AsyncResponse]:
+        data = Requester._build_comments_depth1_data(comment_id, expansion_token, get_comment_api, end_cursor)
+        return await self._request("depth1_comments", "POST", GRAPHQL_URL, data=data, headers=headers)
+
+    async def get_posts(self, headers: dict, time_range: dict, identifier: str, docid: str, cursor: str = "") -> Optional[AsyncResponse]:
+        data = Requester._build_posts_data(time_range, identifier, docid, cursor)
+        return await self._request("posts", "POST", GRAPHQL_URL, data=data, headers=headers)
+
+class AsyncFacebookScraper():
+    '''
+    Chế độ crawl bất đồng bộ: DEPTH01 COMMENT của các parent comment và COMMENT
+    của các post được lấy song song, giới hạn bởi max_concurrency và endpoint_limits.
+    '''
+    def __init__(self, max_concurrency: int = 16, endpoint_limits: Optional[dict] = None,
+                 request_timeout: int = 30, image_workers: int = 4,
+                 bootstrap_cache: Optional[BootstrapCache] = None,
+                 checkpoint_store: Optional[CheckpointStore] = None,
+                 api_registry: Optional[ApiRegistry] = None):
+        self.max_concurrency = max_concurrency
+        self.bootstrap_cache = bootstrap_cache if bootstrap_cache is not None else BootstrapCache()
+        self.checkpoint_store = checkpoint_store if checkpoint_store is not None else CheckpointStore()
+        self.api_registry = api_registry if api_registry is not None else ApiRegistry.shared()
+        self.endpoint_limits = endpoint_limits
+        self.request_timeout = request_timeout
+        self.image_workers = image_workers
+        self.image_downloader = None
+        self.image_report = None
+        self.crawl_stats = None
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        # Dùng chung cấu hình pool keep-alive theo host với HttpClient
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=HttpClient.pool_size)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        # Không lưu cookie giống _BlockAllCookies của HttpClient, cookie chỉ gửi qua headers
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, cookie_jar=aiohttp.DummyCookieJar())
+
+    async def crawl_depth1_comments(self, requester: AsyncRequester, headers: dict, feedback_info: dict,
+                                    reaction_id_info: dict, depth1_comment_api: str,
+                                    max_comment: int = 50, max_retry: int = 3) -> list:
+        comment_info = list()
+        if feedback_info.get('total_count') == 0:
+            return comment_info
+
+        page_info = {
+            'has_next_page': True,
+            'end_cursor': ""
+        }
+        iter = 0
+        retry_count = 0
+        while page_info['has_next_page'] and len(comment_info) < max_comment:
+            try:
+                resp = await requester.get_comments_depth1(headers, feedback_info['id'], feedback_info['expansion_token'],
+                                                           depth1_comment_api, page_info['end_cursor'])
+                data_json = Parser.parse_jsons(resp)[0]
+                comments = await asyncio.to_thread(Parser.parse_depth1_comments, data_json, reaction_id_info,
+                                                   downloader=self.image_downloader)
+                page_info = Parser.parse_depth1_comment_page_info(resp)
+
+                comment_info += list(comments)
+                retry_count = 0
+                self.api_registry.mark_verified({'Depth1CommentsListPaginationQuery': depth1_comment_api})
+            except Exception:
+                logger.debug("Lấy DEPTH01 COMMENT ITER %s thất bại", iter)
+                retry_count += 1
+                if retry_count >= max_retry:
+                    logger.debug(f"Thử lại thất bại")
+                    break
+            iter += 1
+
+        return comment_info
+
+    async def _fill_depth1_comments(self, requester: AsyncRequester, headers: dict, comment: dict,
+                                    reaction_id_info: dict, depth1_comment_api: str, max_comment: int) -> None:
+        feedback_info = comment.get('feedback_info', {})
+        if 'id' not in feedback_info or 'expansion_token' not in feedback_info:
+            return
+        feedback_info['comments'] = await self.crawl_depth1_comments(requester, headers, feedback_info, reaction_id_info,
+                                                                     depth1_comment_api, max_comment=max_comment)
+
+    async def crawl_comment(self, requester: AsyncRequester, post_url: str, feedback_id: str,
+                            ranking: Ranking, reaction_id_info: dict, cmt_api: dict,
+                            max_comment: int = 50, max_depth1_comment: int = 50,
+                            max_retry: int = 3) -> Optional[dict]:
+        try:
+            logger.debug("Thực hiện lấy COMMENT (async): %s", post_url)
+
+            depth1_comment_api = cmt_api['Depth1CommentsListPaginationQuery']
+            headers = await requester.get_headers(post_url)
+
+            resp = await requester.get_comments(headers, feedback_id, ranking, cmt_api['CommentListComponentsRootQuery'])
+            comment_info = await asyncio.to_thread(Parser.parse_comments_info, resp, headers, reaction_id_info,
+                                                   fetch_depth1=False, downloader=self.image_downloader)
+            page_info = Parser.parse_page_info(resp)
+            self.api_registry.mark_verified({'CommentListComponentsRootQuery': cmt_api['CommentListComponentsRootQuery']})
+
+            # Mỗi parent comment vừa parse xong được lấy DEPTH01 COMMENT ngay, không chờ trang kế tiếp
+            depth1_tasks = [
+                asyncio.create_task(self._fill_depth1_comments(requester, headers, comment, reaction_id_info,
+                                                               depth1_comment_api, max_depth1_comment))
+                for comment in comment_info['comments']
+            ]
+
+            more_comment_api = cmt_api['CommentsListComponentsPaginationQuery']
+            iter = 0
+            retry_count = 0
+            while page_info['has_next_page'] and len(comment_info['comments']) < max_comment:
+                try:
+                    resp = await requester.get_more_comments(headers, feedback_id, ranking, more_comment_api,
+                                                             page_info['end_cursor'])
+                    data_json = Parser.parse_jsons(resp)[0]
+                    comments = await asyncio.to_thread(Parser.parse_comments, data_json, headers, reaction_id_info,
+                                                       fetch_depth1=False, downloader=self.image_downloader)
+                    page_info = Parser.parse_page_info(resp)
+
+                    comment_info['comments'] += comments
+                    self.api_registry.mark_verified({'CommentsListComponentsPaginationQuery': more_comment_api})
+                    depth1_tasks += [
+                        asyncio.create_task(self._fill_depth1_comments(requester, headers, comment, reaction_id_info,
+                                                                       depth1_comment_api, max_depth1_comment))
+                        for comment in comments
+                    ]
+                    retry_count = 0
+                except Exception:
+                    logger.debug("Lỗi khi lấy PARENT COMMENT ITER %s", iter)
+                    retry_count += 1
+                    if retry_count >= max_retry:
+                        logger.warning(f"Thất bại khi lấy PARENT COMMENT --- Thử lại lần {retry_count+1} ---")
+                        break
+                iter += 1
+
+            await asyncio.gather(*depth1_tasks)
+            logger.debug("Lấy PARENT COMMENT thành công %s", post_url)
+            return comment_info
+        except Exception as e:
+            logger.error(f"Lỗi khi lấy PARENT COMMENT {e}")
+            return None
+
+    async def _crawl_post_comments(self, requester: AsyncRequester, page_url: str, post_info: dict, ranking: Ranking,
+                                   reaction_id_info: dict, cmt_api: dict, sink: JsonlSink, all_posts: Optional[list],
+                                   max_parent_comment: int, max_depth1_comment: int) -> None:
+        post_info['comments'] = await self.crawl_comment(requester, post_info['post_url'], post_info['feedback_id'],
+                                                         ranking, reaction_id_info, cmt_api,
+                                                         max_comment=max_parent_comment,
+                                                         max_depth1_comment=max_depth1_comment)
+        self._write_post(page_url, post_info, sink, all_posts)
+
+    def _write_post(self, page_url: str, post_info: dict, sink: JsonlSink, all_posts: Optional[list]) -> None:
+        sink.write(post_info)
+        self.checkpoint_store.mark_seen(page_url, post_info)
+        n_comments = Utils.count_comments(post_info.get('comments'))
+        self.crawl_stats['posts'] += 1
+        self.crawl_stats['comments'] += n_comments
+        Metrics.inc("crawler_posts_total")
+        Metrics.inc("crawler_comments_total", n_comments)
+        if all_posts is not None:
+            all_posts.append(post_info)
+
+    def _save_finished_pages(self, page_url: str, window: str, pending_pages: list, n_saved_posts: int) -> None:
+        '''
+        Chỉ lưu cursor của trang khi comment của mọi post tới trang đó đã được ghi,
+        tránh mất post nếu chương trình dừng trong lúc comment còn đang chạy.
+        '''
+        while pending_pages and all(task.done() for task in pending_pages[0][1]):
+            page_info, _ = pending_pages.pop(0)
+            self.checkpoint_store.save_page_info(page_url, window, page_info, n_saved_posts + self.crawl_stats['posts'])
+
+    async def crawl_post(self, page_url: str, after_time: str = None, before_time: str = None,
+                         ranking_comment: Ranking = Ranking.MOST_RELEVANT, include_comment: bool = True,
+                         save_dir: str = "data\\image", max_post: int = 10,
+                         comment_api_path: str = DEFAULT_COMMENT_API_PATH,
+                         return_posts: bool = False,
+                         max_parent_comment: int = 50, max_depth1_comment: int = 50,
+                         output_dir: str = "data/json",
+                         resume: bool = True, incremental: bool = False,
+                         output_max_bytes: Optional[int] = None, output_max_seconds: Optional[int] = None,
+                         output_compression: Optional[str] = None):
+        logger.debug(f"----------------Chương trình lấy post (async)---------------")
+        headers, bootstrap, _ = await asyncio.to_thread(FacebookScraper._get_page_api_info, page_url, self.bootstrap_cache)
+        identifier, post_api = bootstrap['identifier'], bootstrap['post_api']
+        reaction_id = bootstrap['reaction_ids']
+        time_range, page_info = Utils.init_requests_variables(after_time, before_time)
+        cmt_api = self.api_registry.require(COMMENT_API_NAMES, comment_api_path)
+
+        window = CheckpointStore.window_key(after_time, before_time)
+        n_saved_posts = 0
+        saved_page_info = self.checkpoint_store.get_page_info(page_url, window) if resume else None
+        if saved_page_info is not None and saved_page_info['has_next_page']:
+            logger.debug(f"Tiếp tục từ cursor đã lưu, đã lấy {saved_page_info['n_posts']} post")
+            page_info = {'has_next_page': True, 'end_cursor': saved_page_info['end_cursor']}
+            n_saved_posts = saved_page_info['n_posts']
+        # Đang đi tiếp từ cursor cũ (backfill dở) thì chưa tới phần đã lấy, không dừng theo mốc incremental
+        resuming = saved_page_info is not None and saved_page_info['has_next_page']
+        newest_time = None
+        if incremental and not resuming:
+            newest_time = self.checkpoint_store.newest_creation_time(page_url, time_range['after_time'], time_range['before_time'])
+
+        # Post chỉ được giữ lại trong bộ nhớ khi cần trả về
+        all_posts = [] if return_posts else None
+        self.crawl_stats = {'posts': 0, 'comments': 0, 'files': []}
+        os.makedirs(save_dir, exist_ok=True)
+
+        fanpage_name = page_url.rstrip('/').split('/')[-1] or "unknown"
+        file_jsonl_path = os.path.join(output_dir, f"posts_{fanpage_name}_{before_time}.jsonl")
+        sink = JsonlSink(file_jsonl_path, max_bytes=output_max_bytes, max_seconds=output_max_seconds,
+                         compression=output_compression)
+
+        max_retry = 3
+        n_iter = Utils.n_post2n_iter(max(max_post - n_saved_posts, 0))
+
+        retry_count = 0
+        comment_tasks = []
+        # (page_info, task comment của trang) chờ lưu vào checkpoint store
+        pending_pages = []
+
+        self.image_downloader = ImageDownloader(n_workers=self.image_workers)
+        try:
+            async with self._new_session() as session:
+                requester = AsyncRequester(session, self.max_concurrency, self.endpoint_limits)
+
+                for round_idx in range(n_iter):
+                    logger.debug(f"--- ITER {round_idx+1} ---")
+                    if not page_info['has_next_page']:
+                        break
+
+                    resp = await requester.get_posts(headers, time_range, identifier, post_api, page_info['end_cursor'])
+                    if not resp or resp.status_code != 200:
+                        logger.warning(f"Lỗi khi gửi request lấy post {resp.status_code if resp else 'No response'}")
+                        break
+
+                    resp_jsons = Parser.parse_jsons(resp)
+                    reached_known = False
+                    page_tasks = []
+                    for idx, json in enumerate(resp_jsons):
+                        try:
+                            fields = Parser.extract_post_fields(json)
+                            post_url = fields['post_url']
+                            if post_url is None:
+                                continue
+
+                            creation_time = fields['creation_time']
+                            reached_known = newest_time is not None and creation_time is not None and creation_time <= newest_time
+                            if self.checkpoint_store.is_seen(page_url, post_url):
+                                logger.debug("Bỏ qua post đã lấy %s", post_url)
+                                continue
+
+                            post_info = await asyncio.to_thread(Parser.parse_post_obj, json, save_dir, self.image_downloader, fields)
+                            if post_info == {}:
+                                continue
+
+                            if include_comment:
+                                # Comment của các post được crawl song song trong khi tiếp tục phân trang post
+                                page_tasks.append(asyncio.create_task(
+                                    self._crawl_post_comments(requester, page_url, post_info, ranking_comment, reaction_id,
+                                                              cmt_api, sink, all_posts,
+                                                              max_parent_comment, max_depth1_comment)))
+                            else:
+                                self._write_post(page_url, post_info, sink, all_posts)
+                        except Exception as e:
+                            logger.warning(f"Lỗi dòng: {e}")
+                    comment_tasks += page_tasks
+
+                    new_page_info = Parser.parse_post_page_info(resp_jsons)
+                    if new_page_info == {}:
+                        retry_count += 1
+                        if retry_count >= max_retry:
+                            logger.warning(f"Thất bại khi lấy PageInfo --- Thử lại lần {retry_count+1} ---")
+                            break
+                    else:
+                        retry_count = 0
+                        page_info = new_page_info
+                        if reached_known:
+                            logger.debug(f"Đã tới post cũ hơn post mới nhất đã lưu, dừng phân trang")
+                            page_info = {'has_next_page': False, 'end_cursor': ""}
+                        pending_pages.append((page_info, page_tasks))
+                    self._save_finished_pages(page_url, window, pending_pages, n_saved_posts)
+
+                await asyncio.gather(*comment_tasks)
+                self._save_finished_pages(page_url, window, pending_pages, n_saved_posts)
+        finally:
+            sink.close()
+            self.crawl_stats['files'] = sink.files
+            self.api_registry.flush()
+            self.image_report = await asyncio.to_thread(self.image_downloader.close)
+            self.image_downloader = None
+            logger.debug(f"Báo cáo tải ảnh: {self.image_report}")
+
+        logger.debug(f"Đã lưu {self.crawl_stats['posts']} post vào {sink.files}")
+
+        if return_posts:
+            return all_posts
+
+def parse_endpoint_limits(values: list[str]) -> dict:
+    limits = dict()
+    for value in values or []:
+        name, limit = value.split('=')
+        if name not in DEFAULT_ENDPOINT_LIMITS:
+            raise ValueError(f"Endpoint không hợp lệ: {name}")
+        limits[name] = int(limit)
+    return limits
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chương trình lấy FACEBOOK POST ở chế độ async")
+    parser.add_argument("page_url", help="URL của fanpage cần lấy post")
+    parser.add_argument("--after-time", default=None, help="Định dạng %%Y-%%m-%%d_%%H-%%M-%%S")
+    parser.add_argument("--before-time", default=None, help="Định dạng %%Y-%%m-%%d_%%H-%%M-%%S")
+    parser.add_argument("--max-post", type=int, default=300)
+    parser.add_argument("--max-parent-comment", type=int, default=20)
+    parser.add_argument("--max-depth1-comment", type=int, default=30)
+    parser.add_argument("--max-concurrency", type=int, default=16, help="Số request đồng thời tối đa")
+    parser.add_argument("--limit", action="append", metavar="ENDPOINT=N",
+                        help=f"Giới hạn đồng thời cho từng endpoint: {', '.join(DEFAULT_ENDPOINT_LIMITS)}")
+    parser.add_argument("--incremental", action="store_true", help="Dừng khi gặp post cũ hơn post mới nhất đã lưu trong khung thời gian")
+    parser.add_argument("--no-resume", action="store_true", help="Không tiếp tục từ cursor đã lưu")
+    parser.add_argument("--comment-api", default=DEFAULT_COMMENT_API_PATH,
+                        help="File doc_id API comment, đủ API thì dùng nguyên bộ trong file thay vì api_info.json")
+    parser.add_argument("--image-max-side", type=int, default=None,
+                        help="Tạo bản thu nhỏ cho ảnh tải về, cạnh dài tối đa bằng số px này (ví dụ 1024)")
+    parser.add_argument("--image-format", choices=["webp", "jpeg"], default="webp")
+    parser.add_argument("--drop-original-images", action="store_true",
+                        help="Chỉ giữ bản thu nhỏ của ảnh, JSON ghi đường dẫn theo đuôi bản thu nhỏ (.webp/.jpg). "
+                             "Đường dẫn .jpg/.png trong JSON của các lần crawl trước sẽ không còn tồn tại")
+    args = parser.parse_args()
+
+    if args.image_max_side:
+        ImageStore.configure_derivatives(args.image_max_side, args.image_format,
+                                         keep_originals=not args.drop_original_images)
+
+    scraper = AsyncFacebookScraper(max_concurrency=args.max_concurrency,
+                                   endpoint_limits=parse_endpoint_limits(args.limit))
+    time1 = time.time()
+    asyncio.run(scraper.crawl_post(args.page_url, after_time=args.after_time, before_time=args.before_time,
+                                   max_post=args.max_post, ranking_comment=Ranking.MOST_RELEVANT,
+                                   comment_api_path=args.comment_api,
+                                   max_parent_comment=args.max_parent_comment,
+                                   max_depth1_comment=args.max_depth1_comment,
+                                   resume=not args.no_resume, incremental=args.incremental))
+    time2 = time.time()
+
+    print(f"Thời gian thực hiện: {time2 - time1} giây")
+    logger.debug(f"Thời gian thực hiện: {time2 - time1} giây")
@@ -0,0 +1,109 @@
+from logger import setup_logger
+from facebook_scraper import FacebookScraper
+from async_scraper import AsyncFacebookScraper
+from bootstrap_cache import BootstrapCache
+from checkpoint_store import CheckpointStore
+from http_client import HttpClient
+from rate_limiter import RateLimiter, DEFAULT_RATES
+from metrics import Metrics
+from replay import ReplayServer, DEFAULT_FIXTURE_DIR
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+def run_benchmark(page_url: str, fixture_dir: str = DEFAULT_FIXTURE_DIR, mode: str = "sync",
+                  max_post: int = 30, max_parent_comment: int = 20, max_depth1_comment: int = 30,
+                  latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                  unthrottled: bool = True, comment_api_path: str = "./api_info/comment_api.json") -> dict:
+    '''
+    Chạy crawl_post với replay server cục bộ và đo post/s, comment/s, bộ nhớ đỉnh (tracemalloc).
+    '''
+    tmp_dir = tempfile.mkdtemp(prefix="crawl-bench-")
+    # Cache và checkpoint mới cho mỗi lần chạy để các lần đo giống nhau
+    bootstrap_cache = BootstrapCache(os.path.join(tmp_dir, "bootstrap.json"))
+    checkpoint_store = CheckpointStore(os.path.join(tmp_dir, "checkpoints.sqlite"))
+    crawl_kwargs = dict(max_post=max_post, max_parent_comment=max_parent_comment,
+                        max_depth1_comment=max_depth1_comment, comment_api_path=comment_api_path,
+                        save_dir=os.path.join(tmp_dir, "image"), output_dir=os.path.join(tmp_dir, "json"))
+
+    if unthrottled:
+        # Đo tốc độ của bản thân crawler, không để RateLimiter giới hạn
+        RateLimiter.configure({endpoint: 1000.0 for endpoint in DEFAULT_RATES})
+
+    with ReplayServer(fixture_dir, latency=latency, jitter=jitter, error_rate=error_rate) as server:
+        HttpClient.set_replay(server.url)
+        Metrics.reset()
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            if mode == "async":
+                scraper = AsyncFacebookScraper(bootstrap_cache=bootstrap_cache, checkpoint_store=checkpoint_store)
+                asyncio.run(scraper.crawl_post(page_url, **crawl_kwargs))
+            else:
+                scraper = FacebookScraper(bootstrap_cache=bootstrap_cache, checkpoint_store=checkpoint_store)
+                scraper.crawl_post(page_url, **crawl_kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            HttpClient.set_replay(None)
+            if unthrottled:
+                RateLimiter.configure()
+
+        stats = scraper.crawl_stats
+        return {
+            "mode": mode,
+            "seconds": elapsed,
+            "posts": stats['posts'],
+            "comments": stats['comments'],
+            "posts_per_second": stats['posts'] / elapsed if elapsed > 0 else 0.0,
+            "comments_per_second": stats['comments'] / elapsed if elapsed > 0 else 0.0,
+            "peak_memory_mb": peak / (1024 * 1024),
+            "server_requests": server.n_requests,
+            "server_missing": server.n_missing,
+            "server_errors": server.n_errors,
+            "endpoints": Metrics.summary()['endpoints'],
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crawler với replay server cục bộ")
+    parser.add_argument("page_url", help="URL page đã được ghi lại bằng replay.py record")
+    parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--max-post", type=int, default=30)
+    parser.add_argument("--max-parent-comment", type=int, default=20)
+    parser.add_argument("--max-depth1-comment", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ mỗi request của replay server (giây)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttled", action="store_true", help="Giữ nguyên RateLimiter như khi crawl thật")
+    parser.add_argument("--comment-api", default="./api_info/comment_api.json")
+    parser.add_argument("--output", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    results = []
+    for run_idx in range(args.repeat):
+        result = run_benchmark(args.page_url, fixture_dir=args.fixture_dir, mode=args.mode,
+                               max_post=args.max_post, max_parent_comment=args.max_parent_comment,
+                               max_depth1_comment=args.max_depth1_comment, latency=args.latency,
+                               jitter=args.jitter, error_rate=args.error_rate,
+                               unthrottled=not args.throttled, comment_api_path=args.comment_api)
+        results.append(result)
+        print(f"[{run_idx + 1}/{args.repeat}] {result['seconds']:.2f}s - "
+              f"{result['posts']} post ({result['posts_per_second']:.2f}/s), "
+              f"{result['comments']} comment ({result['comments_per_second']:.2f}/s), "
+              f"peak {result['peak_memory_mb']:.1f} MB, {result['server_requests']} request "
+              f"({result['server_missing']} thiếu fixture, {result['server_errors']} lỗi giả lập)")
+        logger.debug(f"Kết quả benchmark: {result}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=4)
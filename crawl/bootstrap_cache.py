@@ -0,0 +1,95 @@
+from logger import setup_logger
+from filelock import FileLock
+from typing import Optional
+import json
+import os
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_CACHE_PATH = "./api_info/bootstrap_cache.json"
+# doc_id và entryPoint của Facebook thay đổi theo đợt deploy, vài giờ là đủ an toàn
+DEFAULT_TTL = 6 * 60 * 60
+
+class BootstrapCache():
+    '''
+    Cache lưu trên đĩa cho thông tin khởi tạo của từng page (entryPoint, identifier,
+    doc_id lấy post, reaction ids), tránh lặp lại homepage + preload script + request post
+    đầu tiên ở mỗi lần crawl. Mỗi mục hết hạn sau ttl giây. Nhiều process dùng chung file:
+    mỗi lần ghi đều đọc lại và gộp với bản trên đĩa dưới file lock.
+    '''
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: int = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._entries = self._load()
+
+    @staticmethod
+    def _key(page_url: str) -> str:
+        return page_url.strip().rstrip('/').lower()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except Exception as e:
+            logger.warning(f"Không đọc được bootstrap cache {self.path} {e}")
+            return {}
+
+    def _merge_from_disk(self) -> None:
+        # Giữ mục mới hơn giữa bộ nhớ và file, process khác có thể vừa bootstrap page khác
+        for key, entry in self._load().items():
+            if entry.get('fetched_at', 0) > self._entries.get(key, {}).get('fetched_at', -1):
+                self._entries[key] = entry
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self._entries, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def _update(self, key: str, entry: Optional[dict]) -> None:
+        '''
+        Đọc lại file, gộp, rồi mới đặt (entry) hoặc xoá (entry=None) mục key và ghi xuống.
+        '''
+        with self._lock, self._file_lock:
+            self._merge_from_disk()
+            if entry is not None:
+                self._entries[key] = entry
+            elif self._entries.pop(key, None) is None:
+                return
+            self._save()
+
+    def get(self, page_url: str) -> Optional[dict]:
+        key = BootstrapCache._key(page_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry.get('fetched_at', 0) > self.ttl:
+                # Có thể process khác vừa lưu bản mới hơn
+                with self._file_lock:
+                    self._merge_from_disk()
+                entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.get('fetched_at', 0) > self.ttl:
+            logger.debug(f"Bootstrap cache của {page_url} đã hết hạn")
+            return None
+
+        logger.debug(f"Dùng bootstrap cache cho {page_url}")
+        return entry
+
+    def set(self, page_url: str, info: dict) -> None:
+        entry = dict(info)
+        entry['fetched_at'] = int(time.time())
+        self._update(BootstrapCache._key(page_url), entry)
+        logger.debug(f"Lưu bootstrap cache cho {page_url}")
+
+    def invalidate(self, page_url: str) -> None:
+        self._update(BootstrapCache._key(page_url), None)
+        logger.debug(f"Xoá bootstrap cache của {page_url}")
@@ -0,0 +1,122 @@
+from logger import setup_logger
+from typing import Optional
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_CHECKPOINT_PATH = "./api_info/checkpoints.sqlite"
+
+class CheckpointStore():
+    '''
+    Lưu tiến độ crawl trên SQLite: cursor phân trang của từng (page, khung thời gian)
+    và danh sách post đã lấy của từng page kèm creation_time. Nhờ đó lượt crawl bị dừng
+    giữa chừng có thể chạy tiếp từ cursor cuối, và lượt crawl định kỳ bỏ qua post đã có.
+    '''
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL cho phép nhiều process của orchestrator cùng đọc/ghi một file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_state (
+                    page_key TEXT NOT NULL,
+                    window TEXT NOT NULL,
+                    end_cursor TEXT,
+                    has_next_page INTEGER NOT NULL,
+                    n_posts INTEGER NOT NULL DEFAULT 0,
+                    updated_at INTEGER NOT NULL,
+                    PRIMARY KEY (page_key, window)
+                )''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS seen_posts (
+                    page_key TEXT NOT NULL,
+                    post_url TEXT NOT NULL,
+                    feedback_id TEXT,
+                    creation_time INTEGER,
+                    seen_at INTEGER NOT NULL,
+                    PRIMARY KEY (page_key, post_url)
+                )''')
+            self._conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_seen_posts_time
+                ON seen_posts (page_key, creation_time)''')
+
+    @staticmethod
+    def page_key(page_url: str) -> str:
+        return page_url.strip().rstrip('/').lower()
+
+    @staticmethod
+    def window_key(after_time: Optional[str], before_time: Optional[str]) -> str:
+        return f"{after_time or 'begin'}__{before_time or 'now'}"
+
+    def get_page_info(self, page_url: str, window: str) -> Optional[dict]:
+        '''
+        Trả về page_info (has_next_page, end_cursor) đã lưu của khung thời gian, None nếu chưa có.
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT end_cursor, has_next_page, n_posts FROM crawl_state WHERE page_key = ? AND window = ?",
+                (CheckpointStore.page_key(page_url), window)).fetchone()
+        if row is None:
+            return None
+        return {'end_cursor': row[0] or "", 'has_next_page': bool(row[1]), 'n_posts': row[2]}
+
+    def save_page_info(self, page_url: str, window: str, page_info: dict, n_posts: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO crawl_state (page_key, window, end_cursor, has_next_page, n_posts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (page_key, window) DO UPDATE SET
+                    end_cursor = excluded.end_cursor,
+                    has_next_page = excluded.has_next_page,
+                    n_posts = excluded.n_posts,
+                    updated_at = excluded.updated_at''',
+                (CheckpointStore.page_key(page_url), window, page_info.get('end_cursor') or "",
+                 int(bool(page_info.get('has_next_page'))), n_posts, int(time.time())))
+
+    def reset_page_info(self, page_url: str, window: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM crawl_state WHERE page_key = ? AND window = ?",
+                               (CheckpointStore.page_key(page_url), window))
+
+    def is_seen(self, page_url: str, post_url: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM seen_posts WHERE page_key = ? AND post_url = ?",
+                                     (CheckpointStore.page_key(page_url), post_url)).fetchone()
+        return row is not None
+
+    def mark_seen(self, page_url: str, post_info: dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO seen_posts (page_key, post_url, feedback_id, creation_time, seen_at)
+                VALUES (?, ?, ?, ?, ?)''',
+                (CheckpointStore.page_key(page_url), post_info['post_url'], post_info.get('feedback_id'),
+                 post_info.get('creation_time'), int(time.time())))
+
+    def newest_creation_time(self, page_url: str, after_time: int = 0, before_time: Optional[int] = None) -> Optional[int]:
+        '''
+        Post mới nhất đã lưu của page trong khung thời gian [after_time, before_time): post của khung
+        mới hơn không được làm mốc dừng cho lượt crawl khung cũ hơn.
+        '''
+        query = "SELECT MAX(creation_time) FROM seen_posts WHERE page_key = ? AND creation_time >= ?"
+        params = [CheckpointStore.page_key(page_url), after_time]
+        if before_time is not None:
+            query += " AND creation_time < ?"
+            params.append(before_time)
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
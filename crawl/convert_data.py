@@ -1,17 +1,27 @@
+from logger import setup_logger
+from output_sink import JsonlSink, iter_jsonl, COMPRESSION_SUFFIXES
+from thread_store import ThreadStoreWriter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, Optional
+import argparse
+import glob
 import json
 import os
+import sys
+import logging
 
-input_path = "data/json/posts_K14vn.json"
-output_path = input_path.replace("posts_K14vn.json", "posts_K14vn_final_converted.json")
+logger = setup_logger(__name__, logging.DEBUG)
 
-if not os.path.exists(output_path):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+# Output của crawl_post là JSONL (có thể đã xoay file hoặc nén .gz/.zst)
+DEFAULT_INPUT = "data/json/posts_K14vn_None.jsonl"
+CONVERTED_SUFFIX = "_converted.jsonl"
+THREADS_SUFFIX = "_threads"
 
 def get_image_descriptions(image_paths):
     # Placeholder, bạn sẽ gọi Gemini API để sinh description cho từng ảnh
     return [{"path": path, "image_description": ""} for path in (image_paths or [])]
 
-def process_comment(comment, parent_texts=None, parent_images=None):
+def process_comment(comment, parent_texts=None, parent_images=None) -> Iterator[dict]:
     if parent_texts is None:
         parent_texts = []
     if parent_images is None:
@@ -25,7 +35,7 @@ def process_comment(comment, parent_texts=None, parent_images=None):
     parent_image_descriptions = [{"path": img, "image_description": ""} for img in parent_images]
 
     # Data point cho comment hiện tại
-    comment_datapoint = {
+    yield {
         "Persons": [],
         "Aspect_1": "",
         "Aspect_2": "",
@@ -40,21 +50,14 @@ def process_comment(comment, parent_texts=None, parent_images=None):
 
     # Đệ quy cho comment con, truyền mảng cha tăng dần
     feedback_info = comment.get("feedback_info", {})
-    children = []
     for child in feedback_info.get("comments", []):
-        children.extend(process_comment(
+        yield from process_comment(
             child,
             parent_texts + [comment.get("text")],
             parent_images + comment_images
-        ))
-    return [comment_datapoint] + children
+        )
 
-with open(input_path, "r", encoding="utf-8") as f:
-    data = json.load(f)
-
-output = []
-
-for post in data:
+def convert_post(post: dict) -> dict:
     post_images = post.get("image_paths", [])
     post_image_descriptions = get_image_descriptions(post_images)
 
@@ -69,12 +72,115 @@ for post in data:
         "post_url": post.get("post_url"),
         "comments": []
     }
-    comments = post.get("comments", {}).get("comments", [])
+    comments = (post.get("comments") or {}).get("comments", [])
     for comment in comments:
         post_dict["comments"].extend(process_comment(comment))
-    output.append(post_dict)
+    return post_dict
+
+def iter_posts(input_path: str) -> Iterator[dict]:
+    # File .json cũ (một mảng) vẫn phải load cả file, JSONL thì đọc từng dòng
+    if input_path.endswith(".json"):
+        with open(input_path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+    else:
+        yield from iter_jsonl(input_path)
+
+def output_path_for(input_path: str, output_dir: Optional[str] = None) -> str:
+    name = os.path.basename(input_path)
+    for suffix in (".gz", ".zst"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    name = os.path.splitext(name)[0]
+    return os.path.join(output_dir or os.path.dirname(input_path), f"{name}{CONVERTED_SUFFIX}")
+
+def convert_file_normalized(input_path: str, output_dir: Optional[str] = None, compression: Optional[str] = None,
+                            image_dir: str = "data/image") -> dict:
+    '''
+    Ghi dạng chuẩn hoá (posts/comments/images, xem thread_store.py) vào thư mục <tên>_threads.
+    '''
+    threads_dir = output_path_for(input_path, output_dir)[:-len(CONVERTED_SUFFIX)] + THREADS_SUFFIX
+    n_posts, n_comments = 0, 0
+    with ThreadStoreWriter(threads_dir, image_dir=image_dir, compression=compression) as writer:
+        for post in iter_posts(input_path):
+            n_comments += writer.add_post(post)
+            n_posts += 1
+    logger.debug(f"Chuyển {input_path} -> {threads_dir}: {n_posts} post, {n_comments} comment")
+    return {"input": input_path, "output": threads_dir, "posts": n_posts, "comments": n_comments}
+
+def convert_file(input_path: str, output_dir: Optional[str] = None, compression: Optional[str] = None) -> dict:
+    '''
+    Chuyển một file output của crawler thành JSONL các post đã làm phẳng comment,
+    mỗi lần chỉ giữ một post trong bộ nhớ.
+    '''
+    output_path = output_path_for(input_path, output_dir)
+    final_path = f"{output_path}{COMPRESSION_SUFFIXES[compression]}"
+    # JsonlSink ghi nối tiếp, chạy lại thì phải xoá kết quả cũ
+    if os.path.exists(final_path):
+        os.remove(final_path)
+    n_posts, n_comments = 0, 0
+    with JsonlSink(output_path, compression=compression, flush_each_record=False) as sink:
+        for post in iter_posts(input_path):
+            post_dict = convert_post(post)
+            sink.write(post_dict)
+            n_posts += 1
+            n_comments += len(post_dict["comments"])
+    logger.debug(f"Chuyển {input_path} -> {sink.files}: {n_posts} post, {n_comments} comment")
+    return {"input": input_path, "output": final_path,
+            "posts": n_posts, "comments": n_comments}
+
+def expand_inputs(patterns: list[str]) -> list[str]:
+    # Tự mở rộng glob vì shell trên Windows không làm việc này
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        # Bỏ qua output của lần chuyển trước khi glob khớp cả chúng
+        paths.extend(path for path in matches
+                     if CONVERTED_SUFFIX not in os.path.basename(path) and not os.path.isdir(path))
+    return paths
+
+def convert_files(input_paths: list[str], output_dir: Optional[str] = None, compression: Optional[str] = None,
+                  workers: Optional[int] = None, normalized: bool = False) -> list[dict]:
+    '''
+    Chuyển nhiều file song song, mỗi file một process. File lỗi được ghi log và bỏ qua,
+    không có trong kết quả trả về.
+    '''
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    convert = convert_file_normalized if normalized else convert_file
+    workers = min(workers or os.cpu_count() or 1, len(input_paths)) or 1
+    results = []
+    if workers == 1:
+        for path in input_paths:
+            try:
+                results.append(convert(path, output_dir, compression))
+            except Exception as e:
+                logger.error(f"Lỗi khi chuyển {path} {e}")
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert, path, output_dir, compression): path for path in input_paths}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Lỗi khi chuyển {futures[future]} {e}")
+    return results
 
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(output, f, ensure_ascii=False, indent=2)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Làm phẳng comment trong output của crawler thành datapoint")
+    parser.add_argument("inputs", nargs="*", default=[DEFAULT_INPUT],
+                        help="File JSONL/JSON (.gz, .zst) hoặc glob, ví dụ data/json/posts_*.jsonl*")
+    parser.add_argument("--output-dir", default=None, help="Mặc định ghi cạnh file input")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Số process, mặc định bằng số core")
+    parser.add_argument("--normalized", action="store_true",
+                        help="Ghi posts/comments/images chuẩn hoá thay vì datapoint đã làm phẳng")
+    args = parser.parse_args()
 
-print(f"Đã chuyển đổi xong, lưu tại {output_path}")
\ No newline at end of file
+    input_paths = expand_inputs(args.inputs)
+    results = convert_files(input_paths, args.output_dir, args.compression, args.workers, args.normalized)
+    for result in results:
+        print(f"{result['input']} -> {result['output']}: {result['posts']} post, {result['comments']} comment")
+    print(f"Đã chuyển đổi xong {len(results)}/{len(input_paths)} file")
+    if len(results) < len(input_paths):
+        sys.exit(1)
@@ -7,8 +7,11 @@ from selenium_stealth import stealth
 import undetected_chromedriver as uc
 from parser import Parser 
 from utils import Utils
+from api_registry import ApiRegistry
 from logger import setup_logger
+from typing import Optional
 import random
+import threading
 import time
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.remote.webelement import WebElement
@@ -16,14 +19,55 @@ import logging
 
 logger = setup_logger(__name__, logging.DEBUG)
 
+# Tài nguyên không cần tải khi chỉ bắt request GraphQL để lấy doc_id
+BLOCKED_RESOURCE_URLS = ["*.css", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+                         "*.woff", "*.woff2", "*.ttf", "*.mp4"]
+# Request chạy lâu hơn số giây này (long-polling, kết nối chat) không tính khi chờ mạng rảnh
+LONG_POLL_SECONDS = 5
+
+# Gắn MutationObserver rồi mới cuộn, trả về số node mới ngay khi DOM thay đổi (0 nếu hết thời gian)
+SCROLL_AND_OBSERVE_SCRIPT = '''
+    const target = arguments[0];
+    const pixels = arguments[1];
+    const timeoutMs = arguments[2];
+    const done = arguments[arguments.length - 1];
+    let timer = null;
+    const observer = new MutationObserver((mutations) => {
+        let added = 0;
+        for (const m of mutations) added += m.addedNodes.length;
+        if (added > 0) {
+            observer.disconnect();
+            clearTimeout(timer);
+            done(added);
+        }
+    });
+    observer.observe(target || document.body, {childList: true, subtree: true});
+    timer = setTimeout(() => { observer.disconnect(); done(0); }, timeoutMs);
+    if (pixels) {
+        if (target) { target.scrollBy(0, pixels); } else { window.scrollBy(0, pixels); }
+    }
+'''
+
 class ControllerDriver:
-    def __init__(self):
+    def __init__(self, api_info_path: str = "./api_info/api_info.json", reset_api_info: bool = True,
+                 api_registry: Optional[ApiRegistry] = None):
         self.driver = None
-        self.api_info_path = "./api_info/api_info.json"
-        if Utils.file_exists(self.api_info_path):
+        self.browser = None
+        self.tab = None
+        self.debug_port = None
+        self.api_info_path = api_info_path
+        # Trạng thái mạng lấy từ sự kiện Network của DevTools
+        self.captured_apis = dict()
+        self._inflight = dict()
+        self._last_network_activity = time.monotonic()
+        self._network_cond = threading.Condition()
+        if reset_api_info and Utils.file_exists(self.api_info_path):
             Utils.del_json(self.api_info_path)
+        # Các driver trong DriverPool dùng chung một registry
+        self.api_registry = api_registry if api_registry is not None else ApiRegistry(api_info_path)
     
-    def start_controller(self) -> webdriver.Chrome:
+    def start_controller(self, headless: bool = False, debug_port: int = 9222,
+                         block_resources: bool = False) -> webdriver.Chrome:
         # Khởi động driver Selenium
         chrome_options = uc.ChromeOptions()
 
@@ -33,19 +77,32 @@ class ControllerDriver:
         # Đảm bảo trình duyệt không bị phát hiện là Selenium Bot
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")  # Ẩn các đặc tính kiểm tra tự động
         chrome_options.add_argument('--disable-infobars')  # Tắt thông báo trên trình duyệt (ví dụ: "Chrome đang được điều khiển bởi một chương trình tự động")
-        chrome_options.add_argument("--remote-debugging-port=9222")  # Cho phép remote debugging (có thể tắt nếu không cần)
+        # Cho phép remote debugging, mỗi driver trong DriverPool dùng một cổng riêng
+        chrome_options.add_argument(f"--remote-debugging-port={debug_port}")
+        if headless:
+            chrome_options.add_argument("--headless=new")
+            chrome_options.add_argument("--window-size=1366,768")
+        if block_resources:
+            chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+            chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
         
         self.driver = webdriver.Chrome(options=chrome_options)
-        logger.debug("Khởi động chrome driver thành công")
+        self.debug_port = debug_port
+        logger.debug(f"Khởi động chrome driver thành công (cổng {debug_port}, headless={headless})")
 
         # Khởi tạo DevTools client
-        self.browser = pychrome.Browser(url="http://127.0.0.1:9222")
+        self.browser = pychrome.Browser(url=f"http://127.0.0.1:{debug_port}")
         self.tab = self.browser.list_tab()[0]
         self.tab.start()
         self.tab.Network.enable(includeResponseBodies=True)
+        if block_resources:
+            # Chặn CSS, ảnh, font ngay ở tầng mạng để trang load nhanh hơn
+            self.tab.Network.setBlockedURLs(urls=BLOCKED_RESOURCE_URLS)
         
 
         self.tab.Network.requestWillBeSent = self.handle_request
+        self.tab.Network.loadingFinished = self.handle_loading_done
+        self.tab.Network.loadingFailed = self.handle_loading_done
         return self.driver
 
     def handle_request(self, **kwargs) -> None:
@@ -54,16 +111,106 @@ class ControllerDriver:
             url = request.get('url')
             method = request.get('method')
             payload = request.get('postData')
-            if "graphql" in url:
+            with self._network_cond:
+                self._inflight[kwargs.get('requestId')] = time.monotonic()
+                self._last_network_activity = time.monotonic()
+            if "graphql" in url and payload:
                 logger.debug("Tìm thấy api graphql")
                 graphql_api = Parser._get_api_value(payload)
-                Utils.check_and_add_api(self.api_info_path, graphql_api)
+                self.api_registry.add(*graphql_api)
+                with self._network_cond:
+                    self.captured_apis[graphql_api[0]] = graphql_api[1]
+                    self._network_cond.notify_all()
         except Exception as e:
             if self.is_driver_alive() == False:
                 logger.debug("Driver đã đóng")
             else:
                 raise Exception(f"Lỗi khi lấy api {e}")
 
+    def handle_loading_done(self, **kwargs) -> None:
+        with self._network_cond:
+            self._inflight.pop(kwargs.get('requestId'), None)
+            self._last_network_activity = time.monotonic()
+            self._network_cond.notify_all()
+
+    def reset_captured_apis(self) -> None:
+        with self._network_cond:
+            self.captured_apis = dict()
+
+    def has_apis(self, api_names: list[str]) -> bool:
+        with self._network_cond:
+            return all(api_name in self.captured_apis for api_name in api_names)
+
+    def wait_for_apis(self, api_names: list[str], timeout: float = 10) -> bool:
+        """
+        Chờ đến khi các API GraphQL xuất hiện trong request mà DevTools bắt được,
+        trả về ngay khi đủ (không đọc lại api_info.json).
+        """
+        with self._network_cond:
+            found = self._network_cond.wait_for(
+                lambda: all(api_name in self.captured_apis for api_name in api_names), timeout)
+        if found:
+            logger.debug(f"Đã bắt được {api_names}")
+        return found
+
+    def _n_active_requests(self, now: float) -> int:
+        return sum(1 for started_at in self._inflight.values() if now - started_at < LONG_POLL_SECONDS)
+
+    def wait_for_network_idle(self, idle_time: float = 0.5, timeout: float = 10, max_inflight: int = 0) -> bool:
+        """
+        Chờ đến khi không còn quá max_inflight request đang chạy trong idle_time giây liên tiếp.
+        Trả về False nếu hết timeout mà mạng vẫn bận.
+        """
+        deadline = time.monotonic() + timeout
+        with self._network_cond:
+            while True:
+                now = time.monotonic()
+                if self._n_active_requests(now) <= max_inflight:
+                    quiet_for = now - self._last_network_activity
+                    if quiet_for >= idle_time:
+                        return True
+                    wait_time = idle_time - quiet_for
+                else:
+                    wait_time = idle_time
+                if now >= deadline:
+                    logger.debug(f"Hết {timeout}s mà mạng vẫn bận ({self._n_active_requests(now)} request)")
+                    return False
+                self._network_cond.wait(min(wait_time, deadline - now))
+
+    def wait_for_new_content(self, element: WebElement = None, timeout: float = 5, pixels: int = 0) -> int:
+        """
+        Cuộn pixels (nếu có) rồi chờ DOM của element (mặc định body) có node mới bằng MutationObserver.
+        Trả về số node mới, 0 nếu hết timeout.
+        """
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            return self.driver.execute_async_script(SCROLL_AND_OBSERVE_SCRIPT, element, pixels, int(timeout * 1000)) or 0
+        except Exception as e:
+            logger.debug(f"Lỗi khi chờ nội dung mới {e}")
+            return 0
+
+    def wait_for_page_ready(self, timeout: float = 10) -> bool:
+        """Chờ document.readyState == 'complete' rồi chờ mạng rảnh."""
+        loaded = self.is_page_loaded(timeout)
+        return self.wait_for_network_idle(timeout=timeout) and loaded
+
+    def wait_for_first_match(self, locator_list: list[dict], timeout: float = 5) -> WebElement:
+        """
+        Như find_first_match nhưng chờ tối đa timeout giây đến khi một locator có phần tử click được.
+        """
+        def first_clickable(driver):
+            for locator in locator_list:
+                for element in driver.find_elements(locator.get("by", By.CSS_SELECTOR), locator.get("selector")):
+                    if self.is_clickable(element):
+                        return element
+            return False
+
+        try:
+            return WebDriverWait(self.driver, timeout).until(first_clickable)
+        except Exception:
+            logger.debug(f"Sau {timeout}s không có phần tử nào click được trong {locator_list}")
+            return None
+
     def is_driver_alive(self):
         try:
             _ = self.driver.current_url
@@ -82,6 +229,7 @@ class ControllerDriver:
             if hasattr(self, 'browser') and self.browser:
                     self.browser.close_tab(self.tab)
                     logger.debug("Tab DevTools đã đóng.")
+            self.api_registry.flush()
             # Đóng WebDriver
             if self.driver:
                 self.driver.quit()
@@ -406,29 +554,27 @@ class ControllerDriver:
         except Exception as e:
             raise Exception(f"Lỗi khi refresh {e}")
 
-    def random_scroll(self, max_scrolls: int = 10, min_wait: int = 2, max_wait: int = 2.5) -> None:
+    def random_scroll(self, max_scrolls: int = 10, timeout: float = 5, stop_when=None) -> None:
         """
-        Cuộn trang ngẫu nhiên với Selenium.
+        Cuộn trang ngẫu nhiên với Selenium, sau mỗi lần cuộn chờ đến khi có nội dung mới
+        và mạng rảnh thay vì ngủ một khoảng cố định.
 
         Args:
-            driver: Đối tượng Selenium WebDriver.
             max_scrolls: Số lần cuộn tối đa.
-            min_wait: Thời gian chờ tối thiểu giữa các lần cuộn (giây).
-            max_wait: Thời gian chờ tối đa giữa các lần cuộn (giây).
+            timeout: Thời gian chờ tối đa sau mỗi lần cuộn (giây).
+            stop_when: Hàm không tham số, dừng cuộn ngay khi trả về True.
         """
         logger.debug("Tiến hành mô phỏng cuộn trang")
-        last_height = self.driver.execute_script("return document.body.scrollHeight")
 
         for i in range(max_scrolls):
+            if stop_when is not None and stop_when():
+                break
             # Tạo khoảng cách cuộn ngẫu nhiên
             logger.debug(f"Thực hiện cuộn trang lần thứ {i + 1}")
             scroll_offset = random.randint(100, 800)
-            self.driver.execute_script(f"window.scrollBy(0, {scroll_offset});")
-
-            self.is_page_loaded()
-            # Thời gian chờ ngẫu nhiên sau mỗi lần cuộn
-            wait_time = random.uniform(min_wait, max_wait)
-            time.sleep(wait_time)
+            n_added = self.wait_for_new_content(None, timeout, pixels=scroll_offset)
+            if n_added:
+                self.wait_for_network_idle(timeout=timeout)
 
         logger.debug("Mô phỏng cuộn trang thành công")
 
@@ -478,24 +624,29 @@ class ControllerDriver:
             logger.debug(f"Phần tử {element} không thể click được")
             return False
 
-    def scroll_element(self, element: WebElement, pixels: int = 300, delay: float = 0.5, repeat: int = 3):
+    def scroll_element(self, element: WebElement, pixels: int = 300, timeout: float = 3, repeat: int = 3,
+                       stop_when=None):
         """
-        Cuộn một phần tử vùng scrollable theo chiều dọc (scrollTop hoặc scrollBy)
+        Cuộn một phần tử vùng scrollable theo chiều dọc (scrollBy), mỗi lần cuộn
+        chờ đến khi phần tử có nội dung mới (tối đa timeout giây)
 
         Args:
-            driver (WebDriver): Trình điều khiển Selenium
             element (WebElement): Vùng DOM cuộn được (div, section...)
             pixels (int): Số pixel mỗi lần cuộn (âm để cuộn lên)
-            delay (float): Thời gian chờ giữa mỗi lần cuộn
+            timeout (float): Thời gian chờ nội dung mới tối đa sau mỗi lần cuộn
             repeat (int): Số lần cuộn lặp lại
+            stop_when: Hàm không tham số, dừng cuộn ngay khi trả về True
 
         Returns:
             None
         """
         for i in range(repeat):
+            if stop_when is not None and stop_when():
+                break
             logger.debug(f"Thực hiện cuộn trang lần {i + 1}")
-            self.driver.execute_script("arguments[0].scrollBy(0, arguments[1]);", element, pixels)
-            time.sleep(delay)
+            if not self.wait_for_new_content(element, timeout, pixels=pixels):
+                # Không có nội dung mới: có thể đã hết comment hoặc request còn đang chạy
+                self.wait_for_network_idle(timeout=timeout)
 
     def scroll_into_view(self, element: WebElement) -> None:
         try:
@@ -0,0 +1,110 @@
+from driver_manager import ControllerDriver
+from api_registry import ApiRegistry
+from logger import setup_logger
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+import copy
+import queue
+import threading
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_WARM_URL = "https://www.facebook.com/"
+
+class DriverPool():
+    '''
+    Giữ sẵn một số Chrome (mặc định headless, không tải ảnh/CSS) đã add cookie,
+    để lấy API không phải khởi động trình duyệt và đăng nhập lại mỗi lần.
+    Mỗi driver dùng một cổng remote debugging riêng bắt đầu từ base_port.
+    '''
+    def __init__(self, cookies: list[dict], size: int = 2, headless: bool = True, block_resources: bool = True,
+                 base_port: int = 9222, api_info_path: str = "./api_info/api_info.json",
+                 warm_url: str = DEFAULT_WARM_URL):
+        self.cookies = cookies
+        self.size = size
+        self.headless = headless
+        self.block_resources = block_resources
+        self.base_port = base_port
+        self.api_info_path = api_info_path
+        self.api_registry = ApiRegistry(api_info_path)
+        self.warm_url = warm_url
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _start_driver(self, port: int) -> ControllerDriver:
+        driver = ControllerDriver(self.api_info_path, reset_api_info=False, api_registry=self.api_registry)
+        driver.start_controller(headless=self.headless, debug_port=port, block_resources=self.block_resources)
+        # Cookie chỉ add được khi đang ở đúng domain, add một lần rồi giữ cho các lần lease sau
+        driver.go_to_url(self.warm_url)
+        driver.add_cookie(copy.deepcopy(self.cookies))
+        driver.refresh()
+        driver.is_page_loaded()
+        logger.debug(f"Driver cổng {port} đã sẵn sàng")
+        return driver
+
+    def start(self) -> "DriverPool":
+        with self._lock:
+            if self._started:
+                return self
+            ports = [self.base_port + i for i in range(self.size)]
+            # Khởi động song song, thời gian khởi động pool xấp xỉ một lần khởi động Chrome
+            with ThreadPoolExecutor(max_workers=self.size) as executor:
+                drivers = list(executor.map(self._start_driver, ports))
+            for driver in drivers:
+                self._drivers.append(driver)
+                self._idle.put(driver)
+            self._started = True
+        logger.debug(f"Khởi động DriverPool {self.size} driver")
+        return self
+
+    def lease(self, timeout: Optional[float] = None) -> ControllerDriver:
+        '''
+        Lấy một driver rảnh (chờ tối đa timeout giây), driver đã chết được khởi động lại trên cùng cổng.
+        '''
+        self.start()
+        driver = self._idle.get(timeout=timeout)
+        if not driver.is_driver_alive():
+            logger.warning(f"Driver cổng {driver.debug_port} đã chết, khởi động lại")
+            port = driver.debug_port
+            driver.stop_controller()
+            new_driver = self._start_driver(port)
+            with self._lock:
+                self._drivers[self._drivers.index(driver)] = new_driver
+            driver = new_driver
+        return driver
+
+    def release(self, driver: ControllerDriver) -> None:
+        # Về trang trắng để trang cũ không tiếp tục gửi request nền trong lúc chờ
+        try:
+            driver.go_to_url("about:blank")
+        except Exception as e:
+            logger.debug(f"Lỗi khi trả driver cổng {driver.debug_port} về trang trắng {e}")
+        self._idle.put(driver)
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None):
+        driver = self.lease(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self) -> None:
+        with self._lock:
+            for driver in self._drivers:
+                driver.stop_controller()
+            self._drivers = []
+            self._idle = queue.Queue()
+            self._started = False
+        self.api_registry.close()
+        logger.debug("Đã đóng DriverPool")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -5,75 +5,125 @@ import os
 import time
 import json
 from utils import Utils
+from image_downloader import ImageDownloader
+from bootstrap_cache import BootstrapCache
+from output_sink import JsonlSink
+from metrics import Metrics, MetricsFlusher
+from checkpoint_store import CheckpointStore
+from api_registry import ApiRegistry, COMMENT_API_NAMES, DEFAULT_COMMENT_API_PATH
 from typing import Union, Optional, Tuple
 from datetime import datetime
 import logging
 
 logger = setup_logger(__name__, logging.DEBUG)
 class FacebookScraper():
+    # Downloader ảnh nền của lượt crawl_post hiện tại và báo cáo tải ảnh của lượt gần nhất
+    image_downloader: Optional[ImageDownloader] = None
+    image_report: Optional[dict] = None
+    # Thống kê của lượt crawl_post gần nhất: số post, số comment và các file output đã ghi
+    crawl_stats: Optional[dict] = None
+
+    def __init__(self, bootstrap_cache: Optional[BootstrapCache] = None,
+                 checkpoint_store: Optional[CheckpointStore] = None,
+                 api_registry: Optional[ApiRegistry] = None):
+        self.bootstrap_cache = bootstrap_cache if bootstrap_cache is not None else BootstrapCache()
+        self.checkpoint_store = checkpoint_store if checkpoint_store is not None else CheckpointStore()
+        # doc_id của các API comment lấy qua registry dùng chung, comment_api.json chỉ đọc lại khi file đổi
+        self.api_registry = api_registry if api_registry is not None else ApiRegistry.shared()
+
+    @staticmethod
+    def _get_page_api_info(page_url: str, bootstrap_cache: Optional[BootstrapCache] = None,
+                           refresh: bool = False) -> Tuple[dict, dict, bool]:
+        '''
+        Trả về (headers, bootstrap, from_cache). bootstrap gồm entryPoint, identifier,
+        post_api và reaction_ids, lấy từ cache nếu còn hạn.
+        '''
+        headers = Requester._get_headers(page_url)
+
+        if bootstrap_cache is not None and not refresh:
+            bootstrap = bootstrap_cache.get(page_url)
+            if bootstrap is not None:
+                return headers, bootstrap, True
+
+        homepage_response = Requester._get_homepage(page_url, headers)
+
+        entryPoint = Parser._parse_entryPoint(homepage_response)
+        identifier = Parser._parse_identifier(entryPoint, homepage_response)
+        post_api = Parser._parse_docid(entryPoint, homepage_response)           
+        
+        logger.debug(f"EntryPoint: {entryPoint}")
+        logger.debug(f"PageID: {identifier}")
+        logger.debug(f"PostAPI: {post_api}")
+        logger.debug(f"Lấy thông tin api thành công")
+
+        # Reaction ids nằm trong response post đầu tiên, dùng lại headers và doc_id vừa lấy
+        reaction_ids = Parser._get_reaction_id_from_posts(headers, identifier, entryPoint, post_api)
+
+        bootstrap = {
+            'entryPoint': entryPoint,
+            'identifier': identifier,
+            'post_api': post_api,
+            'reaction_ids': reaction_ids
+        }
+        if bootstrap_cache is not None and identifier and reaction_ids:
+            bootstrap_cache.set(page_url, bootstrap)
+        return headers, bootstrap, False
+
     def crawl_comment(self, post_url: str, feedback_id: str,
                        ranking: Ranking,
                        reaction_id_info: dict,
-                        cmt_api_path: str,
+                        cmt_api_path: str = DEFAULT_COMMENT_API_PATH,
                        has_return: bool = False,
                         has_write: bool = True, max_comment: int = 50, max_depth1_comment: int = 50,
-                        max_retry: int = 3, break_time: int = 2) -> None:
+                        max_retry: int = 3) -> None:
         try: 
-            logger.debug(f"{'-' * 20} Thực hiện lấy COMMENT: {'-' * 20}")
-            logger.debug(f"Post URL: {post_url}")
-            logger.debug(f"Post ID: {feedback_id}")
-            logger.debug(f"Ranking Filter: {ranking.name}")
+            logger.debug("-------------------- Thực hiện lấy COMMENT: --------------------")
+            logger.debug("Post URL: %s, Post ID: %s, Ranking Filter: %s", post_url, feedback_id, ranking.name)
 
-            cmt_api = Utils.load_json(cmt_api_path)
-            logger.debug(f"API Get Comment {cmt_api}") 
+            cmt_api = self.api_registry.require(COMMENT_API_NAMES, cmt_api_path)
+            logger.debug("API Get Comment %s", cmt_api)
 
             # Lấy api get comment gốc và gửi request
             comment_api = cmt_api['CommentListComponentsRootQuery']
             headers = Requester._get_headers(post_url)
 
-            logger.debug(f"Gửi request lần đầu lấy thông tin comment")
             resp = Requester._get_comments(headers, feedback_id, ranking, comment_api)
 
-            logger.debug(f"Tiến hành parser response:")
-            comment_info = Parser.parse_comments_info(resp, headers,  reaction_id_info=reaction_id_info)
+            comment_info = Parser.parse_comments_info(resp, headers,  reaction_id_info=reaction_id_info,
+                                                      downloader=self.image_downloader)
             page_info = Parser.parse_page_info(resp)
+            self.api_registry.mark_verified({'CommentListComponentsRootQuery': comment_api})
 
             # Lấy api get thêm comment và gửi request
             more_comment_api = cmt_api['CommentsListComponentsPaginationQuery']
-            logger.debug(f"Lấy thêm comment API: {more_comment_api}")
             max_iter = Utils.n_comment2n_iter(max_comment) - 1
             iter = 0
             retry_count = 0
             while page_info['has_next_page'] and len(comment_info['comments']) < max_comment:
-                logger.debug(f"{'-' * 20} PARENT COMMENT ITER {iter} {'-' * 20}")
                 try:
                     end_cursor = page_info['end_cursor']
                     resp = Requester._get_more_comments(headers, feedback_id, ranking,  more_comment_api, end_cursor)
 
-                    logger.debug(f"Tiến hành parser response:")
                     resp_jsons = Parser.parse_jsons(resp)
                     data_json = resp_jsons[0]
-                    comments = Parser.parse_comments(data_json, headers, reaction_id_info) 
+                    comments = Parser.parse_comments(data_json, headers, reaction_id_info, downloader=self.image_downloader)
                     cur_page_info = Parser.parse_page_info(resp)
 
-                    logger.debug(f"{'-' * 20}Lấy PARENT COMMENT ITER {iter} thành công{'-' * 20}")
                     comment_info['comments'] += comments
                     page_info = cur_page_info
                     retry_count = 0
+                    self.api_registry.mark_verified({'CommentsListComponentsPaginationQuery': more_comment_api})
                 except:
-                    logger.debug(f"{'-' * 20} Lỗi khi lấy PARENT COMMENT ITER {iter} {'-' * 20}")
+                    logger.debug("Lỗi khi lấy PARENT COMMENT ITER %s", iter)
                     retry_count += 1
                     if retry_count >= max_retry:
                         logger.warning(f"Thất bại khi lấy PARENT COMMENT --- Thử lại lần {retry_count+1} ---")
                         break
                 iter += 1
-                time.sleep(break_time)
                 
-            for idx, comment in enumerate(comment_info["comments"]):
-                logger.debug(f"Comment {idx}:")
-                logger.debug(f"Text: {comment['text']}")
-                logger.debug(f"Image: {comment['image']}")
-                logger.debug(f"\n")
+            if logger.isEnabledFor(logging.DEBUG):
+                for idx, comment in enumerate(comment_info["comments"]):
+                    logger.debug("Comment %s:\nText: %s\nImage: %s\n", idx, comment['text'], comment['image'])
             
             #Ghi kết quả vào tệp
             # if has_write:
@@ -81,9 +131,7 @@ class FacebookScraper():
             #     os.makedirs(os.path.dirname(comments_path), exist_ok=True)
             #     Utils.write_jsonl(comments_path, comment_info)
 
-            path = "./facebook_urls/comments.json"
-            Utils.write_json(path, comment_info)            
-
+            # Comment được ghi cùng post vào file JSONL trong output_dir của job, không ghi ra file dùng chung
             if has_return:
                 return comment_info
             logger.debug(f"Lấy PARENT COMMENT thành công")
@@ -93,48 +141,81 @@ class FacebookScraper():
     def crawl_post(self, page_url: str, after_time: int = None, before_time: int = None, 
                    ranking_comment: Ranking = Ranking.MOST_RELEVANT, include_comment: bool = True, 
                    save_dir: str = "data\\image", max_post: int = 10, 
-                   comment_api_path: str = "./api_info/comment_api.json", 
+                   comment_api_path: str = DEFAULT_COMMENT_API_PATH, 
                    return_posts: bool = False,
-                    max_parent_comment: int = 50, max_depth1_comment: int = 50):
+                    max_parent_comment: int = 50, max_depth1_comment: int = 50,
+                    image_workers: int = 4, output_dir: str = "data/json",
+                    resume: bool = True, incremental: bool = False,
+                    output_max_bytes: Optional[int] = None, output_max_seconds: Optional[int] = None,
+                    output_compression: Optional[str] = None):
+        '''
+        resume: tiếp tục từ cursor đã lưu nếu lượt crawl trước của khung thời gian này bị dừng giữa chừng.
+        incremental: dừng phân trang khi gặp post cũ hơn post mới nhất đã lưu của page trong khung thời gian này
+                     (không áp dụng khi đang tiếp tục từ cursor đã lưu).
+        Post đã có trong checkpoint store luôn được bỏ qua, không lấy lại comment.
+        output_*: xoay file JSONL theo kích thước/thời gian và nén gzip hoặc zstd.
+        Post chỉ được giữ lại trong bộ nhớ khi return_posts=True.
+        '''
+        self.image_downloader = ImageDownloader(n_workers=image_workers)
+        self.crawl_stats = {'posts': 0, 'comments': 0, 'files': []}
+        sink = None
         try:
             logger.debug(f"----------------Chương trình lấy post---------------")
-            headers = Requester._get_headers(page_url)
-            homepage_response = Requester._get_homepage(page_url, headers)
-
-            entryPoint = Parser._parse_entryPoint(homepage_response)
-            identifier = Parser._parse_identifier(entryPoint, homepage_response)
-            post_api = Parser._parse_docid(entryPoint, homepage_response)           
-            
-            logger.debug(f"EntryPoint: {entryPoint}")
-            logger.debug(f"PageID: {identifier}")
-            logger.debug(f"PostAPI: {post_api}")
-            logger.debug(f"Lấy thông tin api thành công")
+            headers, bootstrap, from_cache = self._get_page_api_info(page_url, self.bootstrap_cache)
+            entryPoint, identifier, post_api = bootstrap['entryPoint'], bootstrap['identifier'], bootstrap['post_api']
+            reaction_id = bootstrap['reaction_ids']
 
             time_range, page_info = Utils.init_requests_variables(after_time, before_time)
             logger.debug(f"TimeRange: {time_range}")
             logger.debug(f"PageInfo: {page_info}")
             logger.debug(f"Lấy thông tin Variable Request thành công")
 
-            reaction_id= Parser._get_reaction_id(page_url) 
-                    
+            window = CheckpointStore.window_key(after_time, before_time)
+            n_posts = 0
+            saved_page_info = self.checkpoint_store.get_page_info(page_url, window) if resume else None
+            if saved_page_info is not None and saved_page_info['has_next_page']:
+                logger.debug(f"Tiếp tục từ cursor đã lưu, đã lấy {saved_page_info['n_posts']} post")
+                page_info = {'has_next_page': True, 'end_cursor': saved_page_info['end_cursor']}
+                n_posts = saved_page_info['n_posts']
+
+            # Đang đi tiếp từ cursor cũ (backfill dở) thì chưa tới phần đã lấy, không dừng theo mốc incremental
+            resuming = saved_page_info is not None and saved_page_info['has_next_page']
+            newest_time = None
+            if incremental and not resuming:
+                newest_time = self.checkpoint_store.newest_creation_time(page_url, time_range['after_time'], time_range['before_time'])
+            logger.debug(f"Post mới nhất đã lưu: {newest_time}")
+
             all_posts = []
-            post_ids = set()
             os.makedirs(save_dir, exist_ok=True)
             
             max_retry = 3
             retry_count = 0
             page_info_found = True
-            n_iter = Utils.n_post2n_iter(max_post)  
+            n_iter = Utils.n_post2n_iter(max(max_post - n_posts, 0))
             logger.debug(f"NUM ITERATIONS: {n_iter}")
 
             fanpage_name = page_url.rstrip('/').split('/')[-1] or "unknown"
-            file_jsonl_path = f"data/json/posts_{fanpage_name}_{before_time}.jsonl"
-            Utils.remove_file(file_jsonl_path)
+            # Không xoá file cũ: post đã ghi được giữ lại và post đã có sẽ bị bỏ qua
+            file_jsonl_path = os.path.join(output_dir, f"posts_{fanpage_name}_{before_time}.jsonl")
+            sink = JsonlSink(file_jsonl_path, max_bytes=output_max_bytes, max_seconds=output_max_seconds,
+                             compression=output_compression)
 
-            for round_idx in range(n_iter):
-                logger.debug(f"--- ITER {round_idx+1} ---")
+            round_idx = 0
+            while round_idx < n_iter:
+                round_idx += 1
+                logger.debug(f"--- ITER {round_idx} ---")
 
-                if page_info_found == False:
+                if page_info_found == False and from_cache:
+                    # doc_id/identifier trong cache có thể đã cũ, làm mới một lần rồi thử lại
+                    logger.warning(f"Request lỗi khi dùng bootstrap cache, làm mới bootstrap")
+                    self.bootstrap_cache.invalidate(page_url)
+                    headers, bootstrap, from_cache = self._get_page_api_info(page_url, self.bootstrap_cache, refresh=True)
+                    entryPoint, identifier, post_api = bootstrap['entryPoint'], bootstrap['identifier'], bootstrap['post_api']
+                    reaction_id = bootstrap['reaction_ids']
+                    page_info_found = True
+                    # Vòng lỗi trước không lấy được trang nào, bù lại để vẫn đủ số trang cần lấy
+                    n_iter += 1
+                elif page_info_found == False:
                     retry_count += 1
                     if retry_count >= max_retry:
                         logger.warning(f"Thất bại khi lấy PageInfo --- Thử lại lần {retry_count+1} ---")
@@ -146,14 +227,30 @@ class FacebookScraper():
 
                     if not resp or resp.status_code != 200:
                         logger.warning(f"Lỗi khi gửi request lấy post {resp.status_code if resp else 'No response'}")
+                        if from_cache:
+                            page_info_found = False
+                            continue
                         break
 
                     resp_jsons = Parser.parse_jsons(resp)
+                    reached_known = False
 
                     for idx, json in enumerate(resp_jsons):
-                        logger.debug(f"Parse Json thứ {idx+1}")
                         try:
-                            post_info = Parser.parse_post_obj(json, save_dir=save_dir)
+                            fields = Parser.extract_post_fields(json)
+                            post_url = fields['post_url']
+                            if post_url is None:
+                                continue
+
+                            # Feed trả về post mới trước (trừ post ghim), nên chỉ cần xét post cuối của trang
+                            creation_time = fields['creation_time']
+                            reached_known = newest_time is not None and creation_time is not None and creation_time <= newest_time
+
+                            if self.checkpoint_store.is_seen(page_url, post_url):
+                                logger.debug("Bỏ qua post đã lấy %s", post_url)
+                                continue
+
+                            post_info = Parser.parse_post_obj(json, save_dir=save_dir, downloader=self.image_downloader, fields=fields)
 
                             if post_info != {}:
                                 if include_comment:
@@ -163,8 +260,16 @@ class FacebookScraper():
                                                                                 reaction_id, comment_api_path, has_return=True,
                                                                                  max_comment=max_parent_comment, max_depth1_comment=max_depth1_comment)
 
-                                Utils.write_jsonl(file_jsonl_path, post_info)      
-                                all_posts.append(post_info)
+                                sink.write(post_info)
+                                self.checkpoint_store.mark_seen(page_url, post_info)
+                                n_posts += 1
+                                n_comments = Utils.count_comments(post_info.get('comments'))
+                                self.crawl_stats['posts'] += 1
+                                self.crawl_stats['comments'] += n_comments
+                                Metrics.inc("crawler_posts_total")
+                                Metrics.inc("crawler_comments_total", n_comments)
+                                if return_posts:
+                                    all_posts.append(post_info)
                             
                         except Exception as e:
                             logger.warning(f"Lỗi dòng: {e}")
@@ -178,22 +283,29 @@ class FacebookScraper():
                         page_info = new_page_info
                         page_info_found = True
 
-                    time.sleep(3)
+                    if reached_known:
+                        logger.debug(f"Đã tới post cũ hơn post mới nhất đã lưu, dừng phân trang")
+                        page_info = {'has_next_page': False, 'end_cursor': ""}
+                    if page_info_found:
+                        self.checkpoint_store.save_page_info(page_url, window, page_info, n_posts)
+                    if not page_info['has_next_page']:
+                        break
             
-            os.makedirs("data/json", exist_ok=True)
-            fanpage_name = page_url.rstrip('/').split('/')[-1] or "unknown"
-            file_path = f"data/json/posts_{fanpage_name}.json"
-            Utils.write_json(file_path, all_posts)
-
-            for post in all_posts:
-                logger.debug(f"Post content: {post['post_content']}")
-
-            logger.debug(f"Đã lưu thông tin các post vào {file_path}")
+            logger.debug(f"Đã lưu {self.crawl_stats['posts']} post vào {sink.files}")
             if return_posts:
                 return all_posts
         except Exception as e:
             logger.error(f"Lỗi khi lấy post {e}")
             raise Exception(f"Lỗi khi lấy post {e}")
+        finally:
+            if sink is not None:
+                sink.close()
+                self.crawl_stats['files'] = sink.files
+            self.api_registry.flush()
+            self.image_report = self.image_downloader.close()
+            self.image_downloader = None
+            logger.debug(f"Báo cáo tải ảnh: {self.image_report}")
+            logger.info(f"Metrics: {Metrics.summary()}")
     
 if __name__ == "__main__":
     scraper = FacebookScraper()
@@ -215,10 +327,19 @@ if __name__ == "__main__":
     max_depth1_comment = 30
     max_parent_comment = 20
     max_post = 300
-    time1 = time.time()
-    scraper.crawl_post(fanpage_url, max_post=max_post, ranking_comment=ranking, before_time=before_time, after_time=after_time, max_parent_comment=max_parent_comment, max_depth1_comment=max_depth1_comment)
-    time2 = time.time()
+    Metrics.reset()
+    flusher = MetricsFlusher("./logs/metrics.json", interval=10)
+    try:
+        scraper.crawl_post(fanpage_url, max_post=max_post, ranking_comment=ranking, before_time=before_time, after_time=after_time, max_parent_comment=max_parent_comment, max_depth1_comment=max_depth1_comment)
+    finally:
+        flusher.close()
 
-    print(f"Thời gian thực hiện: {time2 - time1} giây")
-    logger.debug(f"Thời gian thực hiện: {time2 - time1} giây")
+    summary = Metrics.summary()
+    print(f"Thời gian thực hiện: {summary['elapsed_seconds']:.1f} giây")
+    print(f"{summary['posts']:.0f} post ({summary['posts_per_second']:.2f}/s), "
+          f"{summary['comments']:.0f} comment ({summary['comments_per_second']:.2f}/s), "
+          f"{summary['images']:.0f} ảnh ({summary['images_per_second']:.2f}/s)")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"{endpoint}: {stats}")
+    logger.debug(f"Tổng kết metrics: {summary}")
  
\ No newline at end of file
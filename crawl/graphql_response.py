@@ -0,0 +1,89 @@
+from typing import Any, Optional
+import json
+
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+except ImportError:
+    orjson = None
+    JSON_BACKEND = "json"
+
+def loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _step(obj: Any, key) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key)
+    if isinstance(obj, list) and isinstance(key, int) and -len(obj) <= key < len(obj):
+        return obj[key]
+    return None
+
+def get_path(obj: Any, path: tuple, default: Any = None) -> Any:
+    '''
+    Đi theo path (key của dict hoặc index của list), trả về default nếu thiếu bất kỳ bước nào.
+    '''
+    for key in path:
+        obj = _step(obj, key)
+        if obj is None:
+            return default
+    return obj
+
+class FieldPlan():
+    '''
+    Tập field cần lấy, mỗi field là (path, default). Các path được gộp thành cây tiền tố
+    lúc khởi tạo, nên extract chỉ đi qua mỗi nhánh chung một lần cho tất cả field.
+    '''
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self._defaults = {name: default for name, (_, default) in fields.items()}
+        self._trie = dict()
+        for name, (path, _) in fields.items():
+            trie = self._trie
+            for idx, key in enumerate(path):
+                children, names = trie.setdefault(key, (dict(), []))
+                if idx == len(path) - 1:
+                    names.append(name)
+                trie = children
+
+    def extract(self, obj: Any) -> dict:
+        result = dict(self._defaults)
+        stack = [(obj, self._trie)]
+        while stack:
+            node, trie = stack.pop()
+            for key, (children, names) in trie.items():
+                value = _step(node, key)
+                if value is None:
+                    continue
+                for name in names:
+                    result[name] = value
+                if children:
+                    stack.append((value, children))
+        return result
+
+class ParsedResponse():
+    '''
+    Response GraphQL (nhiều JSON cách nhau bởi \\r\\n) được decode đúng một lần.
+    Dùng ParsedResponse.of(resp) để các hàm parse khác nhau dùng lại kết quả đã decode.
+    '''
+    def __init__(self, text: str):
+        self.jsons = [loads(chunk) for chunk in text.split('\r\n') if chunk.strip()]
+
+    @staticmethod
+    def of(resp) -> "ParsedResponse":
+        parsed = getattr(resp, '_parsed_response', None)
+        if parsed is None:
+            parsed = ParsedResponse(resp.text)
+            try:
+                resp._parsed_response = parsed
+            except AttributeError:
+                pass
+        return parsed
+
+    @property
+    def first(self) -> Optional[dict]:
+        return self.jsons[0] if self.jsons else None
+
+    def get(self, path: tuple, default: Any = None) -> Any:
+        return get_path(self.first, path, default)
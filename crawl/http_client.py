@@ -0,0 +1,209 @@
+import requests
+from requests.adapters import HTTPAdapter
+from http.cookiejar import CookieJar, CookiePolicy
+from logger import setup_logger
+from typing import Optional
+from urllib.parse import urlsplit
+import threading
+import os
+import logging
+
+try:
+    import httpx
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+# Số kết nối keep-alive giữ lại cho mỗi host (facebook.com, fbcdn.net, ...)
+DEFAULT_POOL_SIZE = 16
+# Số host được giữ pool cùng lúc
+DEFAULT_POOL_HOSTS = 8
+
+class _BlockAllCookies(CookiePolicy):
+    '''
+    Không lưu cookie vào session: mỗi request đã tự gửi cookie qua headers,
+    nếu session lưu lại cookie thì _get_headers sẽ không nhận được cookie mới.
+    '''
+    return_ok = set_ok = domain_return_ok = path_return_ok = lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+class RequestBudgetExceeded(Exception):
+    pass
+
+class RequestBudget():
+    '''
+    Giới hạn tổng số request của cả lượt crawl. Khi chạy nhiều process, truyền counter và lock
+    tạo từ multiprocessing.Manager để các process dùng chung một ngân sách.
+    '''
+    def __init__(self, limit: int, counter=None, lock=None):
+        self.limit = limit
+        self._counter = counter
+        self._lock = lock if lock is not None else threading.Lock()
+        self._used = 0
+
+    @property
+    def used(self) -> int:
+        return self._counter.value if self._counter is not None else self._used
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            if self._counter is not None:
+                self._counter.value += 1
+            else:
+                self._used += 1
+            return True
+
+class HttpClient():
+    '''
+    Tầng transport dùng chung cho toàn bộ crawler: giữ kết nối keep-alive theo từng host
+    thay vì mở TCP+TLS mới cho mỗi request. Dùng HTTP/2 (httpx + h2) nếu được bật và có cài đặt.
+    '''
+    pool_size = DEFAULT_POOL_SIZE
+    pool_hosts = DEFAULT_POOL_HOSTS
+    http2 = False
+
+    budget: Optional[RequestBudget] = None
+    # Khi chạy với replay server: mọi URL được chuyển thành <replay_url>/<host><path>?<query>
+    replay_url: Optional[str] = None
+    # Recorder (replay.FixtureRecorder) nhận mọi response để ghi thành fixture
+    recorder = None
+
+    _client = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def configure(pool_size: int = DEFAULT_POOL_SIZE, pool_hosts: int = DEFAULT_POOL_HOSTS, http2: bool = False) -> None:
+        with HttpClient._lock:
+            HttpClient.pool_size = pool_size
+            HttpClient.pool_hosts = pool_hosts
+            HttpClient.http2 = http2
+            HttpClient._close_client()
+
+        logger.debug(f"Cấu hình HttpClient pool_size={pool_size} pool_hosts={pool_hosts} http2={http2}")
+
+    @staticmethod
+    def _new_client():
+        if HttpClient.http2 and HTTP2_AVAILABLE:
+            limits = httpx.Limits(max_connections=HttpClient.pool_size * HttpClient.pool_hosts,
+                                  max_keepalive_connections=HttpClient.pool_size * HttpClient.pool_hosts)
+            client = httpx.Client(http2=True, limits=limits, follow_redirects=True,
+                                  cookies=CookieJar(policy=_BlockAllCookies()), timeout=None)
+            logger.debug("Khởi tạo HttpClient HTTP/2 thành công")
+            return client
+
+        if HttpClient.http2:
+            logger.warning("Chưa cài đặt httpx[http2], dùng HTTP/1.1")
+
+        session = requests.Session()
+        session.cookies.set_policy(_BlockAllCookies())
+        adapter = HTTPAdapter(pool_connections=HttpClient.pool_hosts, pool_maxsize=HttpClient.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        logger.debug("Khởi tạo HttpClient HTTP/1.1 keep-alive thành công")
+        return session
+
+    @staticmethod
+    def get_client():
+        if HttpClient._client is None:
+            with HttpClient._lock:
+                if HttpClient._client is None:
+                    HttpClient._client = HttpClient._new_client()
+        return HttpClient._client
+
+    @staticmethod
+    def _close_client() -> None:
+        if HttpClient._client is not None:
+            HttpClient._client.close()
+            HttpClient._client = None
+
+    @staticmethod
+    def close() -> None:
+        with HttpClient._lock:
+            HttpClient._close_client()
+
+    @staticmethod
+    def set_budget(budget: Optional[RequestBudget]) -> None:
+        HttpClient.budget = budget
+
+    @staticmethod
+    def _acquire_budget(url: str) -> None:
+        if HttpClient.budget is not None and not HttpClient.budget.acquire():
+            raise RequestBudgetExceeded(f"Đã dùng hết ngân sách {HttpClient.budget.limit} request ({url})")
+
+    @staticmethod
+    def set_replay(replay_url: Optional[str]) -> None:
+        HttpClient.replay_url = replay_url.rstrip('/') if replay_url else None
+        logger.debug(f"Chuyển request tới replay server {HttpClient.replay_url}")
+
+    @staticmethod
+    def rewrite_url(url: str) -> str:
+        if HttpClient.replay_url is None:
+            return url
+        parts = urlsplit(url)
+        query = f"?{parts.query}" if parts.query else ""
+        return f"{HttpClient.replay_url}/{parts.netloc}{parts.path}{query}"
+
+    @staticmethod
+    def request(method: str, url: str, **kwargs):
+        HttpClient._acquire_budget(url)
+        resp = HttpClient.get_client().request(method, HttpClient.rewrite_url(url), **kwargs)
+        if HttpClient.recorder is not None:
+            HttpClient.recorder.record(method, url, kwargs.get('data'), resp)
+        return resp
+
+    @staticmethod
+    def get(url: str, **kwargs):
+        return HttpClient.request("GET", url, **kwargs)
+
+    @staticmethod
+    def post(url: str, data: Optional[dict] = None, **kwargs):
+        return HttpClient.request("POST", url, data=data, **kwargs)
+
+    @staticmethod
+    def cookies_dict(resp) -> dict:
+        # requests trả về RequestsCookieJar, httpx trả về Cookies bọc CookieJar trong thuộc tính jar
+        jar = getattr(resp.cookies, 'jar', resp.cookies)
+        return {cookie.name: cookie.value for cookie in jar}
+
+    @staticmethod
+    def download(url: str, path: str, chunk_size: int = 64 * 1024, hasher=None, **kwargs) -> int:
+        '''
+        Tải file theo từng chunk vào path (ghi qua file tạm rồi đổi tên), trả về số byte đã ghi.
+        Nếu truyền hasher (hashlib) thì nội dung được băm trong lúc tải.
+        '''
+        HttpClient._acquire_budget(url)
+        tmp_path = f"{path}.part"
+        n_bytes = 0
+        client = HttpClient.get_client()
+        url = HttpClient.rewrite_url(url)
+        try:
+            if isinstance(client, requests.Session):
+                with client.get(url, stream=True, **kwargs) as resp:
+                    resp.raise_for_status()
+                    with open(tmp_path, "wb") as f:
+                        for chunk in resp.iter_content(chunk_size):
+                            f.write(chunk)
+                            n_bytes += len(chunk)
+                            if hasher is not None:
+                                hasher.update(chunk)
+            else:
+                with client.stream("GET", url, **kwargs) as resp:
+                    resp.raise_for_status()
+                    with open(tmp_path, "wb") as f:
+                        for chunk in resp.iter_bytes(chunk_size):
+                            f.write(chunk)
+                            n_bytes += len(chunk)
+                            if hasher is not None:
+                                hasher.update(chunk)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return n_bytes
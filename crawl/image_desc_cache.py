@@ -0,0 +1,97 @@
+from logger import setup_logger
+from typing import Optional
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_IMAGE_DESC_CACHE_PATH = "./api_info/image_desc_cache.sqlite"
+
+STATUS_OK = "ok"
+STATUS_RETRY = "retry"
+
+class ImageDescCache():
+    '''
+    Cache mô tả ảnh trên SQLite, khoá là sha256 nội dung file: cùng một file dưới nhiều tên chỉ mô tả
+    một lần, hai ảnh khác nội dung không bao giờ dùng chung mô tả qua cache (perceptual hash chỉ dùng
+    để gợi ý ảnh gần trùng trong ImageDescriber). Ảnh gọi lỗi được lưu với status "retry" và số lần thử
+    thay vì chuỗi "ERROR: ...".
+    '''
+    def __init__(self, path: str = DEFAULT_IMAGE_DESC_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS image_descriptions (
+                    sha256 TEXT PRIMARY KEY,
+                    description TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    model TEXT,
+                    updated_at INTEGER NOT NULL
+                )''')
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha256: str) -> Optional[str]:
+        '''
+        Trả về mô tả đã có (có thể là chuỗi rỗng), None nếu chưa mô tả hoặc đang chờ thử lại.
+        '''
+        with self._lock:
+            row = self._conn.execute("SELECT description FROM image_descriptions WHERE sha256 = ? AND status = ?",
+                                     (sha256, STATUS_OK)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, sha256: str, description: str, model: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO image_descriptions (sha256, description, status, attempts, error, model, updated_at)
+                VALUES (?, ?, ?, 1, NULL, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET description = excluded.description, status = excluded.status,
+                    attempts = image_descriptions.attempts + 1, error = NULL, model = excluded.model,
+                    updated_at = excluded.updated_at''',
+                (sha256, description, STATUS_OK, model, int(time.time())))
+
+    def mark_retry(self, sha256: str, error: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO image_descriptions (sha256, description, status, attempts, error, updated_at)
+                VALUES (?, NULL, ?, 1, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET status = excluded.status, attempts = image_descriptions.attempts + 1,
+                    error = excluded.error, updated_at = excluded.updated_at''',
+                (sha256, STATUS_RETRY, error, int(time.time())))
+
+    def retry_hashes(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT sha256 FROM image_descriptions WHERE status = ?", (STATUS_RETRY,))]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM image_descriptions WHERE status = ?", (STATUS_OK,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "retry": len(self.retry_hashes()),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,284 @@
+from logger import setup_logger
+from label_engine import KeyPool, DEFAULT_BASE_URL, DEFAULT_MODEL, DEFAULT_MAX_RETRY, DEFAULT_RPM_PER_KEY
+from image_desc_cache import ImageDescCache, DEFAULT_IMAGE_DESC_CACHE_PATH, STATUS_OK, STATUS_RETRY
+from image_store import ImageStore, INDEX_FILE_NAME
+from image_hash import load_rgb, dhash, hamming, file_sha256, thumbnail, same_picture, DEFAULT_MAX_PIXEL_DIFF
+from image_prefilter import ImagePrefilter, DECISION_SEND, DECISION_ICON, DEFAULT_TEMPLATES_PATH
+from output_sink import JsonlSink
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+import argparse
+import mimetypes
+import os
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+STATUS_UNREADABLE = "unreadable"
+# Ảnh được ImagePrefilter xử lý tại chỗ, không gọi LLM
+STATUS_ICON = "icon"
+STATUS_SKIPPED = "skipped"
+DEFAULT_MAX_ROUNDS = 3
+DEFAULT_RETRY_WAIT = 30
+# Chỉ ghép các file có dHash trùng hẳn rồi xác nhận bằng thumbnail, tăng lên vài bit để bắt cả ảnh
+# resize/nén lại (thumbnail vẫn phải khớp nên ảnh cùng bố cục khác chữ không bị ghép)
+DEFAULT_MAX_DISTANCE = 0
+
+IMAGE_PROMPT = (
+    "Ảnh này phục vụ cho bài toán phân tích cảm xúc theo chủ đề. Hãy xử lý ảnh và làm theo các quy tắc sau:\n"
+    "- Nếu ảnh là **icon hoặc hình vẽ**, hãy trích xuất nội dung chữ (nếu có).\n"
+    "- Nếu icon là một trong các biểu tượng sau, hãy mô tả ý nghĩa cảm xúc đơn giản:\n"
+    "    • Trái tim → biểu hiện tình cảm tích cực, yêu thương.\n"
+    "    • Thích / Like → sự đồng tình, ủng hộ.\n"
+    "    • Haha → niềm vui, hài hước.\n"
+    "    • Buồn → nỗi buồn, cảm xúc tiêu cực nhẹ.\n"
+    "    • Phẫn nộ / Giận  → cảm xúc tiêu cực mạnh, bất mãn.\n"
+    "    • Bông hoa → sự trân trọng, tưởng nhớ, dịu dàng.\n"
+    "- Trả về theo dạng: \"Icon <mô tả ngắn> - Ý nghĩa: <ý nghĩa cảm xúc>\". Nếu có chữ trong ảnh, thêm vào sau: ' - Chữ trong ảnh: <text>'.\n"
+    "- Nếu icon không mang ý nghĩa rõ ràng, trả về chuỗi rỗng.\n"
+    "- Nếu ảnh có **người thật**, hãy mô tả ngắn gọn và trích xuất chữ nếu có, theo dạng: 'Ảnh có người: <mô tả> - Văn bản trong ảnh: <text>'.\n"
+    "- Nếu ảnh có watermark hoặc các chữ mờ không mang ý nghĩa, **bỏ qua**, không trích xuất các chữ đó.\n"
+    "- Nếu ảnh không rõ ràng hoặc không mang thông tin đáng chú ý, trả về chuỗi rỗng.\n"
+    "- Trả lời ngắn gọn, không thêm giải thích hoặc suy luận mở rộng."
+)
+
+def model_input(path: str) -> str:
+    # Ảnh đã có bản thu nhỏ trong ImageStore thì đọc và gửi bản thu nhỏ
+    return ImageStore.for_dir(os.path.dirname(path) or ".").model_input(path)
+
+def image_part(path: str) -> tuple[str, bytes]:
+    mime_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+    with open(path, "rb") as f:
+        return mime_type, f.read()
+
+def list_images(image_dir: str) -> list[str]:
+    # Bỏ qua index và thư mục objects của ImageStore, file đang tải dở. Ảnh đã bỏ bản gốc có file theo
+    # tên local_path(), ảnh nào chưa có tên đó trong image_dir thì liệt kê theo key, đọc qua model_input()
+    names = {name for name in os.listdir(image_dir)
+             if name != INDEX_FILE_NAME and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+             and os.path.isfile(os.path.join(image_dir, name))}
+    store = ImageStore.for_dir(image_dir)
+    names.update(key for key in store.keys()
+                 if os.path.basename(store.local_path(key)) not in names and store.resolve(key) is not None)
+    return [os.path.join(image_dir, name) for name in sorted(names)]
+
+class ImageDescriber():
+    '''
+    Mô tả ảnh song song bằng tất cả key của KeyPool. Ảnh được gom theo sha256 nội dung nên cùng một file
+    dưới nhiều tên chỉ gửi một lần, mô tả được cache theo sha256. dHash chỉ gợi ý các file gần trùng (ảnh
+    resize, nén lại), hai file chỉ dùng chung mô tả khi thumbnail xác nhận là cùng một hình. Ảnh lỗi được
+    đánh dấu "retry" và tự đưa lại vào hàng đợi ở vòng sau, hết số vòng thì ghi status "retry" để lần chạy
+    sau làm tiếp. Có prefilter thì icon đã biết và ảnh không mang thông tin được xử lý tại chỗ, không tốn request.
+    '''
+    def __init__(self, key_pool: KeyPool, prompt: str = IMAGE_PROMPT, workers_per_key: int = 2,
+                 max_retry: int = DEFAULT_MAX_RETRY, cache: Optional[ImageDescCache] = None,
+                 model: Optional[str] = None, max_rounds: int = DEFAULT_MAX_ROUNDS,
+                 retry_wait: float = DEFAULT_RETRY_WAIT, max_distance: int = DEFAULT_MAX_DISTANCE,
+                 prefilter: Optional[ImagePrefilter] = None, hash_workers: Optional[int] = None,
+                 max_pixel_diff: int = DEFAULT_MAX_PIXEL_DIFF):
+        self.key_pool = key_pool
+        self.prompt = prompt
+        self.workers = max(1, len(key_pool.slots) * workers_per_key)
+        self.max_retry = max_retry
+        self.cache = cache
+        self.model = model
+        self.max_rounds = max(1, max_rounds)
+        self.retry_wait = retry_wait
+        self.max_distance = max_distance
+        self.max_pixel_diff = max_pixel_diff
+        self.prefilter = prefilter
+        self.hash_workers = hash_workers or os.cpu_count() or 1
+
+    def describe(self, path: str) -> str:
+        txt = self.key_pool.call(self.prompt, [image_part(model_input(path))], max_retry=self.max_retry)
+        return txt.replace("\n", " ").replace("\r", " ").strip()
+
+    def _inspect(self, path: str) -> tuple[str, str, bytes, str, Optional[str]]:
+        # Đọc ảnh một lần cho sha256, dHash, thumbnail và prefilter
+        source = model_input(path)
+        sha256 = file_sha256(source)
+        img = load_rgb(source)
+        hash_ = dhash(img)
+        if self.prefilter is None:
+            return sha256, hash_, thumbnail(img), DECISION_SEND, None
+        return (sha256, hash_, thumbnail(img)) + self.prefilter.classify(img, hash_)
+
+    def group(self, paths: list[str]) -> tuple[dict, dict, list[str], dict]:
+        '''
+        Trả về ({sha256 đại diện: [path, ...]}, {path: sha256}, các ảnh không đọc được,
+        {sha256 đại diện: (status, mô tả)} của các hình được prefilter xử lý tại chỗ).
+        '''
+        files, sha_of, unreadable, decisions = dict(), dict(), [], dict()
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            futures = {executor.submit(self._inspect, path): path for path in paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    sha256, hash_, thumb, decision, description = future.result()
+                except Exception as e:
+                    logger.warning(f"Không đọc được ảnh {path} {e}")
+                    unreadable.append(path)
+                    continue
+                sha_of[path] = sha256
+                files.setdefault(sha256, (hash_, thumb, []))[2].append(path)
+                decisions.setdefault(sha256, []).append((decision, description))
+
+        merged, rep_of = self._merge_near(files)
+        results_of = dict()
+        for sha256, results in decisions.items():
+            results_of.setdefault(rep_of[sha256], []).extend(results)
+        local = dict()
+        for rep, results in results_of.items():
+            # Chỉ cần một ảnh trong nhóm có vẻ mang thông tin là gửi cả nhóm đi mô tả
+            if any(decision == DECISION_SEND for decision, _ in results):
+                continue
+            icons = [description for decision, description in results if decision == DECISION_ICON]
+            local[rep] = (STATUS_ICON, icons[0]) if icons else (STATUS_SKIPPED, "")
+        return merged, sha_of, unreadable, local
+
+    def _merge_near(self, files: dict) -> tuple[dict, dict]:
+        '''
+        files: {sha256: (dHash, thumbnail, [path, ...])}. Gộp file vào nhóm đông nhất có dHash lệch tối đa
+        max_distance bit và thumbnail khớp (same_picture), sha256 của file đầu nhóm là đại diện.
+        '''
+        merged, rep_of, reps_by_hash = dict(), dict(), dict()
+        for sha256 in sorted(files, key=lambda h: (-len(files[h][2]), h)):
+            hash_, thumb, members = files[sha256]
+            if self.max_distance > 0:
+                near = [rep for rep_hash, reps in reps_by_hash.items()
+                        if hamming(hash_, rep_hash) <= self.max_distance for rep in reps]
+            else:
+                near = reps_by_hash.get(hash_, [])
+            target = next((rep for rep in near if same_picture(thumb, files[rep][1], self.max_pixel_diff)), None)
+            if target is None:
+                target = sha256
+                reps_by_hash.setdefault(hash_, []).append(sha256)
+            merged.setdefault(target, []).extend(members)
+            rep_of[sha256] = target
+        for members in merged.values():
+            members.sort()
+        return merged, rep_of
+
+    def _cached(self, shas: list[str]) -> Optional[str]:
+        for sha256 in shas:
+            description = self.cache.get(sha256)
+            if description is not None:
+                return description
+        return None
+
+    def run(self, paths: list[str], output_path: str) -> dict:
+        started_at = time.time()
+        groups, sha_of, unreadable, local = self.group(paths)
+        # Mô tả của một nhóm được cache dưới sha256 của mọi file trong nhóm
+        shas_of = {rep: sorted({sha_of[path] for path in members}) for rep, members in groups.items()}
+
+        # Ghi lại toàn bộ file mỗi lần chạy, ảnh đã mô tả được lấy từ cache nên không tốn request
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        n_cache_hits, n_described, n_local = 0, 0, 0
+
+        with JsonlSink(output_path) as sink:
+            def write_group(members: list, description: str, status: str) -> None:
+                for path in members:
+                    sink.write({"path": path, "image_description": description, "image_hash": sha_of.get(path),
+                                "status": status})
+
+            pending = []
+            for rep, members in groups.items():
+                if rep in local:
+                    n_local += len(members)
+                    write_group(members, local[rep][1], local[rep][0])
+                    continue
+                cached = self._cached(shas_of[rep]) if self.cache is not None else None
+                if cached is not None:
+                    n_cache_hits += len(members)
+                    write_group(members, cached, STATUS_OK)
+                else:
+                    pending.append(rep)
+            logger.debug(f"{len(paths)} ảnh, {len(groups)} hình khác nhau, {n_local} ảnh xử lý tại chỗ, {n_cache_hits} ảnh có trong cache, "
+                         f"{len(pending)} hình cần mô tả với {self.workers} worker")
+
+            n_rounds = 0
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while pending and n_rounds < self.max_rounds:
+                    if n_rounds > 0:
+                        logger.info(f"Vòng {n_rounds + 1}: thử lại {len(pending)} hình sau {self.retry_wait:.0f}s")
+                        time.sleep(self.retry_wait)
+                    n_rounds += 1
+                    failed = []
+                    futures = {executor.submit(self.describe, groups[rep][0]): rep for rep in pending}
+                    for future in as_completed(futures):
+                        rep = futures[future]
+                        try:
+                            description = future.result()
+                        except Exception as e:
+                            logger.warning(f"Mô tả ảnh {groups[rep][0]} lỗi {e}")
+                            if self.cache is not None:
+                                for sha256 in shas_of[rep]:
+                                    self.cache.mark_retry(sha256, str(e))
+                            failed.append(rep)
+                            continue
+                        if self.cache is not None:
+                            for sha256 in shas_of[rep]:
+                                self.cache.put(sha256, description, self.model)
+                        write_group(groups[rep], description, STATUS_OK)
+                        n_described += 1
+                    pending = failed
+
+            for rep in pending:
+                write_group(groups[rep], "", STATUS_RETRY)
+            write_group(unreadable, "", STATUS_UNREADABLE)
+
+        return {
+            "images": len(paths),
+            "unique": len(groups),
+            "local": n_local,
+            "cache_hits": n_cache_hits,
+            "described": n_described,
+            "retry": sum(len(groups[rep]) for rep in pending),
+            "unreadable": len(unreadable),
+            "rounds": n_rounds,
+            "seconds": time.time() - started_at,
+            "keys": self.key_pool.stats(),
+        }
+
+if __name__ == "__main__":
+    from label import read_api_keys, API_KEYS_FILE
+
+    parser = argparse.ArgumentParser(description="Sinh mô tả ảnh bằng Gemini, gom ảnh trùng theo sha256 và perceptual hash")
+    parser.add_argument("--image-dir", default="data/image")
+    parser.add_argument("--output", default="image_descriptions.jsonl")
+    parser.add_argument("--keys-file", default=API_KEYS_FILE)
+    parser.add_argument("--rpm-per-key", type=float, default=DEFAULT_RPM_PER_KEY)
+    parser.add_argument("--workers-per-key", type=int, default=2)
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Đổi sang server giả lập (llm_stub.py) để thử")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-rounds", type=int, default=DEFAULT_MAX_ROUNDS, help="Số vòng thử lại ảnh lỗi")
+    parser.add_argument("--retry-wait", type=float, default=DEFAULT_RETRY_WAIT)
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Số bit lệch tối đa giữa hai dHash để xét ghép (vẫn phải khớp thumbnail), 0 = phải trùng hẳn")
+    parser.add_argument("--cache", default=DEFAULT_IMAGE_DESC_CACHE_PATH)
+    parser.add_argument("--templates", default=DEFAULT_TEMPLATES_PATH,
+                        help="Icon template do image_prefilter.py tạo, dùng để lọc ảnh trước khi gọi LLM")
+    parser.add_argument("--no-prefilter", action="store_true", help="Gửi mọi ảnh đi mô tả")
+    args = parser.parse_args()
+
+    key_pool = KeyPool(read_api_keys(args.keys_file), rpm_per_key=args.rpm_per_key, model=args.model,
+                       base_url=args.base_url)
+    cache = ImageDescCache(args.cache)
+    prefilter = None if args.no_prefilter else ImagePrefilter.load(args.templates)
+    describer = ImageDescriber(key_pool, workers_per_key=args.workers_per_key, cache=cache, model=args.model,
+                               max_rounds=args.max_rounds, retry_wait=args.retry_wait, max_distance=args.max_distance,
+                               prefilter=prefilter)
+    result = describer.run(list_images(args.image_dir), args.output)
+    cache.close()
+
+    print(f"{result['images']} ảnh, {result['unique']} hình khác nhau: {result['local']} ảnh xử lý tại chỗ, "
+          f"{result['cache_hits']} ảnh lấy từ cache, "
+          f"{result['described']} hình mô tả mới, {result['retry']} ảnh chờ thử lại, "
+          f"{result['unreadable']} ảnh không đọc được, {result['seconds']:.0f}s")
+    for stats in result["keys"]:
+        print(f"  key #{stats['key']}: {stats['requests']} request, {stats['rate_limited']} lần 429"
+              + (", hết hạn mức" if stats['retired'] else ""))
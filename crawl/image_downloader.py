@@ -0,0 +1,122 @@
+from logger import setup_logger
+from image_store import ImageStore
+from metrics import Metrics
+from typing import Optional
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+class ImageDownloader():
+    '''
+    Pool worker tải ảnh nền. Parser chỉ đưa (uri, path) vào hàng đợi và nhận lại path ngay,
+    worker tải ảnh theo từng chunk xuống đĩa. Hàng đợi có giới hạn nên khi CDN chậm
+    thì luồng parse bị chặn lại thay vì dồn vô hạn ảnh vào bộ nhớ.
+    '''
+    def __init__(self, n_workers: int = 4, max_queue: int = 256, chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._planned = set()
+        self._closed = False
+
+        self.completed = []
+        self.failed = []
+        self.n_skipped = 0
+        self.n_bytes = 0
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"image-downloader-{i}", daemon=True)
+            for i in range(n_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, uri: str, path: str) -> str:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ImageDownloader đã đóng")
+            # Cùng một ảnh xuất hiện nhiều lần trong một lượt crawl chỉ tải một lần
+            if path in self._planned:
+                return path
+            self._planned.add(path)
+
+        self._queue.put((uri, path))
+        return path
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                uri, path = item
+                self._download(uri, path)
+            finally:
+                self._queue.task_done()
+
+    def _download(self, uri: str, path: str) -> None:
+        try:
+            store = ImageStore.for_dir(os.path.dirname(path) or ".")
+            if store.ensure(uri, path):
+                # Ảnh đã có trong kho, không cần tải lại
+                with self._lock:
+                    self.completed.append(path)
+                    self.n_skipped += 1
+                Metrics.inc("crawler_images_total", status="cached")
+                return
+
+            start = time.perf_counter()
+            n_bytes = store.fetch(uri, path, chunk_size=self.chunk_size)
+            with self._lock:
+                self.completed.append(path)
+                self.n_bytes += n_bytes
+            Metrics.inc("crawler_images_total", status="downloaded")
+            Metrics.inc("crawler_image_bytes_total", n_bytes)
+            Metrics.observe("crawler_image_download_seconds", time.perf_counter() - start)
+        except Exception as e:
+            Metrics.inc("crawler_images_total", status="failed")
+            logger.warning(f"Không tải được ảnh {uri} {e}")
+            with self._lock:
+                self.failed.append({"uri": uri, "path": path, "error": str(e)})
+
+    def join(self) -> None:
+        self._queue.join()
+
+    def close(self) -> dict:
+        '''
+        Chờ tải hết ảnh trong hàng đợi, dừng worker và trả về báo cáo.
+        '''
+        with self._lock:
+            if self._closed:
+                return self.report()
+            self._closed = True
+
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        report = self.report()
+        logger.debug(f"Tải ảnh xong: {report['completed']} thành công, {report['failed']} thất bại")
+        return report
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "planned": len(self._planned),
+                "completed": len(self.completed),
+                "skipped": self.n_skipped,
+                "failed": len(self.failed),
+                "bytes": self.n_bytes,
+                "failures": list(self.failed),
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
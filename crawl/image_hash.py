@@ -0,0 +1,54 @@
+from PIL import Image
+import hashlib
+
+def load_rgb(path: str) -> Image.Image:
+    # Icon PNG trong suốt được đặt lên nền trắng, nếu không nền sẽ thành màu đen khi bỏ kênh alpha
+    with Image.open(path) as img:
+        img.load()
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            return Image.alpha_composite(background, img).convert("RGB")
+        return img.convert("RGB")
+
+def dhash(img: Image.Image, size: int = 8) -> str:
+    '''
+    Difference hash: so sánh độ sáng các điểm ảnh kề nhau trên ảnh xám (size+1)x size.
+    Cùng một hình được lưu ở kích thước hoặc định dạng khác cho hash giống hoặc lệch vài bit.
+    '''
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def image_hash(path: str) -> str:
+    return dhash(load_rgb(path))
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Ảnh xám 64x64: cùng một hình resize/nén lại lệch tối đa chừng 20 mức xám ở một điểm,
+# hai ảnh cùng bố cục khác chữ (dHash trùng nhau) lệch trên 50 ở vùng chữ
+THUMBNAIL_SIZE = 64
+DEFAULT_MAX_PIXEL_DIFF = 32
+
+def thumbnail(img: Image.Image, size: int = THUMBNAIL_SIZE) -> bytes:
+    return img.convert("L").resize((size, size), Image.BILINEAR).tobytes()
+
+def same_picture(a: bytes, b: bytes, max_diff: int = DEFAULT_MAX_PIXEL_DIFF) -> bool:
+    '''
+    Xác nhận hai ảnh có dHash gần nhau là cùng một hình: không điểm nào trên thumbnail lệch quá max_diff.
+    '''
+    return len(a) == len(b) and all(abs(x - y) <= max_diff for x, y in zip(a, b))
@@ -0,0 +1,138 @@
+from logger import setup_logger
+from output_sink import iter_jsonl
+from image_hash import load_rgb, dhash, hamming
+from image_store import ImageStore
+from typing import Optional
+from PIL import Image
+import argparse
+import json
+import math
+import os
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_TEMPLATES_PATH = "./api_info/reaction_icons.json"
+# Ảnh nhỏ hơn thế này (cạnh ngắn, px) không đủ chi tiết để có người hay chữ đọc được
+DEFAULT_MIN_SIDE = 48
+# Entropy màu (bit, trên 64 màu) của khung trống/một màu gần 0, ảnh thật và sticker đều trên 2.5
+DEFAULT_MIN_ENTROPY = 2.0
+# Icon cảm xúc/sticker trong comment là ảnh vuông 80px, ảnh lớn hơn thế này không so với template
+DEFAULT_MAX_ICON_SIDE = 128
+DEFAULT_MAX_TEMPLATE_DISTANCE = 2
+ICON_PREFIX = "Icon"
+# Mô tả có chữ trích từ ảnh chỉ đúng cho đúng ảnh đó, không dùng làm template
+TEXT_MARKERS = ("Chữ trong ảnh", "Văn bản trong ảnh", "Ảnh có người")
+
+DECISION_SEND = "send"
+DECISION_ICON = "icon"
+DECISION_SKIP = "skip"
+
+def colour_entropy(img: Image.Image, colors: int = 64) -> float:
+    small = img.convert("RGB").resize((64, 64)).quantize(colors)
+    hist = [count for count in small.histogram() if count]
+    total = sum(hist)
+    return -sum(count / total * math.log2(count / total) for count in hist)
+
+def has_text(description: str) -> bool:
+    return any(marker in description for marker in TEXT_MARKERS)
+
+class ImagePrefilter():
+    '''
+    Phân loại ảnh trên CPU trước khi gọi LLM: ảnh quá nhỏ hoặc gần như một màu bị bỏ qua với mô tả rỗng,
+    ảnh cỡ icon khớp icon cảm xúc đã biết (so dHash với template) nhận luôn mô tả cố định, còn lại mới gửi đi.
+    '''
+    def __init__(self, templates: Optional[dict] = None, min_side: int = DEFAULT_MIN_SIDE,
+                 min_entropy: float = DEFAULT_MIN_ENTROPY, max_distance: int = DEFAULT_MAX_TEMPLATE_DISTANCE,
+                 max_icon_side: int = DEFAULT_MAX_ICON_SIDE):
+        # templates: {dhash: mô tả cố định}, bỏ các template có chữ còn sót trong file cũ
+        self.templates = {hash_: description for hash_, description in (templates or dict()).items()
+                          if not has_text(description)}
+        self.min_side = min_side
+        self.max_icon_side = max_icon_side
+        self.min_entropy = min_entropy
+        self.max_distance = max_distance
+
+    @staticmethod
+    def load(path: str = DEFAULT_TEMPLATES_PATH, **kwargs) -> "ImagePrefilter":
+        templates = dict()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                templates = json.load(f)
+            logger.debug(f"Load {len(templates)} icon template từ {path}")
+        else:
+            logger.warning(f"Không có file template {path}, chỉ lọc theo kích thước và entropy")
+        return ImagePrefilter(templates, **kwargs)
+
+    @staticmethod
+    def build_templates(descriptions_path: str, image_dir: str, prefix: str = ICON_PREFIX,
+                        max_icon_side: int = DEFAULT_MAX_ICON_SIDE) -> dict:
+        '''
+        Lấy các icon cảm xúc đã được mô tả trong image_descriptions.jsonl làm template: {dHash của ảnh: mô tả}.
+        Chỉ lấy ảnh cỡ icon có mô tả không kèm chữ trích từ ảnh.
+        '''
+        templates, store = dict(), ImageStore.for_dir(image_dir)
+        for record in iter_jsonl(descriptions_path):
+            description = record.get("image_description") or ""
+            if not description.startswith(prefix) or has_text(description):
+                continue
+            path = os.path.join(image_dir, record["path"].replace("\\", "/").rsplit("/", 1)[-1])
+            try:
+                img = load_rgb(store.model_input(path))
+            except Exception as e:
+                logger.warning(f"Bỏ qua template {path} {e}")
+                continue
+            if max(img.size) <= max_icon_side:
+                templates.setdefault(dhash(img), description)
+        return templates
+
+    def match_icon(self, hash_: str) -> Optional[str]:
+        description = self.templates.get(hash_)
+        if description is not None:
+            return description
+        best, best_distance = None, self.max_distance + 1
+        for template_hash, template_description in self.templates.items():
+            distance = hamming(hash_, template_hash)
+            if distance < best_distance:
+                best, best_distance = template_description, distance
+        return best
+
+    def classify(self, img: Image.Image, hash_: str) -> tuple[str, Optional[str]]:
+        '''
+        Trả về (quyết định, mô tả): (icon, mô tả cố định), (skip, "") hoặc (send, None).
+        '''
+        if min(img.size) < self.min_side:
+            return DECISION_SKIP, ""
+        if max(img.size) <= self.max_icon_side:
+            description = self.match_icon(hash_)
+            if description is not None:
+                return DECISION_ICON, description
+        if colour_entropy(img) < self.min_entropy:
+            return DECISION_SKIP, ""
+        return DECISION_SEND, None
+
+if __name__ == "__main__":
+    from image_describer import list_images, model_input
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Tạo icon template từ mô tả ảnh đã có và thống kê kết quả lọc")
+    parser.add_argument("--descriptions", required=True, help="image_descriptions.jsonl đã có")
+    parser.add_argument("--image-dir", default="data/image")
+    parser.add_argument("--output", default=DEFAULT_TEMPLATES_PATH)
+    args = parser.parse_args()
+
+    templates = ImagePrefilter.build_templates(args.descriptions, args.image_dir)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(templates, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi {len(templates)} icon template vào {args.output}")
+
+    prefilter = ImagePrefilter(templates)
+    decisions = Counter()
+    for path in list_images(args.image_dir):
+        try:
+            img = load_rgb(model_input(path))
+        except Exception:
+            continue
+        decisions[prefilter.classify(img, dhash(img))[0]] += 1
+    print(f"Kết quả lọc {args.image_dir}: " + ", ".join(f"{k}: {v}" for k, v in decisions.most_common()))
@@ -0,0 +1,386 @@
+from logger import setup_logger
+from http_client import HttpClient
+from typing import Optional
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import logging
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+INDEX_FILE_NAME = "image_index.jsonl"
+OBJECTS_DIR_NAME = "objects"
+DERIVED_DIR_NAME = "derived"
+DERIVATIVE_FORMATS = {"webp": ".webp", "jpeg": ".jpg"}
+DEFAULT_DERIVE_MAX_SIDE = 1024
+DEFAULT_DERIVE_QUALITY = 80
+
+class ImageStore():
+    '''
+    Kho ảnh định danh theo nội dung: bytes của ảnh được lưu một lần tại
+    objects/<2 ký tự đầu>/<sha256><ext>, còn đường dẫn cũ save_dir/<basename> chỉ là
+    hard link tới object đó. Index (basename của URI -> sha256) cho phép bỏ qua
+    request mạng khi ảnh đã có trong kho. Nếu bật configure_derivatives, mỗi ảnh mới tải có thêm
+    một bản thu nhỏ (derived/, WebP hoặc JPEG, cạnh dài tối đa derive_max_side) dùng cho mô tả ảnh
+    và các model phía sau; có thể bỏ luôn bản gốc, khi đó save_dir/<basename> cũng bị xoá (không để
+    tên .jpg/.png trỏ tới bytes WebP) và được thay bằng save_dir/<tên không đuôi><đuôi bản thu nhỏ>
+    link tới bản thu nhỏ. Crawler lấy đường dẫn ghi vào JSON qua local_path() nên đường dẫn đó luôn tồn tại.
+    '''
+    _stores = dict()
+    _stores_lock = threading.Lock()
+
+    # None = không tạo bản thu nhỏ
+    derive_max_side: Optional[int] = None
+    derive_format = "webp"
+    derive_quality = DEFAULT_DERIVE_QUALITY
+    keep_originals = True
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, OBJECTS_DIR_NAME)
+        self.index_path = os.path.join(root, INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+        # sha256 -> các key cùng nội dung, để derive không phải quét cả index
+        self._keys_by_sha = dict()
+        # Tên file của bản thu nhỏ trong root -> key, để tra ngược từ đường dẫn đã ghi trong JSON
+        self._keys_by_derived_name = dict()
+        self._index = dict()
+        for record in self._load_index().values():
+            self._set_record(record)
+
+    @staticmethod
+    def for_dir(root: str) -> "ImageStore":
+        '''
+        Trả về ImageStore dùng chung cho thư mục root (mỗi thư mục chỉ load index một lần).
+        '''
+        key = os.path.abspath(root)
+        with ImageStore._stores_lock:
+            if key not in ImageStore._stores:
+                ImageStore._stores[key] = ImageStore(root)
+            return ImageStore._stores[key]
+
+    @staticmethod
+    def configure_derivatives(max_side: Optional[int] = DEFAULT_DERIVE_MAX_SIDE, fmt: str = "webp",
+                              quality: int = DEFAULT_DERIVE_QUALITY, keep_originals: bool = True) -> None:
+        if fmt not in DERIVATIVE_FORMATS:
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+        if max_side and not PIL_AVAILABLE:
+            logger.warning("Chưa cài Pillow, không tạo bản thu nhỏ cho ảnh")
+            max_side = None
+        ImageStore.derive_max_side = max_side
+        ImageStore.derive_format = fmt
+        ImageStore.derive_quality = quality
+        # Chỉ bỏ bản gốc khi thật sự có bản thu nhỏ thay thế
+        ImageStore.keep_originals = keep_originals or not max_side
+        logger.debug(f"Cấu hình bản thu nhỏ max_side={max_side} format={fmt} quality={quality} "
+                     f"keep_originals={ImageStore.keep_originals}")
+
+    @staticmethod
+    def uri_key(uri: str) -> str:
+        # Query string của CDN thay đổi theo phiên, tên file thì ổn định
+        return os.path.basename(uri.split("?")[0])
+
+    def _load_index(self) -> dict:
+        index = dict()
+        if not os.path.exists(self.index_path):
+            return index
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    index[record["key"]] = record
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+        logger.debug(f"Load image index {self.index_path} thành công: {len(index)} ảnh")
+        return index
+
+    def _set_record(self, record: dict) -> None:
+        old = self._index.get(record["key"])
+        if old is not None and old["sha256"] != record["sha256"]:
+            self._keys_by_sha.get(old["sha256"], set()).discard(record["key"])
+        self._index[record["key"]] = record
+        self._keys_by_sha.setdefault(record["sha256"], set()).add(record["key"])
+        if record.get("derived"):
+            self._keys_by_derived_name[ImageStore._derived_name(record["key"], record["derived"])] = record["key"]
+
+    @staticmethod
+    def _derived_name(key: str, derived: str) -> str:
+        # derived là đường dẫn bản thu nhỏ trong index hoặc chỉ đuôi file (".webp")
+        ext = derived if derived.startswith(".") else os.path.splitext(derived)[1]
+        return os.path.splitext(key)[0] + ext
+
+    def _record_of(self, path_or_uri: str) -> Optional[dict]:
+        name = ImageStore.uri_key(path_or_uri)
+        record = self._index.get(name)
+        if record is None and name in self._keys_by_derived_name:
+            record = self._index.get(self._keys_by_derived_name[name])
+        return record
+
+    def local_path(self, uri: str) -> str:
+        '''
+        Đường dẫn trong root để ghi vào dữ liệu crawl cho ảnh uri: tên cũ save_dir/<basename> nếu
+        bản gốc được giữ, tên theo đuôi bản thu nhỏ nếu bản gốc đã hoặc sẽ bị bỏ.
+        '''
+        key = ImageStore.uri_key(uri)
+        record = self._index.get(key)
+        if record is not None:
+            dropped = bool(record.get("derived")) and not os.path.exists(self.object_path(record["sha256"], record["ext"]))
+            derived = record.get("derived")
+        else:
+            dropped = bool(ImageStore.derive_max_side) and not ImageStore.keep_originals
+            derived = DERIVATIVE_FORMATS[ImageStore.derive_format]
+        return os.path.join(self.root, ImageStore._derived_name(key, derived) if dropped else key)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._index)
+
+    def _append_index(self, record: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def object_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}{ext}")
+
+    def hash_of(self, path_or_uri: str) -> Optional[str]:
+        record = self._record_of(path_or_uri)
+        return record["sha256"] if record else None
+
+    def resolve(self, path_or_uri: str) -> Optional[str]:
+        '''
+        Trả về đường dẫn object của ảnh nếu ảnh đã có trong kho.
+        '''
+        record = self._record_of(path_or_uri)
+        if not record:
+            return None
+        object_path = self.object_path(record["sha256"], record["ext"])
+        if os.path.exists(object_path):
+            return object_path
+        # Bản gốc đã bị bỏ, bản thu nhỏ thay thế
+        derived_path = self.derived_path(record)
+        return derived_path if derived_path and os.path.exists(derived_path) else None
+
+    def derived_path(self, record: dict) -> Optional[str]:
+        return os.path.join(self.root, record["derived"]) if record.get("derived") else None
+
+    def model_input(self, path: str) -> str:
+        '''
+        Đường dẫn nên dùng khi đưa ảnh vào model: bản thu nhỏ nếu có, không thì chính path.
+        '''
+        record = self._record_of(path)
+        derived_path = self.derived_path(record) if record else None
+        return derived_path if derived_path and os.path.exists(derived_path) else path
+
+    def derive(self, key: str) -> Optional[str]:
+        '''
+        Tạo bản thu nhỏ cho ảnh key theo cấu hình hiện tại, ghi vào index và trả về đường dẫn.
+        Bản thu nhỏ không nhỏ hơn bản gốc (icon PNG vài KB) thì giữ bản gốc, trừ khi bản gốc sẽ bị bỏ.
+        '''
+        record = self._index.get(key)
+        if not ImageStore.derive_max_side or record is None:
+            return None
+        object_path = self.object_path(record["sha256"], record["ext"])
+        # Đường dẫn tương đối dạng posix để index dùng được trên cả Windows lẫn Linux
+        relative_path = (f"{DERIVED_DIR_NAME}/{record['sha256'][:2]}/{record['sha256']}_{ImageStore.derive_max_side}"
+                         f"{DERIVATIVE_FORMATS[ImageStore.derive_format]}")
+        derived_path = os.path.join(self.root, relative_path)
+
+        if not os.path.exists(derived_path):
+            if not os.path.exists(object_path):
+                return None
+            os.makedirs(os.path.dirname(derived_path), exist_ok=True)
+            tmp_path = f"{derived_path}.{threading.get_ident()}.tmp"
+            with Image.open(object_path) as img:
+                img.load()
+                img.thumbnail((ImageStore.derive_max_side, ImageStore.derive_max_side), Image.LANCZOS)
+                if ImageStore.derive_format == "jpeg" or img.mode not in ("RGB", "RGBA"):
+                    img = ImageStore._flatten(img, keep_alpha=ImageStore.derive_format == "webp")
+                img.save(tmp_path, format=ImageStore.derive_format.upper(), quality=ImageStore.derive_quality)
+            if ImageStore.keep_originals and os.path.getsize(tmp_path) >= os.path.getsize(object_path):
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, derived_path)
+
+        with self._lock:
+            same_content = [self._index[other_key] for other_key in sorted(self._keys_by_sha.get(record["sha256"], ()))]
+            for other in same_content:
+                if other.get("derived") != relative_path:
+                    other = {**other, "derived": relative_path}
+                    self._set_record(other)
+                    self._append_index(other)
+            if not ImageStore.keep_originals and os.path.exists(object_path):
+                # Các tên file cùng nội dung đang là hard link tới bản gốc: xoá và link tên theo đuôi
+                # bản thu nhỏ thay vào, để đuôi .jpg/.png không nói sai định dạng bytes bên trong
+                for other in same_content:
+                    ImageStore._unlink_if_same(object_path, os.path.join(self.root, other["key"]))
+                    ImageStore._link(derived_path, os.path.join(self.root, ImageStore._derived_name(other["key"], relative_path)))
+                os.remove(object_path)
+        return derived_path
+
+    @staticmethod
+    def _flatten(img, keep_alpha: bool):
+        if img.mode in ("RGBA", "LA", "P", "PA"):
+            img = img.convert("RGBA")
+            if keep_alpha:
+                return img
+            background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            return Image.alpha_composite(background, img).convert("RGB")
+        return img.convert("RGB")
+
+    @staticmethod
+    def _unlink_if_same(src: str, dst: str) -> None:
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            os.remove(dst)
+
+    @staticmethod
+    def _link(src: str, dst: str) -> None:
+        # Không link khi đuôi tên file khác định dạng bytes bên trong
+        if os.path.splitext(src)[1].lower() != os.path.splitext(dst)[1].lower():
+            return
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            # Hệ thống file không hỗ trợ hard link thì chép bản sao
+            shutil.copyfile(src, dst)
+
+    def ensure(self, uri: str, path: str) -> bool:
+        '''
+        Nếu ảnh của uri đã có trong kho thì đảm bảo path (lấy từ local_path()) trỏ tới bản gốc hoặc
+        bản thu nhỏ cùng đuôi và trả về True, không cần gửi request.
+        '''
+        object_path = self.resolve(uri)
+        if object_path is None:
+            return False
+        ImageStore._link(object_path, path)
+        return True
+
+    def add_file(self, key: str, src_path: str, path: str, sha256: Optional[str] = None, move: bool = False) -> str:
+        '''
+        Đưa file src_path vào kho, link path tới object và ghi index. Trả về sha256.
+        '''
+        if sha256 is None:
+            sha256 = ImageStore.hash_file(src_path)
+        ext = os.path.splitext(key)[1].lower()
+        object_path = self.object_path(sha256, ext)
+
+        with self._lock:
+            if os.path.exists(object_path):
+                # Ảnh trùng nội dung với ảnh đã lưu dưới tên khác
+                if move:
+                    os.remove(src_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                if move:
+                    os.replace(src_path, object_path)
+                else:
+                    shutil.copyfile(src_path, object_path)
+
+            ImageStore._link(object_path, path)
+
+            record = {"key": key, "sha256": sha256, "ext": ext, "size": os.path.getsize(object_path)}
+            existing = self._index.get(key)
+            if existing and existing["sha256"] == sha256 and existing.get("derived"):
+                record["derived"] = existing["derived"]
+            if self._index.get(key) != record:
+                self._set_record(record)
+                self._append_index(record)
+        return sha256
+
+    def fetch(self, uri: str, path: str, chunk_size: int = 64 * 1024) -> int:
+        '''
+        Tải ảnh vào kho nếu chưa có. Trả về số byte đã tải (0 nếu lấy từ kho).
+        '''
+        if self.ensure(uri, path):
+            return 0
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        tmp_path = os.path.join(self.objects_dir, f"{ImageStore.uri_key(uri)}.{threading.get_ident()}.download")
+        hasher = hashlib.sha256()
+        n_bytes = HttpClient.download(uri, tmp_path, chunk_size=chunk_size, hasher=hasher)
+        self.add_file(ImageStore.uri_key(uri), tmp_path, path, sha256=hasher.hexdigest(), move=True)
+        if ImageStore.derive_max_side:
+            try:
+                self.derive(ImageStore.uri_key(uri))
+            except Exception as e:
+                logger.warning(f"Không tạo được bản thu nhỏ cho {uri} {e}")
+        return n_bytes
+
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 64 * 1024) -> str:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def ingest_dir(self, image_dir: str) -> dict:
+        '''
+        Đưa các ảnh có sẵn trong image_dir vào kho (dùng cho dữ liệu crawl trước đây).
+        '''
+        n_files, n_new = 0, 0
+        for name in sorted(os.listdir(image_dir)):
+            path = os.path.join(image_dir, name)
+            if not os.path.isfile(path) or name == INDEX_FILE_NAME or name.endswith(".part"):
+                continue
+            if name not in self._index and name in self._keys_by_derived_name:
+                # Tên theo đuôi bản thu nhỏ của ảnh đã bỏ bản gốc
+                continue
+            n_files += 1
+            resolved = self.resolve(name)
+            if resolved is not None and os.path.samefile(resolved, path):
+                # Đã có trong kho từ lần trước. Tên cũ trỏ tới bản thu nhỏ (bản gốc đã bị bỏ) thì thay
+                # bằng tên theo đuôi bản thu nhỏ, đuôi cũ không còn đúng định dạng
+                record = self._index[name]
+                if resolved == self.derived_path(record):
+                    ImageStore._link(resolved, os.path.join(self.root, ImageStore._derived_name(name, record["derived"])))
+                    os.remove(path)
+                continue
+            sha256 = ImageStore.hash_file(path)
+            if not os.path.exists(self.object_path(sha256, os.path.splitext(name)[1].lower())):
+                n_new += 1
+            self.add_file(name, path, path, sha256=sha256)
+
+        n_derived = 0
+        if ImageStore.derive_max_side:
+            for key in self.keys():
+                try:
+                    n_derived += self.derive(key) is not None
+                except Exception as e:
+                    logger.warning(f"Không tạo được bản thu nhỏ cho {key} {e}")
+
+        logger.debug(f"Ingest {image_dir}: {n_files} ảnh, {n_new} nội dung khác nhau, {n_derived} bản thu nhỏ")
+        return {"files": n_files, "unique": n_new, "derived": n_derived}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đưa thư mục ảnh đã crawl vào kho ảnh định danh theo nội dung")
+    parser.add_argument("image_dir", help="Thư mục ảnh, ví dụ data/image")
+    parser.add_argument("--derive-max-side", type=int, default=None,
+                        help="Tạo bản thu nhỏ có cạnh dài tối đa bằng số px này, ví dụ 1024")
+    parser.add_argument("--derive-format", choices=list(DERIVATIVE_FORMATS), default="webp")
+    parser.add_argument("--derive-quality", type=int, default=DEFAULT_DERIVE_QUALITY)
+    parser.add_argument("--drop-originals", action="store_true",
+                        help="Xoá bản gốc và tên file cũ khi đã có bản thu nhỏ, thay bằng tên theo đuôi bản thu nhỏ. "
+                             "Đường dẫn ảnh trong JSON đã crawl trước đó (.jpg/.png) sẽ không còn tồn tại")
+    args = parser.parse_args()
+
+    ImageStore.configure_derivatives(args.derive_max_side, args.derive_format, args.derive_quality,
+                                     keep_originals=not args.drop_originals)
+    stats = ImageStore.for_dir(args.image_dir).ingest_dir(args.image_dir)
+    print(f"Đã xử lý {stats['files']} ảnh, {stats['unique']} nội dung khác nhau, {stats['derived']} bản thu nhỏ")
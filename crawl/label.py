@@ -1,11 +1,10 @@
 import os
 import json
-import math
-from time import sleep
-import re
-from tqdm import tqdm
 import argparse
-import google.generativeai as genai
+from label_engine import KeyPool, LabelEngine, DEFAULT_BASE_URL, DEFAULT_MODEL, DEFAULT_RPM_PER_KEY
+from label_cache import LabelCache, DEFAULT_LABEL_CACHE_PATH
+from output_sink import iter_jsonl
+from thread_store import ThreadStore
 
 # Đường dẫn và các tham số
 IN_PATH = r"E:\Documents\DS200\final_project\facebook_crawl\data\json\data_filled.json"
@@ -14,8 +13,6 @@ OUT_DIR_BASE = r"E:\Documents\DS200\final_project\facebook_crawl\data\json"
 API_KEYS_FILE = r"E:\Documents\DS200\final_project\facebook_crawl\api_keys.txt"
 KEYS_PER_GROUP = 16
 
-MAX_ITEMS_PER_PART = 450
-
 PROMPT_SOFT = (
     "Bạn là một hệ thống phân tích khía cạnh và cảm xúc của các bài viết và bình luận mạng xã hội, "
     "nhằm theo dõi và phân tích mức độ nhắc đến các cá nhân hoặc nội dung liên quan đến họ.\n\n"
@@ -52,6 +49,22 @@ PROMPT_STRICT = (
     "Sentiment: [<sentiment1>, <sentiment2>]\n"
 )
 
+# Phần đuôi của prompt gộp: giữ nguyên phần hướng dẫn của PROMPT_SOFT/PROMPT_STRICT, chỉ thay phần nội dung và định dạng trả về
+BATCH_SUFFIX = (
+    "Phần dưới gồm {n} nội dung độc lập như vậy, mỗi nội dung mở đầu bằng dòng \"### <số thứ tự>\". "
+    "Phân tích riêng từng nội dung, không dùng ngữ cảnh của nội dung khác.\n\n"
+    "{content}\n\n"
+    "Trả đúng {n} kết quả theo thứ tự, mỗi kết quả mở đầu bằng dòng \"### <số thứ tự>\" "
+    "và ngắn gọn như sau (KHÔNG cần JSON):\n"
+    "### 1\n"
+    "Aspect_1: <tên>\n"
+    "Aspect_2: <tên hoặc null>\n"
+    "Sentiment: [<sentiment1>, <sentiment2>]\n"
+)
+
+def make_batch_prompt(prompt):
+    return prompt.split("Nội dung đầy đủ:")[0] + BATCH_SUFFIX
+
 def read_api_keys(filepath):
     keys = []
     with open(filepath, "r", encoding="utf-8") as f:
@@ -61,15 +74,6 @@ def read_api_keys(filepath):
                 keys.append(line)
     return keys
 
-def split_data(data, num_parts, out_dir):
-    os.makedirs(out_dir, exist_ok=True)
-    chunk_size = math.ceil(len(data) / num_parts)
-    for i in range(num_parts):
-        part = data[i*chunk_size : (i+1)*chunk_size]
-        with open(os.path.join(out_dir, f"data_part_{i:02}.json"), "w", encoding="utf-8") as fout:
-            json.dump(part, fout, ensure_ascii=False, indent=2)
-    print(f"Split {len(data)} items into {num_parts} parts in {out_dir}")
-
 def build_full_text(item):
     parts = []
 
@@ -110,31 +114,6 @@ def build_full_text(item):
     full_text = "\n\n".join(parts)
     return full_text
 
-def call_gemini(api_key, text, prompt):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    sleep(1)
-    resp = model.generate_content([prompt.format(content=text)], stream=False)
-    if resp.candidates and resp.candidates[0].content.parts:
-        txt = resp.candidates[0].content.parts[0].text.strip()
-    else:
-        return {"Aspect_1": "Other", "Aspect_2": None, "Sentiment": ["neutral"]}
-
-    if "Aspect_1" not in txt:
-        return {"Aspect_1": "Other", "Aspect_2": None, "Sentiment": ["neutral"]}
-
-    a1 = re.search(r"Aspect_1:\s*(\w+)", txt)
-    a2 = re.search(r"Aspect_2:\s*(\w+|null)", txt)
-    s_match = re.search(r"Sentiment:\s*\[(.*?)\]", txt)
-
-    a1 = a1.group(1) if a1 else "Other"
-    a2 = a2.group(1)
-    a2 = None if a2 and a2.lower() == "null" else a2
-    sentiments = [s.strip().lower() for s in s_match.group(1).split(",")] if s_match else ["neutral"]
-
-    raw_labels = {"Aspect_1": a1, "Aspect_2": a2, "Sentiment": sentiments}
-    return sanitize_labels(raw_labels)
-
 def sanitize_labels(labels):
     ALLOWED_ASPECTS = {"Health", "Fashion", "Sport", "Food", "Art", "Law", "Other"}
     a1 = labels.get("Aspect_1")
@@ -146,88 +125,76 @@ def sanitize_labels(labels):
     sentiments = labels.get("Sentiment", ["neutral"])
     return {"Aspect_1": a1, "Aspect_2": a2, "Sentiment": sentiments}
 
-def process_part(idx, api_key, prompt, input_dir, output_dir, max_items=MAX_ITEMS_PER_PART, delay_sec=0):
-    print(f"⏳ Waiting {delay_sec}s before starting part {idx:02}...")
-    sleep(delay_sec)
-
-    input_path = os.path.join(input_dir, f"data_part_{idx:02}.json")
-    output_jsonl = os.path.join(output_dir, f"data_labeled_{idx:02}.jsonl")
-    output_json = os.path.join(output_dir, f"data_labeled_{idx:02}.json")
-    error_log = os.path.join(output_dir, f"errors_{idx:02}.txt")
-
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)[:max_items]
-
-    error_items = []
-    labeled_data = []
-    start_idx = 0
-
-    if os.path.exists(output_jsonl):
-        with open(output_jsonl, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    item = json.loads(line)
-                    labeled_data.append(item)
-                except:
-                    break
-        start_idx = len(labeled_data)
-
-    with open(output_jsonl, "a", encoding="utf-8") as fout:
-        for i in tqdm(range(start_idx, len(data)), desc=f"Part {idx:02}"):
-            item = data[i]
-            full_text = build_full_text(item)
-
-            try:
-                sleep(1)
-                labels = call_gemini(api_key, full_text, prompt)
-                item.update(labels)
-                labeled_data.append(item)
-                fout.write(json.dumps(item, ensure_ascii=False) + "\n")
-                tqdm.write(f"[{idx:02}] {i} → A1={labels['Aspect_1']}, A2={labels['Aspect_2']}, S={labels['Sentiment']}")
-            except Exception as e:
-                error_items.append({"part": idx, "index": i, "error": str(e)})
-                tqdm.write(f"[Part {idx:02}] Item {i} ERROR: {e}. Sleeping 2 minutes before retry...")
-                sleep(120)
-
-    with open(output_json, "w", encoding="utf-8") as fout:
-        json.dump(labeled_data, fout, ensure_ascii=False, indent=2)
-
-    with open(error_log, "w", encoding="utf-8") as ferr:
-        for err in error_items:
-            ferr.write(f"Part {err['part']:02} | Index {err['index']} | Error: {err['error']}\n")
-
-    print(f"Done part {idx:02} → labeled: {len(labeled_data)}, errors: {len(error_items)}")
+def load_items(path, image_desc_path=None, max_items=None):
+    # Thư mục <tên>_threads (dạng chuẩn hoá) được đọc qua ThreadView, không chép post vào từng item
+    if os.path.isdir(path):
+        store = ThreadStore(path)
+        if image_desc_path:
+            desc_map = {os.path.basename(obj["path"].replace("\\", "/")): obj["image_description"]
+                        for obj in iter_jsonl(image_desc_path)}
+            store.set_image_descriptions(desc_map)
+        items = list(store.iter_views())
+    elif path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    else:
+        items = list(iter_jsonl(path))
+    return items[:max_items] if max_items else items
 
 def main():
     parser = argparse.ArgumentParser(description="Run Gemini labeling with multiple API key groups and prompts.")
     parser.add_argument("--key-group", type=int, choices=[0,1], required=True,
                         help="Which key group to use: 0 = first 16 keys (soft prompt), 1 = second 16 keys (strict prompt)")
+    parser.add_argument("--input", default=IN_PATH, help="File .json/.jsonl hoặc thư mục _threads của convert_data.py --normalized")
+    parser.add_argument("--image-descriptions", default=None, help="image_descriptions.jsonl, dùng với thư mục _threads")
+    parser.add_argument("--output-dir", default=OUT_DIR_BASE)
+    parser.add_argument("--keys-file", default=API_KEYS_FILE)
+    parser.add_argument("--rpm-per-key", type=float, default=DEFAULT_RPM_PER_KEY)
+    parser.add_argument("--workers-per-key", type=int, default=2)
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Đổi sang server giả lập (llm_stub.py) để thử")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-items", type=int, default=None)
+    parser.add_argument("--cache", default=DEFAULT_LABEL_CACHE_PATH, help="File SQLite cache nhãn, dùng chung mọi lần chạy")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Số nội dung gộp trong một request (ví dụ 10), 1 = mỗi item một request")
     args = parser.parse_args()
 
-    api_keys = read_api_keys(API_KEYS_FILE)
-    total_keys = len(api_keys)
-    if total_keys < 32:
-        raise ValueError(f"Expected at least 32 API keys, found {total_keys}")
+    api_keys = read_api_keys(args.keys_file)
 
     # Chọn 16 keys theo nhóm
     start_idx = args.key_group * KEYS_PER_GROUP
     selected_keys = api_keys[start_idx : start_idx + KEYS_PER_GROUP]
+    if not selected_keys:
+        raise ValueError(f"Không có key nào cho nhóm {args.key_group}, file có {len(api_keys)} key")
 
     # Chọn prompt theo nhóm
     prompt = PROMPT_SOFT if args.key_group == 0 else PROMPT_STRICT
 
     # Chuẩn bị thư mục output cho từng loại prompt
-    out_dir = os.path.join(OUT_DIR_BASE, "soft" if args.key_group == 0 else "strict")
+    out_dir = os.path.join(args.output_dir, "soft" if args.key_group == 0 else "strict")
     os.makedirs(out_dir, exist_ok=True)
 
-    with open(IN_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    split_data(data, KEYS_PER_GROUP, out_dir)
-
-    for idx, api_key in enumerate(selected_keys):
-        delay = 0
-        process_part(idx, api_key, prompt, out_dir, out_dir, delay_sec=delay)
+    items = load_items(args.input, args.image_descriptions, args.max_items)
+
+    key_pool = KeyPool(selected_keys, rpm_per_key=args.rpm_per_key, model=args.model, base_url=args.base_url)
+    cache = None if args.no_cache else LabelCache(args.cache)
+    engine = LabelEngine(key_pool, prompt, build_full_text, sanitize_labels, workers_per_key=args.workers_per_key,
+                         cache=cache, model=args.model, batch_prompt=make_batch_prompt(prompt), batch_size=args.batch_size)
+    result = engine.run(items, os.path.join(out_dir, "data_labeled.jsonl"), os.path.join(out_dir, "errors.jsonl"))
+
+    print(f"Done → labeled: {result['labeled']}, skipped (đã có): {result['skipped']}, "
+          f"errors: {result['errors']}, {result['seconds']:.0f}s với {len(selected_keys)} key")
+    print(f"Cache: {result['cache_hits']} item lấy từ cache, {result['api_items']} nội dung gọi LLM, "
+          f"tiết kiệm {result['calls_saved']} lần gọi")
+    print(f"Batch: {result['batches']} request, {result['fallback']} mục phải gọi lại riêng")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"  {stats['entries']} nhãn trong cache, hit rate {stats['hit_rate']:.1%}")
+        cache.close()
+    for stats in result["keys"]:
+        print(f"  key #{stats['key']}: {stats['requests']} request, {stats['rate_limited']} lần 429"
+              + (", hết hạn mức" if stats['retired'] else ""))
 
 if __name__ == "__main__":
     main()
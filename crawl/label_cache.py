@@ -0,0 +1,77 @@
+from logger import setup_logger
+from typing import Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_LABEL_CACHE_PATH = "./api_info/label_cache.sqlite"
+
+class LabelCache():
+    '''
+    Cache nhãn trên SQLite, khoá là sha256(prompt, full_text): cùng nội dung với cùng prompt
+    chỉ gọi LLM một lần, dùng chung giữa các part, các prompt và các lần chạy lại.
+    '''
+    def __init__(self, path: str = DEFAULT_LABEL_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL để nhiều process gán nhãn cùng đọc/ghi một file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS labels (
+                    key TEXT PRIMARY KEY,
+                    labels TEXT NOT NULL,
+                    model TEXT,
+                    created_at INTEGER NOT NULL
+                )''')
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt: str, full_text: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(full_text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT labels FROM labels WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, labels: dict, model: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO labels (key, labels, model, created_at)
+                VALUES (?, ?, ?, ?)''', (key, json.dumps(labels, ensure_ascii=False), model, int(time.time())))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
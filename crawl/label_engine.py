@@ -0,0 +1,382 @@
+from logger import setup_logger
+from rate_limiter import TokenBucket, backoff_delay
+from output_sink import JsonlSink, iter_jsonl
+from label_cache import LabelCache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Optional
+import base64
+import os
+import re
+import threading
+import time
+import logging
+import requests
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+DEFAULT_MODEL = "gemini-2.5-flash"
+# Hạn mức miễn phí của gemini-2.5-flash là 10 request/phút cho mỗi key
+DEFAULT_RPM_PER_KEY = 10
+DEFAULT_COOLDOWN = 60
+DEFAULT_MAX_RETRY = 5
+# Số lần 429 tối đa cho một prompt trước khi bỏ cuộc và ghi lỗi
+DEFAULT_MAX_RATE_LIMITED = 10
+# Key bị 429 liên tiếp chừng này lần (không có request nào thành công xen giữa) coi như hết hạn mức
+DEFAULT_RETIRE_AFTER = 5
+REQUEST_TIMEOUT = 120
+# Mỗi mục trong prompt gộp và trong câu trả lời mở đầu bằng dòng "### <số thứ tự>"
+BATCH_SECTION_RE = re.compile(r"^[ \t]*#{2,}[ \t]*(\d+)[ \t]*$", re.MULTILINE)
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float, daily: bool = False):
+        super().__init__(f"429{' (hết hạn mức ngày)' if daily else ''}, thử lại sau {retry_after:.0f}s")
+        self.retry_after = retry_after
+        self.daily = daily
+
+class KeysExhausted(Exception):
+    pass
+
+class TransientError(Exception):
+    pass
+
+def _retry_after(resp: requests.Response) -> float:
+    # Gemini trả thời gian chờ trong RetryInfo.retryDelay ("37s"), một số proxy dùng header Retry-After
+    try:
+        for detail in resp.json().get("error", {}).get("details", []):
+            if detail.get("@type", "").endswith("RetryInfo"):
+                return float(detail.get("retryDelay", "").rstrip("s"))
+    except (ValueError, AttributeError):
+        pass
+    try:
+        return float(resp.headers.get("Retry-After", DEFAULT_COOLDOWN))
+    except ValueError:
+        return DEFAULT_COOLDOWN
+
+def _is_daily_quota(resp: requests.Response) -> bool:
+    # Hết hạn mức ngày thì QuotaFailure có quotaId dạng "GenerateRequestsPerDayPerProjectPerModel-FreeTier"
+    try:
+        for detail in resp.json().get("error", {}).get("details", []):
+            if detail.get("@type", "").endswith("QuotaFailure"):
+                if any("PerDay" in violation.get("quotaId", "") for violation in detail.get("violations", [])):
+                    return True
+    except (ValueError, AttributeError):
+        pass
+    return False
+
+class GeminiClient():
+    '''
+    Gọi generateContent qua REST với một key, giữ kết nối bằng requests.Session.
+    base_url đổi được để chạy với server giả lập cục bộ (llm_stub.py).
+    '''
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL, base_url: str = DEFAULT_BASE_URL):
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.session = requests.Session()
+
+    def generate(self, text: str, images: Optional[list[tuple[str, bytes]]] = None) -> str:
+        '''
+        images là danh sách (mime_type, bytes), gửi kèm prompt dưới dạng inline_data.
+        '''
+        parts = [{"text": text}]
+        for mime_type, data in images or []:
+            parts.append({"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode("ascii")}})
+        try:
+            resp = self.session.post(self.url, headers={"x-goog-api-key": self.api_key},
+                                     json={"contents": [{"parts": parts}]}, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            raise TransientError(f"Lỗi kết nối {e}") from e
+
+        if resp.status_code == 429:
+            raise RateLimited(_retry_after(resp), daily=_is_daily_quota(resp))
+        if resp.status_code >= 500:
+            raise TransientError(f"Server trả về {resp.status_code}")
+        resp.raise_for_status()
+
+        candidates = resp.json().get("candidates") or []
+        parts = (candidates[0].get("content") or {}).get("parts") or [] if candidates else []
+        return parts[0].get("text", "").strip() if parts else ""
+
+class KeySlot():
+    def __init__(self, index: int, client: GeminiClient, rpm: float):
+        self.index = index
+        self.client = client
+        # Tốc độ cố định theo hạn mức của key, bị chặn thì giảm rồi tăng dần lại
+        self.bucket = TokenBucket(rpm / 60, max_rate=rpm / 60)
+        self.cooldown_until = 0.0
+        self.n_requests = 0
+        self.n_rate_limited = 0
+        self.n_consecutive_rate_limited = 0
+        # Key hết hạn mức không được dùng nữa trong lượt chạy này
+        self.retired = False
+
+class KeyPool():
+    '''
+    Chia request cho nhiều key, mỗi key một token bucket. Key bị 429 được tạm rút khỏi vòng quay
+    cho đến hết thời gian chờ server yêu cầu; hết hạn mức ngày hoặc bị 429 liên tiếp retire_after lần
+    thì bị loại hẳn. Hết key dùng được thì call() raise KeysExhausted thay vì chờ mãi.
+    '''
+    def __init__(self, api_keys: list[str], rpm_per_key: float = DEFAULT_RPM_PER_KEY, model: str = DEFAULT_MODEL,
+                 base_url: str = DEFAULT_BASE_URL, retire_after: int = DEFAULT_RETIRE_AFTER):
+        if not api_keys:
+            raise ValueError("Cần ít nhất một API key")
+        self.slots = [KeySlot(i, GeminiClient(key, model, base_url), rpm_per_key) for i, key in enumerate(api_keys)]
+        self.retire_after = retire_after
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self) -> KeySlot:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                active = [slot for slot in self.slots if not slot.retired]
+                if not active:
+                    raise KeysExhausted("Tất cả key đã hết hạn mức")
+                ready = [slot for slot in active if slot.cooldown_until <= now]
+                if ready:
+                    # Xoay vòng giữa các key đang dùng được
+                    slot = ready[self._next % len(ready)]
+                    self._next += 1
+                    wait_time = 0.0
+                else:
+                    slot = None
+                    wait_time = min(s.cooldown_until for s in active) - now
+            if slot is None:
+                logger.warning(f"Tất cả key đang bị chặn, chờ {wait_time:.0f}s")
+                time.sleep(wait_time)
+                continue
+            delay = slot.bucket.reserve()
+            if delay > 0:
+                time.sleep(delay)
+            return slot
+
+    def on_rate_limited(self, slot: KeySlot, retry_after: float, daily: bool = False) -> None:
+        with self._lock:
+            slot.cooldown_until = time.monotonic() + retry_after
+            slot.n_rate_limited += 1
+            slot.n_consecutive_rate_limited += 1
+            if daily or slot.n_consecutive_rate_limited >= self.retire_after:
+                slot.retired = True
+        slot.bucket.on_throttle()
+        if slot.retired:
+            logger.warning(f"Key #{slot.index} hết hạn mức ({slot.n_consecutive_rate_limited} lần 429 liên tiếp), bỏ key")
+        else:
+            logger.warning(f"Key #{slot.index} bị 429, tạm nghỉ {retry_after:.0f}s")
+
+    def call(self, text: str, images: Optional[list[tuple[str, bytes]]] = None,
+             max_retry: int = DEFAULT_MAX_RETRY, max_rate_limited: int = DEFAULT_MAX_RATE_LIMITED) -> str:
+        '''
+        Gửi một prompt, tự chọn key và thử lại; 429 không tính vào số lần thử vì đã đổi sang key khác,
+        nhưng bị 429 quá max_rate_limited lần thì raise để item được ghi lỗi.
+        '''
+        attempt, n_rate_limited = 0, 0
+        while True:
+            slot = self.acquire()
+            slot.n_requests += 1
+            try:
+                result = slot.client.generate(text, images)
+                slot.bucket.on_success()
+                slot.n_consecutive_rate_limited = 0
+                return result
+            except RateLimited as e:
+                self.on_rate_limited(slot, e.retry_after, e.daily)
+                n_rate_limited += 1
+                if n_rate_limited >= max_rate_limited:
+                    raise
+            except TransientError as e:
+                if attempt >= max_retry:
+                    raise
+                delay = backoff_delay(attempt, base=2.0)
+                logger.warning(f"{e}, thử lại lần {attempt + 1} sau {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def stats(self) -> list[dict]:
+        return [{"key": slot.index, "requests": slot.n_requests, "rate_limited": slot.n_rate_limited,
+                 "retired": slot.retired} for slot in self.slots]
+
+def parse_labels(txt: str) -> dict:
+    '''
+    Đọc câu trả lời dạng "Aspect_1: ... / Aspect_2: ... / Sentiment: [...]", chưa qua sanitize_labels.
+    '''
+    if not txt or "Aspect_1" not in txt:
+        return {"Aspect_1": "Other", "Aspect_2": None, "Sentiment": ["neutral"]}
+
+    a1 = re.search(r"Aspect_1:\s*(\w+)", txt)
+    a2 = re.search(r"Aspect_2:\s*(\w+|null)", txt)
+    s_match = re.search(r"Sentiment:\s*\[(.*?)\]", txt)
+
+    a1 = a1.group(1) if a1 else "Other"
+    a2 = a2.group(1) if a2 else None
+    a2 = None if a2 and a2.lower() == "null" else a2
+    sentiments = [s.strip().lower() for s in s_match.group(1).split(",")] if s_match else ["neutral"]
+    return {"Aspect_1": a1, "Aspect_2": a2, "Sentiment": sentiments}
+
+def format_batch(texts: list[str]) -> str:
+    return "\n\n".join(f"### {i}\n\"\"\"\n{text}\n\"\"\"" for i, text in enumerate(texts, 1))
+
+def parse_batch(txt: str, n: int) -> dict:
+    '''
+    Tách câu trả lời của prompt gộp theo các dòng "### <số>", trả về {vị trí: nhãn chưa sanitize}.
+    Mục thiếu, trùng số, ngoài khoảng 1..n hoặc không có Aspect_1 bị bỏ để gọi lại riêng.
+    '''
+    results = dict()
+    if not txt:
+        return results
+    matches = list(BATCH_SECTION_RE.finditer(txt))
+    for i, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(txt)
+        section = txt[match.end():end]
+        if 1 <= number <= n and number - 1 not in results and "Aspect_1" in section:
+            results[number - 1] = parse_labels(section)
+    return results
+
+class LabelEngine():
+    '''
+    Gán nhãn song song bằng tất cả key: mỗi key một token bucket, key bị 429 được tạm nghỉ,
+    lỗi tạm thời được thử lại với exponential backoff. Kết quả ghi JSONL ngay khi có,
+    kèm item_index để chạy lại thì bỏ qua các item đã xong. Có cache thì item trùng nội dung
+    (trong lượt chạy hoặc đã gán nhãn trước đó) không gọi LLM lại. batch_size > 1 thì gộp
+    nhiều nội dung vào một request bằng batch_prompt (có {n} và {content}).
+    '''
+    def __init__(self, key_pool: KeyPool, prompt: str, build_text: Callable[[dict], str],
+                 sanitize: Callable[[dict], dict], workers_per_key: int = 2, max_retry: int = DEFAULT_MAX_RETRY,
+                 cache: Optional[LabelCache] = None, model: Optional[str] = None,
+                 batch_prompt: Optional[str] = None, batch_size: int = 1):
+        if batch_size > 1 and not batch_prompt:
+            raise ValueError("batch_size > 1 cần batch_prompt")
+        self.key_pool = key_pool
+        self.cache = cache
+        self.model = model
+        self.prompt = prompt
+        self.batch_prompt = batch_prompt
+        self.batch_size = max(1, batch_size)
+        self.n_fallback = 0
+        self._lock = threading.Lock()
+        self.build_text = build_text
+        self.sanitize = sanitize
+        self.workers = max(1, len(key_pool.slots) * workers_per_key)
+        self.max_retry = max_retry
+
+    def call(self, text: str) -> str:
+        return self.key_pool.call(text, max_retry=self.max_retry)
+
+    def label_text(self, full_text: str) -> dict:
+        txt = self.call(self.prompt.format(content=full_text))
+        return self.sanitize(parse_labels(txt))
+
+    def label_one(self, item: dict) -> dict:
+        return self.label_text(self.build_text(item))
+
+    def label_batch(self, texts: list[str]) -> list:
+        '''
+        Gán nhãn nhiều nội dung trong một request. Mục nào không đọc được thì gọi lại riêng mục đó;
+        mục gọi lại vẫn lỗi được trả về dưới dạng Exception thay vì làm hỏng cả batch.
+        '''
+        if len(texts) == 1:
+            return [self.label_text(texts[0])]
+        txt = self.call(self.batch_prompt.format(n=len(texts), content=format_batch(texts)))
+        parsed = parse_batch(txt, len(texts))
+        missing = [i for i in range(len(texts)) if i not in parsed]
+        if missing:
+            logger.warning(f"{len(missing)}/{len(texts)} mục trong batch không đọc được, gọi lại từng mục")
+            with self._lock:
+                self.n_fallback += len(missing)
+
+        results = []
+        for i, text in enumerate(texts):
+            if i in parsed:
+                results.append(self.sanitize(parsed[i]))
+                continue
+            try:
+                results.append(self.label_text(text))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @staticmethod
+    def done_indices(output_path: str) -> set:
+        if not os.path.exists(output_path):
+            return set()
+        return {record["item_index"] for record in iter_jsonl(output_path) if "item_index" in record}
+
+    def run(self, items: Iterable, output_path: str, error_path: Optional[str] = None) -> dict:
+        done = LabelEngine.done_indices(output_path)
+
+        # Gom các item cùng full_text: mỗi nội dung chỉ gọi LLM một lần, kể cả trong cùng lượt chạy
+        groups = dict()
+        n_todo = 0
+        for idx, item in enumerate(items):
+            if idx in done:
+                continue
+            full_text = self.build_text(item)
+            groups.setdefault(LabelCache.key(self.prompt, full_text), (full_text, []))[1].append((idx, item))
+            n_todo += 1
+
+        n_labeled, n_cache_hits, errors = 0, 0, []
+        self.n_fallback = 0
+        started_at = time.time()
+
+        def write_group(members: list, labels: dict) -> int:
+            for idx, item in members:
+                record = dict(item)
+                record.update(labels)
+                record["item_index"] = idx
+                sink.write(record)
+            return len(members)
+
+        with JsonlSink(output_path) as sink:
+            pending = dict()
+            for key, (full_text, members) in groups.items():
+                cached = self.cache.get(key) if self.cache is not None else None
+                if cached is not None:
+                    n_cache_hits += len(members)
+                    n_labeled += write_group(members, cached)
+                else:
+                    pending[key] = (full_text, members)
+            keys = list(pending)
+            batches = [keys[i:i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+            logger.debug(f"Gán nhãn {n_todo} item ({len(done)} đã xong, {n_cache_hits} có trong cache, "
+                         f"{len(pending)} nội dung cần gọi LLM trong {len(batches)} request) với {self.workers} worker")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self.label_batch, [pending[key][0] for key in batch]): batch
+                           for batch in batches}
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        results = [e] * len(batch)
+                    for key, labels in zip(batch, results):
+                        members = pending[key][1]
+                        if isinstance(labels, Exception):
+                            for idx, _ in members:
+                                errors.append({"item_index": idx, "error": str(labels)})
+                            logger.error(f"Item {[idx for idx, _ in members]} lỗi sau {self.max_retry} lần thử: {labels}")
+                            continue
+                        if self.cache is not None:
+                            self.cache.put(key, labels, self.model)
+                        n_labeled += write_group(members, labels)
+                        if n_labeled % 100 < len(members):
+                            logger.info(f"Đã gán nhãn {n_labeled}/{n_todo} item")
+
+        if error_path and errors:
+            with JsonlSink(error_path) as error_sink:
+                for error in errors:
+                    error_sink.write(error)
+        return {
+            "labeled": n_labeled,
+            "skipped": len(done),
+            "cache_hits": n_cache_hits,
+            "api_items": len(pending),
+            "batches": len(batches),
+            # Số mục của prompt gộp phải gọi lại riêng vì câu trả lời không đọc được
+            "fallback": self.n_fallback,
+            # Số lần gọi LLM tiết kiệm được nhờ cache, gộp item trùng nội dung và gộp nhiều nội dung một prompt
+            "calls_saved": n_todo - len(batches) - self.n_fallback,
+            "errors": len(errors),
+            "seconds": time.time() - started_at,
+            "keys": self.key_pool.stats(),
+        }
@@ -0,0 +1,163 @@
+from logger import setup_logger
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_REPLY = "Aspect_1: Other\nAspect_2: null\nSentiment: [neutral]"
+BATCH_ITEM_RE = re.compile(r"^### (\d+)$", re.MULTILINE)
+
+class StubGeminiServer():
+    '''
+    Server giả lập endpoint generateContent của Gemini để thử LabelEngine mà không tốn quota:
+    độ trễ cố định + jitter, giới hạn rpm cho từng key (vượt thì trả 429 kèm RetryInfo)
+    và tỉ lệ lỗi 500 ngẫu nhiên. Prompt gộp nhiều mục "### <số>" được trả lời theo từng mục,
+    batch_drop_rate là tỉ lệ mục bị bỏ khỏi câu trả lời để thử đường gọi lại riêng.
+    daily_limit > 0 thì mỗi key chỉ được chừng đó request thành công, sau đó luôn trả 429 hết hạn mức ngày.
+    '''
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rpm_per_key: float = 0, error_rate: float = 0.0, reply: str = DEFAULT_REPLY,
+                 batch_drop_rate: float = 0.0, daily_limit: int = 0):
+        self.latency = latency
+        self.daily_limit = daily_limit
+        self.batch_drop_rate = batch_drop_rate
+        self.jitter = jitter
+        self.rpm_per_key = rpm_per_key
+        self.error_rate = error_rate
+        self.reply = reply
+        self.n_requests = 0
+        self.n_rate_limited = 0
+        self.n_errors = 0
+        self.prompts = []
+        self._calls = dict()
+        self._daily_calls = dict()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_for(self, prompt: str) -> str:
+        numbers = [int(n) for n in BATCH_ITEM_RE.findall(prompt)]
+        if not numbers:
+            return self.reply
+        return "\n\n".join(f"### {i}\n{self.reply}" for i in range(1, max(numbers) + 1)
+                           if not (self.batch_drop_rate and random.random() < self.batch_drop_rate))
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, payload = stub._respond(self.headers.get("x-goog-api-key", ""), body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _over_daily_limit(self, api_key: str) -> bool:
+        if not self.daily_limit:
+            return False
+        with self._lock:
+            if self._daily_calls.get(api_key, 0) >= self.daily_limit:
+                return True
+            self._daily_calls[api_key] = self._daily_calls.get(api_key, 0) + 1
+            return False
+
+    def _over_limit(self, api_key: str) -> bool:
+        if not self.rpm_per_key:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            calls = [t for t in self._calls.get(api_key, []) if now - t < 60]
+            if len(calls) >= self.rpm_per_key:
+                self._calls[api_key] = calls
+                return True
+            calls.append(now)
+            self._calls[api_key] = calls
+            return False
+
+    def _respond(self, api_key: str, body: dict) -> tuple:
+        with self._lock:
+            self.n_requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self._over_daily_limit(api_key):
+            with self._lock:
+                self.n_rate_limited += 1
+            return 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "details": [
+                {"@type": "type.googleapis.com/google.rpc.QuotaFailure", "violations": [
+                    {"quotaId": "GenerateRequestsPerDayPerProjectPerModel-FreeTier"}]},
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "30s"}]}}
+        if self._over_limit(api_key):
+            with self._lock:
+                self.n_rate_limited += 1
+            return 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "details": [
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "5s"}]}}
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.n_errors += 1
+            return 500, {"error": {"code": 500, "status": "INTERNAL"}}
+
+        prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+        with self._lock:
+            self.prompts.append(prompt)
+        return 200, {"candidates": [{"content": {"parts": [{"text": self.reply_for(prompt)}]}}]}
+
+    def start(self) -> "StubGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        logger.debug(f"LLM stub chạy tại {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server giả lập Gemini generateContent")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--rpm-per-key", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-drop-rate", type=float, default=0.0)
+    parser.add_argument("--daily-limit", type=int, default=0, help="Số request mỗi key trước khi hết hạn mức ngày")
+    args = parser.parse_args()
+
+    server = StubGeminiServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                              rpm_per_key=args.rpm_per_key, error_rate=args.error_rate,
+                              batch_drop_rate=args.batch_drop_rate, daily_limit=args.daily_limit)
+    print(f"LLM stub chạy tại {server.url} (dùng --base-url {server.url} cho label.py)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
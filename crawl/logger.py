@@ -1,19 +1,101 @@
 import logging
 from logging import Logger
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import multiprocessing
+import multiprocessing.util
 import os
+import queue
+import threading
 from datetime import datetime
 
-def setup_logger(name: str, level: int = logging.INFO) -> Logger:
-    # Create logs directory if not exists
+# Chế độ log, chọn qua biến môi trường CRAWL_LOG_PROFILE:
+#   debug      - ghi qua hàng đợi vào một file xoay vòng dùng chung, giữ nguyên level của từng module
+#   production - như debug nhưng level tối thiểu là INFO, các lệnh debug trong vòng lặp bị bỏ qua ngay
+#   legacy     - mỗi module một file log riêng, ghi đồng bộ (cách cũ)
+LOG_PROFILE = os.environ.get("CRAWL_LOG_PROFILE", "debug").lower()
+PRODUCTION_MIN_LEVEL = logging.INFO
+
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_listener_pid = None
+_queue = None
+_listener_lock = threading.Lock()
+
+class _NoFormatQueueHandler(QueueHandler):
+    '''
+    Đưa nguyên record vào hàng đợi, việc format message do thread của listener làm,
+    luồng crawl không phải format chuỗi hay chờ ghi đĩa.
+    '''
+    def __init__(self):
+        super().__init__(None)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Lấy hàng đợi mỗi lần ghi: process con tạo bằng fork phải có listener riêng
+        _get_queue().put_nowait(record)
+
+def _logs_dir() -> str:
     current_dir = os.path.dirname(os.path.abspath(__file__))
     logs_dir = os.path.join(current_dir, 'logs')
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir, exist_ok=True)
-    
+    os.makedirs(logs_dir, exist_ok=True)
+    return logs_dir
+
+def _get_queue() -> queue.Queue:
+    global _listener, _listener_pid, _queue
+    if _listener_pid == os.getpid():
+        return _queue
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            # Mỗi process ghi file riêng để không tranh nhau xoay vòng cùng một file
+            process = multiprocessing.current_process()
+            suffix = "" if process.name == "MainProcess" else f"-{os.getpid()}"
+            log_file = os.path.join(_logs_dir(), f"crawl{suffix}.log")
+
+            file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                               encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+            _queue = queue.Queue(-1)
+            _listener = QueueListener(_queue, file_handler, respect_handler_level=False)
+            _listener.start()
+            _listener_pid = os.getpid()
+            atexit.register(stop_logging)
+            if process.name != "MainProcess":
+                # Process con của multiprocessing thoát bằng os._exit, atexit không được gọi
+                multiprocessing.util.Finalize(None, stop_logging, exitpriority=10)
+        return _queue
+
+def stop_logging() -> None:
+    '''
+    Ghi nốt các log còn trong hàng đợi và dừng listener.
+    '''
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        _listener, _listener_pid = None, None
+
+def _setup_legacy_logger(logger: Logger, level: int) -> None:
+    log_file = os.path.join(_logs_dir(), f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setLevel(level)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(file_handler)
+
+def setup_logger(name: str, level: int = logging.INFO) -> Logger:
+    if LOG_PROFILE == "production":
+        level = max(level, PRODUCTION_MIN_LEVEL)
+
     # Setup logger
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    
+
     # Prevent logging to console
     logger.propagate = False
 
@@ -21,16 +103,9 @@ def setup_logger(name: str, level: int = logging.INFO) -> Logger:
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    # Create file handler
-    log_file = os.path.join(logs_dir, f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(level)
-
-    # Set formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-
-    # Add handler to logger
-    logger.addHandler(file_handler)
+    if LOG_PROFILE == "legacy":
+        _setup_legacy_logger(logger, level)
+    else:
+        logger.addHandler(_NoFormatQueueHandler())
 
-    return logger
\ No newline at end of file
+    return logger
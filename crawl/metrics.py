@@ -0,0 +1,250 @@
+from logger import setup_logger
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import json
+import os
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+class Histogram():
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Ước lượng theo cận trên của bucket chứa phân vị q
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)},
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+class Metrics():
+    '''
+    Bộ đếm dùng chung cho crawler trong một process: counter, gauge và histogram có label.
+    Xuất ra dạng text của Prometheus, JSON, hoặc bản tóm tắt cho một lượt crawl.
+    '''
+    started_at = time.time()
+    _counters = dict()
+    _gauges = dict()
+    _histograms = dict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def reset() -> None:
+        with Metrics._lock:
+            Metrics.started_at = time.time()
+            Metrics._counters = dict()
+            Metrics._gauges = dict()
+            Metrics._histograms = dict()
+
+    @staticmethod
+    def inc(name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels_key(labels))
+        with Metrics._lock:
+            Metrics._counters[key] = Metrics._counters.get(key, 0) + value
+
+    @staticmethod
+    def set_gauge(name: str, value: float, **labels) -> None:
+        with Metrics._lock:
+            Metrics._gauges[(name, _labels_key(labels))] = value
+
+    @staticmethod
+    def observe(name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        key = (name, _labels_key(labels))
+        with Metrics._lock:
+            if key not in Metrics._histograms:
+                Metrics._histograms[key] = Histogram(buckets)
+            Metrics._histograms[key].observe(value)
+
+    @staticmethod
+    def record_request(endpoint: str, status, seconds: float, n_bytes: int = 0) -> None:
+        Metrics.inc("crawler_requests_total", endpoint=endpoint, status=status)
+        Metrics.observe("crawler_request_seconds", seconds, endpoint=endpoint)
+        if n_bytes:
+            Metrics.inc("crawler_response_bytes_total", n_bytes, endpoint=endpoint)
+            Metrics.observe("crawler_response_bytes", n_bytes, buckets=SIZE_BUCKETS, endpoint=endpoint)
+
+    @staticmethod
+    def record_retry(endpoint: str, reason) -> None:
+        Metrics.inc("crawler_retries_total", endpoint=endpoint, reason=reason)
+
+    @staticmethod
+    def counter_total(name: str, **labels) -> float:
+        # Cộng tất cả series của counter có chứa các label đã cho
+        wanted = set(_labels_key(labels))
+        with Metrics._lock:
+            return sum(value for (key, series_labels), value in Metrics._counters.items()
+                       if key == name and wanted.issubset(series_labels))
+
+    @staticmethod
+    def snapshot() -> dict:
+        with Metrics._lock:
+            return {
+                "started_at": Metrics.started_at,
+                "elapsed_seconds": time.time() - Metrics.started_at,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in Metrics._counters.items()],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in Metrics._gauges.items()],
+                "histograms": [{"name": name, "labels": dict(labels), **hist.to_dict()}
+                               for (name, labels), hist in Metrics._histograms.items()],
+            }
+
+    @staticmethod
+    def to_prometheus() -> str:
+        lines = []
+        with Metrics._lock:
+            for (name, labels), value in sorted(Metrics._counters.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(Metrics._gauges.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), hist in sorted(Metrics._histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + ("+Inf",), hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def summary() -> dict:
+        '''
+        Tóm tắt lượt crawl: số request, lỗi, retry, độ trễ theo endpoint và thông lượng post/comment/ảnh.
+        '''
+        elapsed = max(time.time() - Metrics.started_at, 1e-9)
+        with Metrics._lock:
+            endpoints = dict()
+            for (name, labels), value in Metrics._counters.items():
+                labels = dict(labels)
+                if name == "crawler_requests_total":
+                    stats = endpoints.setdefault(labels["endpoint"], {"requests": 0, "errors": 0, "retries": 0})
+                    stats["requests"] += value
+                    if str(labels["status"]) != "200":
+                        stats["errors"] += value
+                elif name == "crawler_retries_total":
+                    stats = endpoints.setdefault(labels["endpoint"], {"requests": 0, "errors": 0, "retries": 0})
+                    stats["retries"] += value
+            for (name, labels), hist in Metrics._histograms.items():
+                if name == "crawler_request_seconds":
+                    stats = endpoints.setdefault(dict(labels)["endpoint"], {"requests": 0, "errors": 0, "retries": 0})
+                    stats["p50_seconds"] = hist.quantile(0.5)
+                    stats["p95_seconds"] = hist.quantile(0.95)
+                    stats["mean_seconds"] = hist.sum / hist.count if hist.count else None
+
+        n_posts = Metrics.counter_total("crawler_posts_total")
+        n_comments = Metrics.counter_total("crawler_comments_total")
+        n_images = Metrics.counter_total("crawler_images_total") - Metrics.counter_total("crawler_images_total", status="failed")
+        return {
+            "elapsed_seconds": elapsed,
+            "endpoints": endpoints,
+            "response_bytes": Metrics.counter_total("crawler_response_bytes_total"),
+            "image_bytes": Metrics.counter_total("crawler_image_bytes_total"),
+            "posts": n_posts,
+            "comments": n_comments,
+            "images": n_images,
+            "posts_per_second": n_posts / elapsed,
+            "comments_per_second": n_comments / elapsed,
+            "images_per_second": n_images / elapsed,
+        }
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(Metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = Metrics.to_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    '''
+    Mở endpoint /metrics (Prometheus) và /metrics.json trên một thread nền.
+    '''
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.debug(f"Mở metrics endpoint http://{host}:{port}/metrics")
+    return server
+
+class MetricsFlusher():
+    '''
+    Ghi snapshot metrics ra file JSON sau mỗi interval giây (ghi file tạm rồi đổi tên).
+    '''
+    def __init__(self, path: str, interval: float = 10):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+        self._thread.start()
+
+    def flush(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"snapshot": Metrics.snapshot(), "summary": Metrics.summary()}, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Không ghi được metrics {self.path} {e}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
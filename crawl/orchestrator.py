@@ -0,0 +1,245 @@
+from logger import setup_logger
+from facebook_scraper import FacebookScraper
+from http_client import HttpClient, RequestBudget
+from bootstrap_cache import BootstrapCache
+from checkpoint_store import CheckpointStore
+from metrics import Metrics, MetricsFlusher, start_metrics_server
+from requester import Ranking
+from image_store import ImageStore
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Optional
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+# Các job trong cùng một process dùng chung một BootstrapCache và một CheckpointStore
+_bootstrap_cache: Optional[BootstrapCache] = None
+_checkpoint_store: Optional[CheckpointStore] = None
+_shared_lock = threading.Lock()
+
+def get_bootstrap_cache() -> BootstrapCache:
+    global _bootstrap_cache
+    with _shared_lock:
+        if _bootstrap_cache is None:
+            _bootstrap_cache = BootstrapCache()
+        return _bootstrap_cache
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _checkpoint_store
+    with _shared_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore()
+        return _checkpoint_store
+
+def load_page_urls(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+def page_name(page_url: str) -> str:
+    return page_url.rstrip('/').split('/')[-1] or "unknown"
+
+def build_jobs(page_urls: list[str], windows: list[tuple], crawl_kwargs: dict, output_dir: str) -> list[dict]:
+    jobs = []
+    for page_url in page_urls:
+        for after_time, before_time in windows:
+            window_name = f"{after_time or 'begin'}__{before_time or 'now'}"
+            jobs.append({
+                'page_url': page_url,
+                'after_time': after_time,
+                'before_time': before_time,
+                # Mỗi job ghi vào thư mục riêng để các page/khung thời gian không ghi đè nhau
+                'output_dir': os.path.join(output_dir, page_name(page_url), window_name),
+                'crawl_kwargs': crawl_kwargs,
+            })
+    return jobs
+
+def run_job(job: dict) -> dict:
+    '''
+    Chạy một job crawl_post độc lập. Lỗi của job chỉ được ghi vào kết quả, không làm dừng các job khác.
+    '''
+    result = {
+        'page_url': job['page_url'],
+        'after_time': job['after_time'],
+        'before_time': job['before_time'],
+        'status': 'ok',
+        'posts': 0,
+        'comments': 0,
+        'error': None,
+    }
+    start = time.time()
+    try:
+        scraper = FacebookScraper(bootstrap_cache=get_bootstrap_cache(), checkpoint_store=get_checkpoint_store())
+        scraper.crawl_post(job['page_url'], after_time=job['after_time'], before_time=job['before_time'],
+                           output_dir=job['output_dir'], **job['crawl_kwargs'])
+        result['posts'] = scraper.crawl_stats['posts']
+        result['comments'] = scraper.crawl_stats['comments']
+    except Exception as e:
+        logger.error(f"Job {job['page_url']} thất bại {e}")
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['seconds'] = time.time() - start
+    return result
+
+def _init_process_worker(limit: Optional[int], counter, lock, image_derivatives: Optional[dict] = None) -> None:
+    if limit is not None:
+        HttpClient.set_budget(RequestBudget(limit, counter=counter, lock=lock))
+    if image_derivatives:
+        ImageStore.configure_derivatives(**image_derivatives)
+
+class CrawlOrchestrator():
+    '''
+    Lập lịch crawl_post cho nhiều page x nhiều khung thời gian trên pool thread hoặc process,
+    dùng chung một ngân sách request và tổng hợp tiến độ, thông lượng.
+    '''
+    def __init__(self, n_workers: int = 4, mode: str = "thread", request_budget: Optional[int] = None,
+                 image_derivatives: Optional[dict] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Mode không hợp lệ: {mode}")
+        self.n_workers = n_workers
+        self.mode = mode
+        self.request_budget = request_budget
+        # Tham số cho ImageStore.configure_derivatives, áp dụng trong mọi worker
+        self.image_derivatives = image_derivatives
+
+    def _new_executor(self, manager=None):
+        if self.mode == "thread":
+            if self.request_budget is not None:
+                HttpClient.set_budget(RequestBudget(self.request_budget))
+            if self.image_derivatives:
+                ImageStore.configure_derivatives(**self.image_derivatives)
+            return ThreadPoolExecutor(max_workers=self.n_workers)
+
+        counter = manager.Value('i', 0) if self.request_budget is not None else None
+        lock = manager.Lock() if self.request_budget is not None else None
+        self._shared_counter = counter
+        return ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_process_worker,
+                                   initargs=(self.request_budget, counter, lock, self.image_derivatives))
+
+    def _requests_used(self) -> Optional[int]:
+        if self.request_budget is None:
+            return None
+        if self.mode == "thread":
+            return HttpClient.budget.used
+        return self._shared_counter.value
+
+    def run(self, jobs: list[dict]) -> dict:
+        start = time.time()
+        results = []
+        manager = multiprocessing.Manager() if self.mode == "process" else None
+        try:
+            with self._new_executor(manager) as executor:
+                futures = [executor.submit(run_job, job) for job in jobs]
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+
+                    elapsed = time.time() - start
+                    n_posts = sum(r['posts'] for r in results)
+                    message = (f"[{len(results)}/{len(jobs)}] {page_name(result['page_url'])} "
+                               f"{result['status']} - {result['posts']} post, {result['comments']} comment "
+                               f"trong {result['seconds']:.1f}s | tổng {n_posts} post, {n_posts / elapsed:.2f} post/s")
+                    print(message)
+                    logger.debug(message)
+
+            summary = self.summarize(results, time.time() - start)
+        finally:
+            if self.mode == "thread":
+                HttpClient.set_budget(None)
+            if manager is not None:
+                manager.shutdown()
+        return summary
+
+    def summarize(self, results: list[dict], elapsed: float) -> dict:
+        n_posts = sum(r['posts'] for r in results)
+        n_comments = sum(r['comments'] for r in results)
+        summary = {
+            'jobs': len(results),
+            'failed_jobs': [r for r in results if r['status'] != 'ok'],
+            'posts': n_posts,
+            'comments': n_comments,
+            'seconds': elapsed,
+            'posts_per_second': n_posts / elapsed if elapsed > 0 else 0.0,
+            'comments_per_second': n_comments / elapsed if elapsed > 0 else 0.0,
+            'requests_used': self._requests_used(),
+            'request_budget': self.request_budget,
+        }
+        return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl song song nhiều FACEBOOK PAGE")
+    parser.add_argument("--pages", default="./facebook_urls/page_urls.txt", help="File chứa danh sách URL page, mỗi dòng một URL")
+    parser.add_argument("--window", nargs=2, action="append", metavar=("AFTER", "BEFORE"),
+                        help="Khung thời gian, định dạng %%Y-%%m-%%d_%%H-%%M-%%S. Có thể truyền nhiều lần")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--request-budget", type=int, default=None, help="Tổng số request tối đa của cả lượt crawl")
+    parser.add_argument("--output-dir", default="data/json")
+    parser.add_argument("--max-post", type=int, default=300)
+    parser.add_argument("--max-parent-comment", type=int, default=20)
+    parser.add_argument("--max-depth1-comment", type=int, default=30)
+    parser.add_argument("--no-comment", action="store_true", help="Chỉ lấy post, không lấy comment")
+    parser.add_argument("--incremental", action="store_true", help="Dừng khi gặp post cũ hơn post mới nhất đã lưu trong khung thời gian")
+    parser.add_argument("--no-resume", action="store_true", help="Không tiếp tục từ cursor đã lưu")
+    parser.add_argument("--rotate-mb", type=int, default=None, help="Xoay file output khi vượt quá số MB này")
+    parser.add_argument("--rotate-minutes", type=int, default=None, help="Xoay file output sau số phút này")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None)
+    parser.add_argument("--metrics-port", type=int, default=None, help="Mở endpoint /metrics kiểu Prometheus trên cổng này")
+    parser.add_argument("--metrics-json", default=None, help="File JSON được ghi metrics định kỳ")
+    parser.add_argument("--image-max-side", type=int, default=None,
+                        help="Tạo bản thu nhỏ cho ảnh tải về, cạnh dài tối đa bằng số px này (ví dụ 1024)")
+    parser.add_argument("--image-format", choices=["webp", "jpeg"], default="webp")
+    parser.add_argument("--drop-original-images", action="store_true",
+                        help="Chỉ giữ bản thu nhỏ của ảnh, JSON ghi đường dẫn theo đuôi bản thu nhỏ (.webp/.jpg). "
+                             "Đường dẫn .jpg/.png trong JSON của các lần crawl trước sẽ không còn tồn tại")
+    args = parser.parse_args()
+
+    windows = [tuple(window) for window in args.window] if args.window else [(None, None)]
+    crawl_kwargs = {
+        'ranking_comment': Ranking.MOST_RELEVANT,
+        'include_comment': not args.no_comment,
+        'max_post': args.max_post,
+        'max_parent_comment': args.max_parent_comment,
+        'max_depth1_comment': args.max_depth1_comment,
+        'resume': not args.no_resume,
+        'incremental': args.incremental,
+        'output_max_bytes': args.rotate_mb * 1024 * 1024 if args.rotate_mb else None,
+        'output_max_seconds': args.rotate_minutes * 60 if args.rotate_minutes else None,
+        'output_compression': args.compression,
+    }
+    jobs = build_jobs(load_page_urls(args.pages), windows, crawl_kwargs, args.output_dir)
+
+    # Ở mode process, metrics nằm trong từng process con nên endpoint/file chỉ có số liệu của process chính
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port else None
+    flusher = MetricsFlusher(args.metrics_json) if args.metrics_json else None
+
+    image_derivatives = {
+        'max_side': args.image_max_side,
+        'fmt': args.image_format,
+        'keep_originals': not args.drop_original_images,
+    } if args.image_max_side else None
+    orchestrator = CrawlOrchestrator(n_workers=args.workers, mode=args.mode, request_budget=args.request_budget,
+                                     image_derivatives=image_derivatives)
+    try:
+        summary = orchestrator.run(jobs)
+    finally:
+        if flusher is not None:
+            flusher.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    print(f"Hoàn thành {summary['jobs']} job ({len(summary['failed_jobs'])} lỗi) trong {summary['seconds']:.1f} giây")
+    print(f"{summary['posts']} post ({summary['posts_per_second']:.2f} post/s), "
+          f"{summary['comments']} comment ({summary['comments_per_second']:.2f} comment/s)")
+    if summary['request_budget'] is not None:
+        print(f"Đã dùng {summary['requests_used']}/{summary['request_budget']} request")
+    for failed in summary['failed_jobs']:
+        print(f"Lỗi: {failed['page_url']} {failed['error']}")
+    if args.mode == "thread":
+        for endpoint, stats in Metrics.summary()['endpoints'].items():
+            print(f"{endpoint}: {stats}")
+    logger.debug(f"Tổng kết: {summary}")
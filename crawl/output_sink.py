@@ -0,0 +1,161 @@
+from logger import setup_logger
+from typing import Iterator, Optional
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+import logging
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+COMPRESSION_SUFFIXES = {
+    None: "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+class JsonlSink():
+    '''
+    Ghi từng bản ghi JSON ra file JSONL qua một handle mở sẵn, không giữ dữ liệu trong bộ nhớ.
+    Có thể xoay file theo kích thước (max_bytes, tính trên đĩa) hoặc thời gian (max_seconds)
+    và nén gzip/zstd. Khi xoay file, các phần được đặt tên <tên>.00001.jsonl[.gz|.zst].
+    flush_each_record=False để ghi theo buffer khi không cần dữ liệu xuống đĩa ngay (chuyển đổi hàng loạt).
+    '''
+    def __init__(self, path: str, max_bytes: Optional[int] = None, max_seconds: Optional[int] = None,
+                 compression: Optional[str] = None, flush_each_record: bool = True):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Kiểu nén không hợp lệ: {compression}")
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            raise RuntimeError("Cần cài zstandard để ghi file .zst")
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.flush_each_record = flush_each_record
+        self.rotating = max_bytes is not None or max_seconds is not None
+
+        self.n_records = 0
+        self.files = []
+        self._lock = threading.Lock()
+        self._raw = None
+        self._writer = None
+        self._opened_at = 0.0
+        self._part = self._last_part()
+
+    def _part_path(self, part: int) -> str:
+        base, ext = os.path.splitext(self.path)
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        if not self.rotating:
+            return f"{self.path}{suffix}"
+        return f"{base}.{part:05d}{ext}{suffix}"
+
+    def _last_part(self) -> int:
+        # Không ghi đè các phần của lượt crawl trước (khi chạy tiếp từ checkpoint)
+        if not self.rotating:
+            return 0
+        base, ext = os.path.splitext(self.path)
+        pattern = re.compile(re.escape(os.path.basename(base)) + r"\.(\d{5})" + re.escape(ext))
+        parts = [int(m.group(1)) for name in glob.glob(f"{glob.escape(base)}.*")
+                 if (m := pattern.match(os.path.basename(name)))]
+        return max(parts, default=0)
+
+    def _open(self) -> None:
+        self._part += 1
+        path = self._part_path(self._part)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # Mở ở chế độ append: gzip và zstd đều cho phép nối nhiều frame vào một file
+        self._raw = open(path, "ab")
+        if self.compression == "gzip":
+            self._writer = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        elif self.compression == "zstd":
+            self._writer = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._writer = self._raw
+        self._opened_at = time.time()
+        self.files.append(path)
+        logger.debug(f"Mở file output {path}")
+
+    def _close_current(self) -> None:
+        if self._writer is None:
+            return
+        if self._writer is not self._raw:
+            self._writer.close()
+        self._raw.close()
+        self._writer, self._raw = None, None
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes is not None and self._raw.tell() >= self.max_bytes:
+            return True
+        if self.max_seconds is not None and time.time() - self._opened_at >= self.max_seconds:
+            return True
+        return False
+
+    def write(self, record: dict) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._writer is None:
+                self._open()
+            elif self.rotating and self._should_rotate():
+                self._close_current()
+                self._open()
+
+            self._writer.write(line)
+            self.n_records += 1
+            if not self.flush_each_record:
+                return
+            # Flush từng bản ghi để checkpoint (đánh dấu post đã lấy) không đi trước dữ liệu trên đĩa
+            if self.compression == "zstd":
+                self._writer.flush(zstandard.FLUSH_BLOCK)
+            elif self.compression == "gzip":
+                self._writer.flush()
+            self._raw.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_current()
+        logger.debug(f"Đóng output {self.path}: {self.n_records} bản ghi, {len(self.files)} file")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+def open_text(path: str) -> io.TextIOBase:
+    '''
+    Mở file văn bản, tự giải nén theo đuôi .gz hoặc .zst.
+    '''
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Cần cài zstandard để đọc file .zst")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+    '''
+    Đọc lần lượt từng bản ghi của file JSONL (có thể nén), bỏ qua dòng hỏng.
+    '''
+    with open_text(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Bỏ qua dòng JSON hỏng trong {path}")
@@ -7,8 +7,13 @@ import re
 import json
 from datetime import datetime
 from requester import Requester
+from http_client import HttpClient
+from image_downloader import ImageDownloader
+from image_store import ImageStore
+from graphql_response import ParsedResponse, FieldPlan, get_path
 from typing import Optional, Tuple
 from utils import Utils
+from api_registry import ApiRegistry, COMMENT_API_NAMES, DEFAULT_COMMENT_API_PATH
 import logging
 import time
 
@@ -20,6 +25,42 @@ def is_valid_image(filename):
     ext = os.path.splitext(filename)[1].lower()
     return ext in VALID_IMAGE_EXTS and ext != ''
 
+# Post trong timeline nằm ở data.node.timeline_list_feed_units.edges[0].node, post có 'label' nằm ở data.node
+TIMELINE_POST_ROOT = ('data', 'node', 'timeline_list_feed_units', 'edges', 0, 'node')
+LABEL_POST_ROOT = ('data', 'node')
+
+_STORY = ('comet_sections', 'content', 'story')
+_FEEDBACK_CTX = ('comet_sections', 'feedback', 'story', 'story_ufi_container', 'story',
+                 'feedback_context', 'feedback_target_with_context')
+_SUMMARY_FEEDBACK = _FEEDBACK_CTX + ('comet_ufi_summary_and_actions_renderer', 'feedback')
+
+# Các field của post, tính từ node của post
+POST_FIELD_PLAN = FieldPlan({
+    'post_url': (_STORY + ('wwwURL',), None),
+    'message': (_STORY + ('comet_sections', 'message', 'story', 'message', 'text'), None),
+    'attachments': (_STORY + ('attachments',), []),
+    'feedback_id': (('feedback', 'id'), None),
+    'creation_time': (('comet_sections', 'timestamp', 'story', 'creation_time'), None),
+    'comment_count': (_FEEDBACK_CTX + ('comment_list_renderer', 'feedback', 'comment_rendering_instance',
+                                       'comments', 'total_count'), 0),
+    'share_count': (_SUMMARY_FEEDBACK + ('i18n_share_count',), None),
+    'total_reactions': (_SUMMARY_FEEDBACK + ('reaction_count', 'count'), 0),
+    'top_reactions': (_SUMMARY_FEEDBACK + ('top_reactions', 'edges'), []),
+})
+
+# Các field của một comment edge (parent comment hoặc DEPTH01 COMMENT)
+COMMENT_FIELD_PLAN = FieldPlan({
+    'text': (('node', 'body', 'text'), None),
+    'attachments': (('node', 'attachments'), []),
+    'replies_total_count': (('node', 'feedback', 'replies_fields', 'total_count'), None),
+    'feedback_id': (('node', 'feedback', 'id'), None),
+    'expansion_token': (('node', 'feedback', 'expansion_info', 'expansion_token'), None),
+})
+
+COMMENT_IMAGE_PATH = ('style_type_renderer', 'attachment', 'media', 'image', 'uri')
+COMMENTS_PATH = ('data', 'node', 'comment_rendering_instance_for_feed_location', 'comments')
+REPLIES_PATH = ('data', 'node', 'replies_connection')
+
 class Parser():
     @staticmethod
     def _get_payload(payload: str) -> dict:
@@ -52,7 +93,24 @@ class Parser():
         return total_parent_cmt
     
     @staticmethod
-    def download_images_from_attachments(attachments, save_dir="./data/image"):
+    def _save_image(uri: str, save_dir: str, downloader: Optional[ImageDownloader] = None) -> Optional[str]:
+        '''
+        Trả về đường dẫn lưu ảnh. Nếu có downloader thì ảnh được tải nền và hàm trả về ngay.
+        '''
+        filename = os.path.join(save_dir, os.path.basename(uri.split("?")[0]))
+        if not is_valid_image(filename):
+            return None
+        # Bản gốc bị bỏ thì ghi tên theo đuôi bản thu nhỏ, đường dẫn trong JSON luôn mở được
+        filename = ImageStore.for_dir(save_dir).local_path(uri)
+
+        if downloader is not None:
+            return downloader.submit(uri, filename)
+
+        ImageStore.for_dir(save_dir).fetch(uri, filename)
+        return filename
+
+    @staticmethod
+    def download_images_from_attachments(attachments, save_dir="./data/image", downloader: Optional[ImageDownloader] = None):
         image_paths = []
         for att in attachments:
             try:
@@ -69,11 +127,8 @@ class Parser():
                         viewer_image = media.get('viewer_image', {})
                         uri = viewer_image.get('uri')
                         if uri:
-                            filename = os.path.join(save_dir, os.path.basename(uri.split("?")[0]))
-                            if is_valid_image(filename):
-                                img = requests.get(uri)
-                                with open(filename, "wb") as f:
-                                    f.write(img.content)
+                            filename = Parser._save_image(uri, save_dir, downloader)
+                            if filename:
                                 image_paths.append(filename)
                 elif 'media' in attachment:
                     media = attachment['media']
@@ -81,11 +136,8 @@ class Parser():
                         continue
                     uri = media.get('photo_image', {}).get('uri')
                     if uri:
-                        filename = os.path.join(save_dir, os.path.basename(uri.split("?")[0]))
-                        if is_valid_image(filename):
-                            img = requests.get(uri)
-                            with open(filename, "wb") as f:
-                                f.write(img.content)
+                        filename = Parser._save_image(uri, save_dir, downloader)
+                        if filename:
                             image_paths.append(filename)
             except Exception as e:
                 print("Không lấy được ảnh:", e)
@@ -104,38 +156,47 @@ class Parser():
             logger.debug(f"PageID: {identifier}")
             logger.debug(f"PostAPI: {post_api}")
 
-            time_range, _ = Utils.init_requests_variables()
-            logger.debug(f"TimeRange: {time_range}")
+            return Parser._get_reaction_id_from_posts(headers, identifier, entryPoint, post_api)
 
-            resp = Requester._get_posts(headers, time_range, identifier, entryPoint, post_api)
-            jsons = Parser.parse_jsons(resp)
+    @staticmethod
+    def _get_reaction_id_from_posts(headers: dict, identifier: str, entryPoint: str, post_api: str) -> dict:
+        time_range, _ = Utils.init_requests_variables()
+        logger.debug(f"TimeRange: {time_range}")
 
-            reaction_ids = {}
+        resp = Requester._get_posts(headers, time_range, identifier, entryPoint, post_api)
+        jsons = Parser.parse_jsons(resp)
 
-            for json in jsons:
-                try:
-                    resources = json['extensions']['sr_payload']['ddd']['jsmods']['define']  
-                    for define in resources:
-                        if define[0] == 'DynamicUFIReactionTypes':
-                            reaction_ids = define[2]
-                except Exception as e:
-                    pass
-
-            if reaction_ids:
-                logger.debug("Lấy reaction_ids thành công")  
-            else:
-                logger.warning("Lấy reaction_ids thất bại")
-
-            save_path = './api_info/reaction_ids.json'
-            Utils.write_json(save_path, reaction_ids)
-
-            return reaction_ids
+        reaction_ids = Parser.parse_reaction_ids(jsons)
+
+        save_path = './api_info/reaction_ids.json'
+        Utils.write_json(save_path, reaction_ids)
+
+        return reaction_ids
+
+    @staticmethod
+    def parse_reaction_ids(jsons: list[dict]) -> dict:
+        reaction_ids = {}
+
+        for json in jsons:
+            try:
+                resources = json['extensions']['sr_payload']['ddd']['jsmods']['define']  
+                for define in resources:
+                    if define[0] == 'DynamicUFIReactionTypes':
+                        reaction_ids = define[2]
+            except Exception as e:
+                pass
+
+        if reaction_ids:
+            logger.debug("Lấy reaction_ids thành công")  
+        else:
+            logger.warning("Lấy reaction_ids thất bại")
+
+        return reaction_ids
     
     @staticmethod
     def parse_total_reactions(comment_edge: dict) -> int:
         try: 
             total_reactions = comment_edge['node']['feedback']['reactors']['count_reduced']
-            logger.debug("Lấy total reactions thành công")
             return int(total_reactions)
         except Exception as e:
             logger.warning("Lấy total reactions thất bại")
@@ -146,29 +207,27 @@ class Parser():
         try:
             reaction_detail = dict()
             reaction_edges = comment_edge['node']['feedback']['top_reactions']['edges']
+            # Hàm được gọi cho mọi comment, chỉ format log debug khi level DEBUG đang bật
+            debug = logger.isEnabledFor(logging.DEBUG)
 
             for edge in reaction_edges:
-                logger.debug(edge)
                 id_reaction = edge.get('node', {}) \
                                     .get('id', None)
                 count_reaction = edge.get('reaction_count', None)
                 
-                logger.debug(f"ID reaction và count reaction --{id_reaction}:{count_reaction}--")
-                if id_reaction and count_reaction:
-                    logger.debug(f"Tìm thấy id reaction và count reaction {id_reaction}:{count_reaction}")
-                else:
+                if not (id_reaction and count_reaction):
                     logger.warning("Không tìm thấy id reaction và count reaction")
+                elif debug:
+                    logger.debug("Tìm thấy id reaction và count reaction %s:%s", id_reaction, count_reaction)
             
                 name_reaction = reaction_id_info.get("reactions") \
                                                     .get(str(id_reaction)) \
                                                     .get("name", None)
                 if name_reaction:
-                    logger.debug(f"Tìm thấy tên reaction --{name_reaction}--")
                     reaction_detail[name_reaction] = count_reaction
                 else:
                     logger.warning("Không tìm thấy tên reaction")
             
-            logger.debug("Lấy detail reactions thành công")
             return reaction_detail
         except Exception as e:
             logger.warning("Lấy detail reactions thất bại")
@@ -176,7 +235,6 @@ class Parser():
 
     @staticmethod
     def parse_reaction_comments_info(comment_edge: dict, reaction_id_info: dict) -> dict:
-        logger.debug("Tiến hành lấy thông tin comment")
         reactions_info = dict()
         reactions_info['total'] = Parser.parse_total_reactions(comment_edge)
         reactions_info['detail'] = Parser.parse_detail_reactions(comment_edge, reaction_id_info)
@@ -184,21 +242,19 @@ class Parser():
 
     @staticmethod
     def scraper_depth1_comments(headers: dict, feedback_id: str, expansion_token: str,
-                    reaction_id_info: dict, cmt_api_path: str = "./api_info/comment_api.json",
+                    reaction_id_info: dict, cmt_api_path: str = DEFAULT_COMMENT_API_PATH,
                     max_comment: int = 50,
                     max_retry: int = 3, 
-                    break_time: int = 1) -> None:
+                    downloader: Optional[ImageDownloader] = None,
+                    api_registry: Optional[ApiRegistry] = None) -> None:
 
         try: 
-            logger.debug(f"{'-' * 10} Thực hiện lấy DEPTH01 COMMENT: {'-' * 10}")
-            logger.debug(f"Post ID: {feedback_id}")
-            logger.debug(f"Expansion Token {expansion_token}")
-
-            cmt_api = Utils.load_json(cmt_api_path)
-            logger.debug(f"API Get Comment {cmt_api}") 
+            logger.debug("---------- Thực hiện lấy DEPTH01 COMMENT: %s ----------", feedback_id)
 
-            # Lấy api get comment gốc và gửi request
-            depth1_comment_api = cmt_api['Depth1CommentsListPaginationQuery']
+            # Lấy cả bộ doc_id comment (cmt_api_path được ưu tiên) để depth1 cùng bộ với comment gốc
+            api_registry = api_registry if api_registry is not None else ApiRegistry.shared()
+            depth1_api_name = "Depth1CommentsListPaginationQuery"
+            depth1_comment_api = api_registry.require(COMMENT_API_NAMES, cmt_api_path)[depth1_api_name]
 
             comment_info = list()
 
@@ -209,323 +265,193 @@ class Parser():
             iter = 0
             retry_count = 0
             while page_info['has_next_page'] and len(comment_info) < max_comment:
-                logger.debug(f"{'-' * 20} DEPTH01 COMMENT ITER {iter} {'-' * 20}")
                 try:
                     end_cursor = page_info['end_cursor']
                     resp = Requester._get_comments_depth1(headers, comment_id=feedback_id, expansion_token=expansion_token, get_comment_api=depth1_comment_api, end_cursor=end_cursor)
                     resp_jsons = Parser.parse_jsons(resp)
                     data_json = resp_jsons[0]
-                    comments = Parser.parse_depth1_comments(data_json, reaction_id_info=reaction_id_info)
+                    comments = Parser.parse_depth1_comments(data_json, reaction_id_info=reaction_id_info, downloader=downloader)
                     cur_page_info = Parser.parse_depth1_comment_page_info(resp)
 
-                    logger.debug(f"{'-' * 20} Lấy DEPTH01 COMMENT ITER thành công {iter} {'-' * 20}")
                     comment_info += list(comments)
                     page_info = cur_page_info
                     retry_count = 0
+                    api_registry.mark_verified({depth1_api_name: depth1_comment_api})
                 except:
-                    logger.debug(f"{'-' * 20} Lấy DEPTH01 COMMENT ITER {iter} thất bại {'-' * 20}")
                     retry_count += 1
-                    logger.debug(f"Retry lần thứ {retry_count}")
+                    logger.debug("Lấy DEPTH01 COMMENT ITER %s thất bại, retry lần thứ %s", iter, retry_count)
                     if retry_count >= max_retry:
-                        logger.debug(f"Thử lại thất bại")
+                        logger.debug("Thử lại thất bại")
                         break
-                time.sleep(break_time)
                 iter += 1
                 
-            for idx, comment in enumerate(comment_info):
-                logger.debug(f"Comment {idx}:")
-                logger.debug(f"Text: {comment['text']}")
-                logger.debug(f"Image: {comment['image']}")
-                logger.debug(f"\n")
+            if logger.isEnabledFor(logging.DEBUG):
+                for idx, comment in enumerate(comment_info):
+                    logger.debug("Comment %s:\nText: %s\nImage: %s\n", idx, comment['text'], comment['image'])
 
-            logger.debug(f"{'-' * 10} Lấy DEPTH01 COMMENT thành công {'-' * 10}")                
+            logger.debug("Lấy DEPTH01 COMMENT thành công: %s comment", len(comment_info))
             return comment_info
         except Exception as e:
             logger.error(f"Lỗi khi lấy comment {e}")
 
     @staticmethod
-    def parse_comments(resp_json: dict, headers: dict, reaction_id_info: dict, save_dir: str = "data\\image") -> list:
-        edges = resp_json['data']['node']['comment_rendering_instance_for_feed_location']['comments']['edges']
+    def _parse_comment_edge(edge: dict, reaction_id_info: dict, save_dir: str,
+                            downloader: Optional[ImageDownloader] = None) -> Tuple[dict, dict]:
+        '''
+        Trả về (comment, feedback_info) của một comment edge. feedback_info rỗng nếu comment không có reply.
+        '''
+        fields = COMMENT_FIELD_PLAN.extract(edge)
+        comment = {
+            'text': "",
+            'image': None,
+            'reactions': {}
+        }
+        if fields['text'] is not None:
+            comment['text'] = fields['text']
+        else:
+            logger.warning("Không tìm thấy text trong comment")
+
+        if fields['attachments']:
+            uri = get_path(fields['attachments'], (-1,) + COMMENT_IMAGE_PATH)
+            if uri:
+                comment['image'] = Parser._save_image(uri, save_dir, downloader)
+
+        try:
+            comment['reactions'] = Parser.parse_reaction_comments_info(edge, reaction_id_info)
+        except Exception as e:
+            logger.warning("Không lấy được reactions trong comment")
+
+        feedback_info = dict()
+        if None not in (fields['replies_total_count'], fields['feedback_id'], fields['expansion_token']):
+            feedback_info['total_count'] = fields['replies_total_count']
+            feedback_info['id'] = fields['feedback_id']
+            feedback_info['expansion_token'] = fields['expansion_token']
+        else:
+            logger.warning(f"Không lấy được FEEDBACK_INFO cho comment")
+        return comment, feedback_info
+
+    @staticmethod
+    def parse_comments(resp_json: dict, headers: dict, reaction_id_info: dict, save_dir: str = "data\\image",
+                       fetch_depth1: bool = True, downloader: Optional[ImageDownloader] = None) -> list:
+        edges = get_path(resp_json, COMMENTS_PATH + ('edges',), [])
 
         comments = []
         for edge in edges:
-            comment = {
-                'text': "",
-                'image': None,
-                'reactions': {}
-            }
-            try:
-                comment['text'] = edge['node']['body']['text']
-            except Exception as e:
-                logger.warning("Không tìm thấy text trong comment") 
-            
-            try:
-                attachments = edge['node'].get('attachments', [])
-                if attachments:
-                    att = attachments[-1]
-                    img_info = att['style_type_renderer']['attachment']['media']['image']
-                    uri = img_info.get('uri')
-                    if uri:
-                        filename = os.path.join(save_dir, os.path.basename(uri.split("?")[0]))
-                        if is_valid_image(filename):
-                            img = requests.get(uri)
-                            with open(filename, "wb") as f:
-                                f.write(img.content)
-                            comment['image'] = filename
-            except Exception as e:
-                logger.warning("Không lấy được ảnh trong comment")
-
-            try:
-                comment['reactions'] = Parser.parse_reaction_comments_info(edge, reaction_id_info)
-            except Exception as e:
-                logger.warning("Không lấy được reactions trong comment")
-            
-            feedback_info = dict()
-            try:
-                feedback_info['total_count'] = edge['node']['feedback']['replies_fields']['total_count']
-                feedback_info['id'] = edge['node']['feedback']['id']
-                feedback_info['expansion_token'] = edge['node']['feedback']['expansion_info']['expansion_token']
+            comment, feedback_info = Parser._parse_comment_edge(edge, reaction_id_info, save_dir, downloader)
+            # Chế độ async tự lấy DEPTH01 COMMENT song song nên bỏ qua bước này
+            if feedback_info and fetch_depth1:
                 feedback_info['comments'] = Parser.scraper_depth1_comments(headers=headers, feedback_id=feedback_info['id'], expansion_token=feedback_info['expansion_token'], \
-                                                                            reaction_id_info=reaction_id_info)
-                logger.debug(f"Lấy FEEDBACK_INFO cho parent comment thành công")
-            except Exception as e:
-                logger.warning(f"Không lấy được FEEDBACK_INFO cho parent comment {e}")
-            finally:
-                comment['feedback_info'] = feedback_info
-
-                comments.append(comment)
+                                                                            reaction_id_info=reaction_id_info, downloader=downloader)
+            comment['feedback_info'] = feedback_info
+            comments.append(comment)
 
         return comments
 
     @staticmethod
-    def parse_comments_info(resp: requests.Response, headers: dict, reaction_id_info: dict, save_dir="data\\image") -> dict:
-        resp_jsons = Parser.parse_jsons(resp)
-        resp_json = resp_jsons[0]
+    def parse_comments_info(resp: requests.Response, headers: dict, reaction_id_info: dict, save_dir="data\\image",
+                            fetch_depth1: bool = True, downloader: Optional[ImageDownloader] = None) -> dict:
+        resp_json = ParsedResponse.of(resp).first
 
         comments_info = dict()
         comments_info['total_comment'] = Parser.parse_total_cmt(resp_json)
         comments_info['total_parent_comment'] = Parser.parse_total_parent_cmt(resp_json)
-        comments_info['comments'] = Parser.parse_comments(resp_json, headers, reaction_id_info, save_dir=save_dir)
+        comments_info['comments'] = Parser.parse_comments(resp_json, headers, reaction_id_info, save_dir=save_dir,
+                                                          fetch_depth1=fetch_depth1, downloader=downloader)
         return comments_info
 
     @staticmethod
-    def parse_page_info(resp: requests.Response) -> str:
-        resp_jsons = Parser.parse_jsons(resp)
-        resp_json = resp_jsons[0]
-        page_info = resp_json['data']['node']['comment_rendering_instance_for_feed_location']['comments']['page_info']
-
+    def parse_page_info(resp: requests.Response) -> dict:
+        page_info = ParsedResponse.of(resp).get(COMMENTS_PATH + ('page_info',))
+        if page_info is None:
+            raise KeyError("Không tìm thấy page_info của comment")
         return page_info
+
     @staticmethod
-    def parse_depth1_comment_page_info(resp: requests.Response) -> str:
-        resp_json = Parser.parse_jsons(resp)[0]
-        page_info = resp_json['data']['node']['replies_connection']['page_info']
+    def parse_depth1_comment_page_info(resp: requests.Response) -> dict:
+        page_info = ParsedResponse.of(resp).get(REPLIES_PATH + ('page_info',))
+        if page_info is None:
+            raise KeyError("Không tìm thấy page_info của DEPTH01 COMMENT")
         return page_info
     
     @staticmethod
-    def parse_depth1_comments(resp_json: dict, reaction_id_info: dict, save_dir: str = "data\\image") -> list:
+    def parse_depth1_comments(resp_json: dict, reaction_id_info: dict, save_dir: str = "data\\image",
+                              downloader: Optional[ImageDownloader] = None) -> list:
         logger.debug(f"Tiến hành parse DEPTH1 COMMENT")
         edges = resp_json['data']['node']['replies_connection']['edges']
 
         comments = []
-        for idx, edge in enumerate(edges):
-            logger.debug(f"Tiến hành parse edge thứ {idx+1}")
-            comment = {
-                'text': "",
-                'image': None,
-                'reactions': {}
-            }
-            try:
-                comment['text'] = edge['node']['body']['text']
-            except Exception as e:
-                logger.warning("Không tìm thấy text trong comment") 
-            
-            try:
-                attachments = edge['node'].get('attachments', [])
-                if attachments:
-                    att = attachments[-1]
-                    img_info = att['style_type_renderer']['attachment']['media']['image']
-                    uri = img_info.get('uri')
-                    if uri:
-                        filename = os.path.join(save_dir, os.path.basename(uri.split("?")[0]))
-                        if is_valid_image(filename):
-                            img = requests.get(uri)
-                            with open(filename, "wb") as f:
-                                f.write(img.content)
-                            comment['image'] = filename
-            except Exception as e:
-                logger.warning("Không lấy được ảnh trong comment")
-
-            try:
-                comment['reactions'] = Parser.parse_reaction_comments_info(edge, reaction_id_info)
-            except Exception as e:
-                logger.warning("Không lấy được reactions trong comment")
-            
-            feedback_info = dict()
-            try:
-                feedback_info['total_count'] = edge['node']['feedback']['replies_fields']['total_count']
-                feedback_info['id'] = edge['node']['feedback']['id']
-                feedback_info['expansion_token'] = edge['node']['feedback']['expansion_info']['expansion_token']
+        for edge in edges:
+            comment, feedback_info = Parser._parse_comment_edge(edge, reaction_id_info, save_dir, downloader)
+            if feedback_info:
                 comment['feedback_info'] = feedback_info
-                logger.debug(f"Lấy FEEDBACK_INFO cho parent comment thành công")
-            except Exception as e:
-                logger.warning(f"Không lấy được FEEDBACK_INFO cho parent comment {e}")
-
             comments.append(comment)
 
         return comments
     
-    
     @staticmethod
-    def extract_message_and_attachments(obj):
-        message = ""
-        attachments = []
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-                # print(node)
-            else:
-                node = obj['data']['node']
-                # print(node)
-            if 'label' not in obj:
-                message = node['comet_sections']['content']['story']['comet_sections']['message']['story']['message']['text'].strip()
-                attachments = node['comet_sections']['content']['story'].get('attachments', [])
-            else:
-                message = node['comet_sections']['content']['story']['comet_sections']['message']['story']['message']['text'].strip()
-                attachments = node['comet_sections']['content']['story'].get('attachments', [])
-        except Exception as e:
-            logger.warning(f"Không lấy được text: {e}")
-            attachments = []
+    def _post_node(obj: dict) -> Optional[dict]:
+        return get_path(obj, LABEL_POST_ROOT if 'label' in obj else TIMELINE_POST_ROOT)
+
+    @staticmethod
+    def extract_post_fields(obj: dict) -> dict:
+        '''
+        Lấy toàn bộ field của post trong một lần duyệt theo POST_FIELD_PLAN.
+        '''
+        return POST_FIELD_PLAN.extract(Parser._post_node(obj))
+
+    @staticmethod
+    def clean_message(message: Optional[str]) -> str:
+        message = (message or "").strip()
         message = message.replace('\n', ' ').replace('\r', ' ')
-        message = message.split('Theo:')[0].split('Nguồn:')[0].split('Cre:')[0].strip()
-        return message, attachments
+        return message.split('Theo:')[0].split('Nguồn:')[0].split('Cre:')[0].strip()
+
+    @staticmethod
+    def reactions_detail(top_reactions: list) -> dict:
+        reactions_detail = {}
+        for react in top_reactions:
+            name = get_path(react, ('node', 'localized_name'), 'Unknown')
+            reactions_detail[name] = react.get('reaction_count', 0)
+        return reactions_detail
+
+    @staticmethod
+    def extract_message_and_attachments(obj):
+        fields = Parser.extract_post_fields(obj)
+        return Parser.clean_message(fields['message']), fields['attachments']
     
     @staticmethod
     def extract_post_url(obj):
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-            else:
-                node = obj['data']['node']
-            story = node['comet_sections']['content']['story']
-            post_url = story.get("wwwURL", None)
-            return post_url
-        except Exception as e:
-            logger.warning(f"Không lấy được post url: {e}")
-            return None
+        return get_path(Parser._post_node(obj), _STORY + ('wwwURL',))
 
     @staticmethod
     def extract_comment_count(obj):
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-            else:
-                node = obj['data']['node']
-            comment_count = node.get('comet_sections', {}) \
-                .get('feedback', {}) \
-                .get('story', {}) \
-                .get('story_ufi_container', {}) \
-                .get('story', {}) \
-                .get('feedback_context', {}) \
-                .get('feedback_target_with_context', {}) \
-                .get('comment_list_renderer', {}) \
-                .get('feedback', {}) \
-                .get('comment_rendering_instance', {}) \
-                .get('comments', {}) \
-                .get('total_count', 0)
-            return comment_count
-        except Exception as e:
-            logger.warning(f"Không lấy được comment count: {e}")
-            return 0
+        return Parser.extract_post_fields(obj)['comment_count']
 
     @staticmethod
     def extract_share_count(obj):
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-            else:
-                node = obj['data']['node']
-            feedback_ctx = node.get('comet_sections', {}) \
-                .get('feedback', {}) \
-                .get('story', {}) \
-                .get('story_ufi_container', {}) \
-                .get('story', {}) \
-                .get('feedback_context', {}) \
-                .get('feedback_target_with_context', {})
-            
-            summary = feedback_ctx.get('comet_ufi_summary_and_actions_renderer', {})
-            feedback = summary.get('feedback', {})
-            share_count = feedback.get('i18n_share_count', None)
-            return share_count
-        except Exception as e:
-            logger.warning(f"Không lấy được share count: {e}")
-            return None
+        return Parser.extract_post_fields(obj)['share_count']
 
     @staticmethod
     def extract_reactions(obj):
-        total_reactions = 0
-        reactions_detail = {}
-
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-            else:
-                node = obj['data']['node']
-
-            feedback_ctx = node.get('comet_sections', {}) \
-                .get('feedback', {}) \
-                .get('story', {}) \
-                .get('story_ufi_container', {}) \
-                .get('story', {}) \
-                .get('feedback_context', {}) \
-                .get('feedback_target_with_context', {})
-            
-            summary = feedback_ctx.get('comet_ufi_summary_and_actions_renderer', {})
-            feedback = summary.get('feedback', {})
-            total_reactions = feedback.get('reaction_count', {}).get('count', 0)
-            top_reactions = feedback.get('top_reactions', {}).get('edges', [])
-            
-            for react in top_reactions:
-                node_react = react.get('node', {})
-                name = node_react.get('localized_name', 'Unknown')
-                count = react.get('reaction_count', 0)
-                reactions_detail[name] = count
-                
-        except Exception as e:
-            logger.warning(f"Không lấy được reactions: {e}")
-        return total_reactions, reactions_detail
+        fields = Parser.extract_post_fields(obj)
+        return fields['total_reactions'], Parser.reactions_detail(fields['top_reactions'])
 
     @staticmethod
     def extract_feedback_id(obj):
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']
-            else:
-                node = obj['data']['node']
-            feedback = node.get('feedback', {})
-            feedback_id = feedback.get('id', None)
-            return feedback_id
-        except Exception as e:
-            logger.warning(f"Không lấy được feedback id: {e}")
-            return None
+        return get_path(Parser._post_node(obj), ('feedback', 'id'))
 
     @staticmethod
     def extract_creation_time(obj):
-        try:
-            if 'label' not in obj:
-                node = obj['data']['node']['timeline_list_feed_units']['edges'][0]['node']['comet_sections']
-            else:
-                node = obj['data']['node']['comet_sections']
-            timestamp = node.get('timestamp', {})
-            story = timestamp.get('story', {})
-            creation_time = story.get('creation_time', None)
-            return creation_time
-        except Exception as e:
-            logger.warning(f"Không lấy được creation_time: {e}")
-            return None
+        return get_path(Parser._post_node(obj), ('comet_sections', 'timestamp', 'story', 'creation_time'))
 
     @staticmethod
-    def parse_post_obj(obj, save_dir="data\\image"):
-        post_url = Parser.extract_post_url(obj)
+    def parse_post_obj(obj, save_dir="data\\image", downloader: Optional[ImageDownloader] = None,
+                       fields: Optional[dict] = None):
+        '''
+        fields: kết quả extract_post_fields(obj) nếu đã có, tránh duyệt lại json.
+        '''
+        if fields is None:
+            fields = Parser.extract_post_fields(obj)
+        post_url = fields['post_url']
 
         if post_url == None:
             logger.warning("Không tìm thấy Post")
@@ -533,38 +459,27 @@ class Parser():
         
         logger.debug(f"Tìm Post thành công {post_url}")
 
-        message, attachments = Parser.extract_message_and_attachments(obj)
-        total_reactions, reactions_detail = Parser.extract_reactions(obj)
-        page_info_found = True
-        feedback_id = Parser.extract_feedback_id(obj)
-        creation_time = Parser.extract_creation_time(obj)
-        share_count = Parser.extract_share_count(obj)
-        comment_count = Parser.extract_comment_count(obj)
-        image_paths = Parser.download_images_from_attachments(attachments, save_dir)
+        image_paths = Parser.download_images_from_attachments(fields['attachments'], save_dir, downloader)
 
         return {
-            "post_content": message,
+            "post_content": Parser.clean_message(fields['message']),
             "image_paths": image_paths,
-            "feedback_id": feedback_id,
-            "creation_time": creation_time,
-            "total_reactions": total_reactions,
-            "reactions_detail": reactions_detail,
-            "share_count": share_count,
-            "comment_count": comment_count,
+            "feedback_id": fields['feedback_id'],
+            "creation_time": fields['creation_time'],
+            "total_reactions": fields['total_reactions'],
+            "reactions_detail": Parser.reactions_detail(fields['top_reactions']),
+            "share_count": fields['share_count'],
+            "comment_count": fields['comment_count'],
             "post_url": post_url
         }
     
     @staticmethod 
     def parse_post_page_info(jsons: list[dict]) -> dict:
         page_info = {}
-        for idx, json in enumerate(jsons):
-            announce = f"Tìm kiếm PageInfo ở json thứ {idx + 1}"
-            try:
-                new_page_info = json['data']['page_info']
+        for json in jsons:
+            new_page_info = get_path(json, ('data', 'page_info'))
+            if new_page_info is not None:
                 page_info = new_page_info
-                logger.warning(announce + " - " + "Tìm thấy PageInfo")
-            except Exception as e:
-                logger.warning(announce + " - " + "Không tìm thấy PageInfo") 
 
         if page_info == {}:
             logger.warning("Lấy PageInfo không thành công")
@@ -575,9 +490,13 @@ class Parser():
 
 
     @staticmethod
-    def parse_jsons(resp: requests.Response) -> dict:
-        logger.debug(f"Tiến hành parse jsons")
-        return [json.loads(d) for d in resp.text.split('\r\n', -1) if d.strip()]        
+    def parse_jsons(resp: requests.Response) -> list[dict]:
+        # Response chỉ được decode một lần dù được parse bởi nhiều hàm
+        return ParsedResponse.of(resp).jsons
+
+    @staticmethod
+    def parse_jsons_text(text: str) -> list[dict]:
+        return ParsedResponse(text).jsons
 
     @staticmethod
     def _parse_docid(entryPoint: str, homepage_response: requests.Response):
@@ -586,7 +505,7 @@ class Parser():
             docid = 'NoDocid'
         else:
             for link in soup.findAll('link', {'rel': 'preload'}):
-                resp = requests.get(link['href'])
+                resp = HttpClient.get(link['href'])
                 for line in resp.text.split('\n', -1):
                     if 'ProfileCometTimelineFeedRefetchQuery_' in line:
                         docid = re.findall('e.exports="([0-9]{1,})"', line)[0]
@@ -0,0 +1,128 @@
+from logger import setup_logger
+from typing import Optional
+import random
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+# Tốc độ khởi đầu (request/giây) của từng endpoint, tự điều chỉnh theo phản hồi của server
+DEFAULT_RATES = {
+    "headers": 1.0,
+    "homepage": 0.5,
+    "posts": 0.5,
+    "comments": 1.0,
+    "more_comments": 1.0,
+    "depth1_comments": 2.0,
+}
+DEFAULT_MIN_RATE = 0.05
+DEFAULT_MAX_RATE = 8.0
+# AIMD: mỗi response thành công cộng thêm ADDITIVE_INCREASE, mỗi lần bị chặn/lỗi nhân với DECREASE_FACTOR
+ADDITIVE_INCREASE = 0.05
+DECREASE_FACTOR = 0.5
+
+# Các status đáng thử lại sau khi chờ; các lỗi 4xx khác không tự hết khi gửi lại
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    '''
+    Exponential backoff với full jitter: chờ ngẫu nhiên trong [0, min(cap, base * 2^attempt)].
+    '''
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TokenBucket():
+    '''
+    Token bucket có tốc độ thay đổi theo AIMD: tăng dần khi server trả lời tốt,
+    giảm một nửa khi gặp 429/5xx hoặc lỗi kết nối.
+    '''
+    def __init__(self, rate: float, burst: float = 1.0, min_rate: float = DEFAULT_MIN_RATE,
+                 max_rate: float = DEFAULT_MAX_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        '''
+        Lấy một token và trả về số giây cần chờ trước khi gửi request (0 nếu gửi được ngay).
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+
+class RateLimiter():
+    '''
+    Bộ giới hạn tốc độ dùng chung cho mọi request của Requester (và AsyncRequester),
+    mỗi endpoint một token bucket.
+    '''
+    rates = dict(DEFAULT_RATES)
+    _buckets = dict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def configure(rates: Optional[dict] = None) -> None:
+        with RateLimiter._lock:
+            RateLimiter.rates = {**DEFAULT_RATES, **(rates or {})}
+            RateLimiter._buckets = dict()
+        logger.debug(f"Cấu hình RateLimiter {RateLimiter.rates}")
+
+    @staticmethod
+    def bucket(endpoint: str) -> TokenBucket:
+        with RateLimiter._lock:
+            if endpoint not in RateLimiter._buckets:
+                rate = RateLimiter.rates.get(endpoint, 1.0)
+                RateLimiter._buckets[endpoint] = TokenBucket(rate, max_rate=max(DEFAULT_MAX_RATE, rate))
+            return RateLimiter._buckets[endpoint]
+
+    @staticmethod
+    def acquire(endpoint: str) -> None:
+        RateLimiter.bucket(endpoint).acquire()
+
+    @staticmethod
+    def reserve(endpoint: str) -> float:
+        return RateLimiter.bucket(endpoint).reserve()
+
+    @staticmethod
+    def on_response(endpoint: str, status_code: int) -> None:
+        bucket = RateLimiter.bucket(endpoint)
+        if status_code in RETRY_STATUSES:
+            bucket.on_throttle()
+            logger.warning(f"Endpoint {endpoint} trả về {status_code}, giảm tốc độ còn {bucket.rate:.2f} request/s")
+        elif status_code == 200:
+            bucket.on_success()
+
+    @staticmethod
+    def on_error(endpoint: str) -> None:
+        bucket = RateLimiter.bucket(endpoint)
+        bucket.on_throttle()
+        logger.warning(f"Endpoint {endpoint} lỗi kết nối, giảm tốc độ còn {bucket.rate:.2f} request/s")
+
+    @staticmethod
+    def current_rates() -> dict:
+        with RateLimiter._lock:
+            return {endpoint: bucket.rate for endpoint, bucket in RateLimiter._buckets.items()}
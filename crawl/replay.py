@@ -0,0 +1,263 @@
+from logger import setup_logger
+from http_client import HttpClient
+from facebook_scraper import FacebookScraper
+from bootstrap_cache import BootstrapCache
+from checkpoint_store import CheckpointStore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+DEFAULT_FIXTURE_DIR = "./fixtures/replay"
+INDEX_FILE_NAME = "index.jsonl"
+
+# Ảnh 1x1 trả về khi không có fixture cho URL ảnh (ảnh không được ghi lại)
+PLACEHOLDER_GIF = base64.b64decode("R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw==")
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+def _form_value(data: Optional[dict], key: str) -> Optional[str]:
+    # data của requests là dict giá trị đơn, của parse_qs là dict giá trị list
+    value = (data or {}).get(key)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value
+
+def fixture_keys(method: str, host: str, path: str, data=None) -> tuple:
+    '''
+    Trả về (key chính xác, key dự phòng). Request GraphQL được phân biệt bởi doc_id và variables;
+    key dự phòng bỏ qua variables để replay được cả những cursor chưa từng ghi lại.
+    '''
+    base = f"{method.upper()} {host}{path.rstrip('/')}"
+    doc_id = _form_value(data, 'doc_id')
+    if doc_id is None:
+        return base, base
+    variables = _form_value(data, 'variables') or ""
+    digest = hashlib.sha1(variables.encode("utf-8")).hexdigest()[:16]
+    return f"{base} doc_id={doc_id} vars={digest}", f"{base} doc_id={doc_id}"
+
+class FixtureRecorder():
+    '''
+    Ghi lại response thật (GraphQL, homepage, headers, preload script) thành fixture để replay.
+    Gắn vào HttpClient.recorder để mọi request đi qua HttpClient được ghi.
+    '''
+    def __init__(self, fixture_dir: str = DEFAULT_FIXTURE_DIR):
+        self.fixture_dir = fixture_dir
+        self.bodies_dir = os.path.join(fixture_dir, "bodies")
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.n_recorded = 0
+
+    def record(self, method: str, url: str, data, resp) -> None:
+        parts = urlsplit(url)
+        key, fallback_key = fixture_keys(method, parts.netloc, parts.path, data)
+        body = resp.content
+        body_name = f"{hashlib.sha256(body).hexdigest()}.bin"
+        body_path = os.path.join(self.bodies_dir, body_name)
+        record = {
+            "key": key,
+            "fallback_key": fallback_key,
+            "url": url,
+            "status": resp.status_code,
+            "content_type": resp.headers.get("content-type", "text/html; charset=utf-8"),
+            "cookies": HttpClient.cookies_dict(resp),
+            "body": body_name,
+        }
+        with self._lock:
+            if not os.path.exists(body_path):
+                with open(body_path, "wb") as f:
+                    f.write(body)
+            with open(os.path.join(self.fixture_dir, INDEX_FILE_NAME), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.n_recorded += 1
+
+    def __enter__(self):
+        HttpClient.recorder = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        HttpClient.recorder = None
+        logger.debug(f"Đã ghi {self.n_recorded} fixture vào {self.fixture_dir}")
+
+class FixtureStore():
+    def __init__(self, fixture_dir: str = DEFAULT_FIXTURE_DIR):
+        self.fixture_dir = fixture_dir
+        self.exact = dict()
+        self.fallback = dict()
+        self._cursor = dict()
+        self._lock = threading.Lock()
+
+        with open(os.path.join(fixture_dir, INDEX_FILE_NAME), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.exact.setdefault(record["key"], []).append(record)
+                self.fallback.setdefault(record["fallback_key"], []).append(record)
+        logger.debug(f"Load {sum(len(v) for v in self.exact.values())} fixture từ {fixture_dir}")
+
+    def lookup(self, method: str, host: str, path: str, data=None) -> Optional[dict]:
+        key, fallback_key = fixture_keys(method, host, path, data)
+        for index, name in ((self.exact, key), (self.fallback, fallback_key)):
+            records = index.get(name)
+            if records:
+                # Cùng key được ghi nhiều lần thì trả về lần lượt
+                with self._lock:
+                    position = self._cursor.get(name, 0)
+                    self._cursor[name] = position + 1
+                return records[position % len(records)]
+        return None
+
+    def body(self, record: dict) -> bytes:
+        with open(os.path.join(self.fixture_dir, "bodies", record["body"]), "rb") as f:
+            return f.read()
+
+class ReplayServer():
+    '''
+    Server thay thế facebook.com: URL có dạng /<host gốc><path gốc>, trả về fixture đã ghi.
+    latency (giây) + jitter mô phỏng độ trễ mạng, error_rate trả về ngẫu nhiên error_status.
+    '''
+    def __init__(self, fixture_dir: str = DEFAULT_FIXTURE_DIR, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 500):
+        self.store = FixtureStore(fixture_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.n_requests = 0
+        self.n_missing = 0
+        self.n_errors = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                data = parse_qs(self.rfile.read(length).decode("utf-8")) if length else None
+                replay._respond(self, method, data)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body: bytes,
+              content_type: str = "text/plain; charset=utf-8", cookies: Optional[dict] = None) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (cookies or {}).items():
+            handler.send_header("Set-Cookie", f"{name}={value}; Path=/")
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _respond(self, handler: BaseHTTPRequestHandler, method: str, data) -> None:
+        with self._lock:
+            self.n_requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.n_errors += 1
+            self._send(handler, self.error_status, b"injected error")
+            return
+
+        parts = urlsplit(handler.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        record = self.store.lookup(method, host, f"/{path}", data)
+        if record is None:
+            if path.lower().endswith(IMAGE_EXTS):
+                self._send(handler, 200, PLACEHOLDER_GIF, content_type="image/gif")
+                return
+            with self._lock:
+                self.n_missing += 1
+            logger.warning(f"Không có fixture cho {method} {host}/{path}")
+            self._send(handler, 404, b"no fixture")
+            return
+
+        self._send(handler, record["status"], self.store.body(record), content_type=record["content_type"],
+                   cookies=record["cookies"])
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replay-server", daemon=True)
+        self._thread.start()
+        logger.debug(f"Replay server chạy tại {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ghi lại và replay response của facebook.com")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Crawl thật và ghi response thành fixture")
+    record_parser.add_argument("page_url")
+    record_parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    record_parser.add_argument("--max-post", type=int, default=30)
+    record_parser.add_argument("--max-parent-comment", type=int, default=20)
+    record_parser.add_argument("--max-depth1-comment", type=int, default=30)
+
+    serve_parser = subparsers.add_parser("serve", help="Chạy replay server")
+    serve_parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ cố định mỗi request (giây)")
+    serve_parser.add_argument("--jitter", type=float, default=0.0, help="Độ trễ ngẫu nhiên thêm vào (giây)")
+    serve_parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả về lỗi")
+    serve_parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        # Không dùng cache/checkpoint có sẵn để mọi request khởi tạo đều được ghi lại
+        tmp_dir = tempfile.mkdtemp()
+        scraper = FacebookScraper(bootstrap_cache=BootstrapCache(os.path.join(tmp_dir, "bootstrap.json")),
+                                  checkpoint_store=CheckpointStore(os.path.join(tmp_dir, "checkpoints.sqlite")))
+        with FixtureRecorder(args.fixture_dir) as recorder:
+            scraper.crawl_post(args.page_url, max_post=args.max_post, max_parent_comment=args.max_parent_comment,
+                               max_depth1_comment=args.max_depth1_comment,
+                               save_dir=os.path.join(tmp_dir, "image"), output_dir=os.path.join(tmp_dir, "json"))
+        print(f"Đã ghi {recorder.n_recorded} response vào {args.fixture_dir}")
+    else:
+        server = ReplayServer(args.fixture_dir, port=args.port, latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, error_status=args.error_status)
+        print(f"Replay server chạy tại {server.url}")
+        try:
+            server._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
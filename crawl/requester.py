@@ -1,29 +1,78 @@
 import requests
 from logger import setup_logger
+from http_client import HttpClient, RequestBudgetExceeded
+from rate_limiter import RateLimiter, RETRY_STATUSES, backoff_delay
+from metrics import Metrics
 import re
 import time
 from enum import Enum
 import logging
 
 logger = setup_logger(__name__, logging.DEBUG)
+
+GRAPHQL_URL = "https://www.facebook.com/api/graphql/"
+# Số lần thử lại (có backoff) khi gặp 429/5xx hoặc lỗi kết nối
+DEFAULT_MAX_RETRY = 3
+HOMEPAGE_MAX_RETRY = 8
+
 class Ranking(Enum):
     ALL_COMMENTS = "RANKED_UNFILTERED_CHRONOLOGICAL_REPLIES_INTENT_V1"
     MOST_RELEVANT = "RANKED_FILTERED_INTENT_V1"
     NEWEST = "REVERSE_CHRONOLOGICAL_UNFILTERED_INTENT_V1"
 class Requester():
     @staticmethod
-    def _get_headers(pageurl: str):
+    def _send(endpoint: str, method: str, url: str, max_retry: int = DEFAULT_MAX_RETRY, **kwargs) -> requests.Response:
         '''
-        Send a request to get cookieid as headers.
+        Gửi request qua RateLimiter của endpoint. Khi gặp 429/5xx hoặc lỗi kết nối thì giảm tốc độ
+        của endpoint và thử lại sau một khoảng backoff ngẫu nhiên.
         '''
-        pageurl = re.sub('www', 'm', pageurl)
-        resp = requests.get(pageurl)
+        for attempt in range(max_retry + 1):
+            wait_start = time.perf_counter()
+            RateLimiter.acquire(endpoint)
+            start = time.perf_counter()
+            Metrics.observe("crawler_rate_limit_wait_seconds", start - wait_start, endpoint=endpoint)
+            try:
+                resp = HttpClient.request(method, url, **kwargs)
+            except RequestBudgetExceeded:
+                raise
+            except Exception as e:
+                Metrics.record_request(endpoint, "error", time.perf_counter() - start)
+                RateLimiter.on_error(endpoint)
+                if attempt >= max_retry:
+                    raise
+                Metrics.record_retry(endpoint, "error")
+                delay = backoff_delay(attempt)
+                logger.debug(f"Lỗi khi gửi request {endpoint} {e}, thử lại sau {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            Metrics.record_request(endpoint, resp.status_code, time.perf_counter() - start, len(resp.content))
+            RateLimiter.on_response(endpoint, resp.status_code)
+            Metrics.set_gauge("crawler_rate_limit_rps", RateLimiter.bucket(endpoint).rate, endpoint=endpoint)
+            if resp.status_code not in RETRY_STATUSES or attempt >= max_retry:
+                return resp
+            Metrics.record_retry(endpoint, resp.status_code)
+            delay = backoff_delay(attempt)
+            logger.debug(f"Request {endpoint} trả về {resp.status_code}, thử lại sau {delay:.1f}s")
+            time.sleep(delay)
+
+    @staticmethod
+    def _build_headers(cookies: dict) -> dict:
         headers = {
             'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
             'accept-language': 'en'
         }
-        cookies = resp.cookies.get_dict()
         headers['cookie'] = '; '.join([f'{k}={v}' for k, v in cookies.items()])
+        return headers
+
+    @staticmethod
+    def _get_headers(pageurl: str):
+        '''
+        Send a request to get cookieid as headers.
+        '''
+        pageurl = re.sub('www', 'm', pageurl)
+        resp = Requester._send("headers", "GET", pageurl)
+        headers = Requester._build_headers(HttpClient.cookies_dict(resp))
 
         logger.debug("Lấy headers thành công")
         return headers
@@ -34,22 +83,19 @@ class Requester():
         Send a request to get the homepage response
         '''
         pageurl = re.sub('/$', '', pageurl)
-        timeout_cnt = 0
-        while True:
-            try:
-                homepage_response = requests.get(pageurl, headers=headers, timeout=3)
-                return homepage_response
-            except:
-                time.sleep(5)
-                timeout_cnt += 1
-                if timeout_cnt > 20:
-                    class homepage_response:
-                        text = 'Sorry, something went wrong.'
-                    return homepage_response
+        try:
+            return Requester._send("homepage", "GET", pageurl, max_retry=HOMEPAGE_MAX_RETRY, headers=headers, timeout=3)
+        except RequestBudgetExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Không lấy được homepage {e}")
+            class homepage_response:
+                text = 'Sorry, something went wrong.'
+            return homepage_response
 
     @staticmethod
-    def _get_comments(headers: dict, post_id: str, ranking: Ranking, get_post_api: str) -> requests.Response:
-        data = {
+    def _build_comments_data(post_id: str, ranking: Ranking, get_post_api: str) -> dict:
+        return {
             "variables": str({
                 "commentsIntentToken": ranking.value,
                 "scale": 1,
@@ -59,22 +105,9 @@ class Requester():
             "doc_id": get_post_api
         }
 
-        url = "https://www.facebook.com/api/graphql/"
-        try:
-            resp = requests.post(url, data=data, headers=headers)
-
-            if resp.status_code != 200:
-                logger.warning(f"Lỗi khi request comment {resp.status_code}")
-            else:
-                logger.debug(f"Lấy comment thành công")
-            return resp
-        except Exception as e:
-            logger.debug(f"Lỗi khi request comment {e}")
-            return None 
-
     @staticmethod
-    def _get_more_comments(headers: dict, post_id: str, ranking: Ranking, get_post_api: str, end_cursor: str) -> requests.Response:
-        data = {
+    def _build_more_comments_data(post_id: str, ranking: Ranking, get_post_api: str, end_cursor: str) -> dict:
+        return {
             "variables": str({"commentsAfterCount": -1,
                               "commentsAfterCursor": end_cursor, 
                               "commentsIntentToken": ranking.value,
@@ -85,17 +118,8 @@ class Requester():
             "doc_id": get_post_api
         }
 
-        url = "https://www.facebook.com/api/graphql/"
-
-        try:
-            resp = requests.post(url, data=data, headers=headers)
-            return resp
-        except Exception as e:
-            logger.debug(f"Lỗi khi request comment {e}")
-            return None 
-
     @staticmethod
-    def _get_comments_depth1(headers: dict, comment_id: str, expansion_token: str,  get_comment_api: str, end_cursor: str = "") -> requests.Response:
+    def _build_comments_depth1_data(comment_id: str, expansion_token: str, get_comment_api: str, end_cursor: str = "") -> dict:
         variables = {
             "expansionToken": expansion_token,
             "scale": 1,
@@ -106,20 +130,73 @@ class Requester():
         if end_cursor:
             variables['repliesAfterCursor'] = end_cursor
         
-        data = {
+        return {
             "variables": str(variables),
             "doc_id": get_comment_api
         }
 
-        url = "https://www.facebook.com/api/graphql/"
+    @staticmethod
+    def _build_posts_data(time_range: dict, identifier: str, docid: str, cursor: str = "") -> dict:
+        return {
+            'variables': str({
+                'afterTime': time_range['after_time'],
+                "beforeTime": time_range['before_time'],
+                'cursor': cursor,
+                'id': identifier,
+                'count': 3
+            }), 
+            'doc_id': docid
+        }
+
+    @staticmethod
+    def _get_comments(headers: dict, post_id: str, ranking: Ranking, get_post_api: str) -> requests.Response:
+        data = Requester._build_comments_data(post_id, ranking, get_post_api)
+
+        url = GRAPHQL_URL
+        try:
+            resp = Requester._send("comments", "POST", url, data=data, headers=headers)
+
+            if resp.status_code != 200:
+                logger.warning(f"Lỗi khi request comment {resp.status_code}")
+            else:
+                logger.debug(f"Lấy comment thành công")
+            return resp
+        except RequestBudgetExceeded:
+            raise
+        except Exception as e:
+            logger.debug(f"Lỗi khi request comment {e}")
+            return None 
+
+    @staticmethod
+    def _get_more_comments(headers: dict, post_id: str, ranking: Ranking, get_post_api: str, end_cursor: str) -> requests.Response:
+        data = Requester._build_more_comments_data(post_id, ranking, get_post_api, end_cursor)
+
+        url = GRAPHQL_URL
+
+        try:
+            resp = Requester._send("more_comments", "POST", url, data=data, headers=headers)
+            return resp
+        except RequestBudgetExceeded:
+            raise
+        except Exception as e:
+            logger.debug(f"Lỗi khi request comment {e}")
+            return None 
+
+    @staticmethod
+    def _get_comments_depth1(headers: dict, comment_id: str, expansion_token: str,  get_comment_api: str, end_cursor: str = "") -> requests.Response:
+        data = Requester._build_comments_depth1_data(comment_id, expansion_token, get_comment_api, end_cursor)
+
+        url = GRAPHQL_URL
         try:
-            resp = requests.post(url, data=data, headers=headers)
+            resp = Requester._send("depth1_comments", "POST", url, data=data, headers=headers)
 
             if resp.status_code != 200:
                 logger.warning(f"Lỗi khi request comment {resp.status_code}")
             else:
                 logger.debug(f"Lấy comment thành công")
             return resp
+        except RequestBudgetExceeded:
+            raise
         except Exception as e:
             logger.debug(f"Lỗi khi request comment {e}")
             return None 
@@ -127,23 +204,12 @@ class Requester():
 
     @staticmethod
     def _get_posts(headers: dict, time_range: dict, identifier: str, entryPoint: str, docid: str, cursor: str = "") -> requests.Response:
-        data = {
-            'variables': str({
-                'afterTime': time_range['after_time'],
-                "beforeTime": time_range['before_time'],
-                'cursor': cursor,
-                'id': identifier,
-                'count': 3
-            }), 
-            'doc_id': docid
-        }
+        data = Requester._build_posts_data(time_range, identifier, docid, cursor)
         try:
-            resp = requests.post(
-                url='https://www.facebook.com/api/graphql/',
-                data=data,
-                headers=headers
-            )
+            resp = Requester._send("posts", "POST", GRAPHQL_URL, data=data, headers=headers)
             return resp
+        except RequestBudgetExceeded:
+            raise
         except Exception as e:
             logger.debug(f"Lỗi khi request post {e}")
             return None
\ No newline at end of file
@@ -0,0 +1,216 @@
+from logger import setup_logger
+from output_sink import JsonlSink, iter_jsonl, COMPRESSION_SUFFIXES
+from image_store import ImageStore
+from collections.abc import Mapping
+from typing import Iterator, Optional
+import hashlib
+import os
+import logging
+
+logger = setup_logger(__name__, logging.DEBUG)
+
+POSTS_FILE_NAME = "posts.jsonl"
+COMMENTS_FILE_NAME = "comments.jsonl"
+IMAGES_FILE_NAME = "images.jsonl"
+
+def _basename(path: str) -> str:
+    # Đường dẫn ảnh được lưu trên Windows (data\image\...) lẫn Linux
+    return path.replace("\\", "/").rsplit("/", 1)[-1]
+
+def post_id_of(post: dict) -> str:
+    key = post.get("post_url") or post.get("post_content") or ""
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+class ThreadStoreWriter():
+    '''
+    Ghi output của crawler ở dạng chuẩn hoá: mỗi post, comment và ảnh xuất hiện đúng một lần.
+    Comment trỏ tới comment cha qua parent_id, post và comment trỏ tới ảnh qua image_id (hash nội dung),
+    thay vì chép nội dung post và các comment cha vào từng datapoint.
+    '''
+    def __init__(self, out_dir: str, image_dir: str = "data/image", compression: Optional[str] = None):
+        self.out_dir = out_dir
+        self.image_dir = image_dir
+        # JsonlSink ghi nối tiếp, ghi lại từ đầu thì xoá bản cũ
+        for file_name in (POSTS_FILE_NAME, COMMENTS_FILE_NAME, IMAGES_FILE_NAME):
+            path = os.path.join(out_dir, f"{file_name}{COMPRESSION_SUFFIXES[compression]}")
+            if os.path.exists(path):
+                os.remove(path)
+        self.posts = JsonlSink(os.path.join(out_dir, POSTS_FILE_NAME), compression=compression, flush_each_record=False)
+        self.comments = JsonlSink(os.path.join(out_dir, COMMENTS_FILE_NAME), compression=compression, flush_each_record=False)
+        self.images = JsonlSink(os.path.join(out_dir, IMAGES_FILE_NAME), compression=compression, flush_each_record=False)
+        self._image_ids = dict()
+        self._written_images = set()
+
+    def _image_id(self, path: str) -> str:
+        '''
+        sha256 nội dung ảnh (lấy từ ImageStore hoặc đọc file), nên cùng một ảnh dưới nhiều tên chỉ lưu một lần.
+        '''
+        if path in self._image_ids:
+            return self._image_ids[path]
+        image_id = ImageStore.for_dir(self.image_dir).hash_of(_basename(path))
+        if image_id is None:
+            local_path = os.path.join(self.image_dir, _basename(path))
+            if os.path.exists(local_path):
+                with open(local_path, "rb") as f:
+                    image_id = hashlib.sha256(f.read()).hexdigest()
+            else:
+                image_id = hashlib.sha256(_basename(path).encode("utf-8")).hexdigest()
+
+        if image_id not in self._written_images:
+            self._written_images.add(image_id)
+            self.images.write({"image_id": image_id, "path": path, "image_description": ""})
+        self._image_ids[path] = image_id
+        return image_id
+
+    def _write_comments(self, comments: list, post_id: str, parent_id: Optional[str], depth: int) -> int:
+        n_comments = 0
+        for idx, comment in enumerate(comments):
+            comment_id = f"{parent_id or post_id}.{idx}"
+            self.comments.write({
+                "comment_id": comment_id,
+                "post_id": post_id,
+                "parent_id": parent_id,
+                "depth": depth,
+                "text": comment.get("text"),
+                "image_ids": [self._image_id(comment["image"])] if comment.get("image") else [],
+                "reactions": comment.get("reactions", {}),
+            })
+            children = (comment.get("feedback_info") or {}).get("comments", [])
+            n_comments += 1 + self._write_comments(children, post_id, comment_id, depth + 1)
+        return n_comments
+
+    def add_post(self, post: dict) -> int:
+        '''
+        Ghi một post thô của crawler cùng toàn bộ cây comment, trả về số comment đã ghi.
+        '''
+        post_id = post_id_of(post)
+        self.posts.write({
+            "post_id": post_id,
+            "post_url": post.get("post_url"),
+            "post_content": post.get("post_content"),
+            "creation_time": post.get("creation_time"),
+            "total_reactions": post.get("total_reactions"),
+            "share_count": post.get("share_count"),
+            "comment_count": post.get("comment_count"),
+            "image_ids": [self._image_id(path) for path in post.get("image_paths") or []],
+        })
+        return self._write_comments((post.get("comments") or {}).get("comments", []), post_id, None, 0)
+
+    def close(self) -> None:
+        for sink in (self.posts, self.comments, self.images):
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+def _find(out_dir: str, file_name: str) -> str:
+    for suffix in ("", ".gz", ".zst"):
+        path = os.path.join(out_dir, f"{file_name}{suffix}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"Không tìm thấy {file_name} trong {out_dir}")
+
+class ThreadStore():
+    '''
+    Đọc dữ liệu chuẩn hoá do ThreadStoreWriter ghi. Mỗi post, comment, ảnh chỉ có một bản trong bộ nhớ;
+    ThreadView dựng input cho build_text/build_full_text của một comment khi cần.
+    '''
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.posts = {post["post_id"]: post for post in iter_jsonl(_find(out_dir, POSTS_FILE_NAME))}
+        self.comments = {comment["comment_id"]: comment for comment in iter_jsonl(_find(out_dir, COMMENTS_FILE_NAME))}
+        self.images = {image["image_id"]: image for image in iter_jsonl(_find(out_dir, IMAGES_FILE_NAME))}
+        logger.debug(f"Load {len(self.posts)} post, {len(self.comments)} comment, {len(self.images)} ảnh từ {out_dir}")
+
+    def set_image_descriptions(self, desc_map: dict) -> int:
+        '''
+        Gán mô tả ảnh theo basename của đường dẫn (như image_descriptions.jsonl), trả về số ảnh được gán.
+        '''
+        n_updated = 0
+        for image in self.images.values():
+            desc = desc_map.get(_basename(image["path"]))
+            if desc is not None:
+                image["image_description"] = desc
+                n_updated += 1
+        return n_updated
+
+    def image_descriptions(self, image_ids: list) -> list[dict]:
+        return [{"path": self.images[image_id]["path"], "image_description": self.images[image_id]["image_description"]}
+                for image_id in image_ids if image_id in self.images]
+
+    def ancestors(self, comment_id: str) -> list[dict]:
+        # Các comment cha từ gốc xuống, không tính comment hiện tại
+        chain = []
+        parent_id = self.comments[comment_id]["parent_id"]
+        while parent_id is not None:
+            parent = self.comments[parent_id]
+            chain.append(parent)
+            parent_id = parent["parent_id"]
+        return chain[::-1]
+
+    def view(self, comment_id: str) -> "ThreadView":
+        return ThreadView(self, comment_id)
+
+    def iter_views(self) -> Iterator["ThreadView"]:
+        for comment_id in self.comments:
+            yield ThreadView(self, comment_id)
+
+    def __len__(self) -> int:
+        return len(self.comments)
+
+class ThreadView(Mapping):
+    '''
+    Datapoint (post + một comment) ở dạng cũ, các field được dựng khi truy cập:
+    post_content, image_paths, image_descriptions, creation_time, ..., comment
+    (comment_text, comment_images, parent_comment_texts, ...). Dùng trực tiếp cho
+    build_full_text(item) / build_text(item) thay cho datapoint đã làm phẳng.
+    '''
+    POST_KEYS = ("post_content", "creation_time", "total_reactions", "share_count", "comment_count", "post_url")
+    KEYS = POST_KEYS + ("comment_id", "image_paths", "image_descriptions", "comment")
+
+    def __init__(self, store: ThreadStore, comment_id: str):
+        self.store = store
+        self.comment_id = comment_id
+        self._comment = store.comments[comment_id]
+        self._post = store.posts[self._comment["post_id"]]
+        self._comment_fields = None
+
+    def _build_comment(self) -> dict:
+        parents = self.store.ancestors(self.comment_id)
+        parent_image_ids = [image_id for parent in parents for image_id in parent["image_ids"]]
+        return {
+            "comment_text": self._comment["text"],
+            "comment_images": [self.store.images[i]["path"] for i in self._comment["image_ids"]],
+            "comment_image_descriptions": self.store.image_descriptions(self._comment["image_ids"]),
+            "parent_comment_texts": [parent["text"] for parent in parents],
+            "parent_comment_images": [self.store.images[i]["path"] for i in parent_image_ids],
+            "parent_comment_image_descriptions": self.store.image_descriptions(parent_image_ids),
+        }
+
+    def __getitem__(self, key: str):
+        if key in ThreadView.POST_KEYS:
+            return self._post[key]
+        if key == "comment_id":
+            return self.comment_id
+        if key == "image_paths":
+            return [self.store.images[i]["path"] for i in self._post["image_ids"]]
+        if key == "image_descriptions":
+            return self.store.image_descriptions(self._post["image_ids"])
+        if key == "comment":
+            # build_full_text gọi item.get("comment") nhiều lần, chỉ dựng một lần cho mỗi view
+            if self._comment_fields is None:
+                self._comment_fields = self._build_comment()
+            return self._comment_fields
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(ThreadView.KEYS)
+
+    def __len__(self) -> int:
+        return len(ThreadView.KEYS)
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in ThreadView.KEYS}
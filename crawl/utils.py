@@ -30,32 +30,6 @@ class Utils():
             logger.error(f"Lỗi khi load cookies {path} {e}")
             raise Exception("Lỗi khi load cookies", e)
 
-    @staticmethod
-    def check_and_add_api(json_path: str, data: Tuple[str, int]) -> None:
-        if os.path.exists(json_path):
-            try:
-                with open(json_path, "r", encoding="utf-8") as file:
-                    json_data = json.load(file)
-            except json.JSONDecodeError:
-                json_data = {}
-        else:
-            json_data = {}
-
-        key, value = data
-
-        if key not in json_data.keys():
-            json_data[key] = value
-        else:
-            if json_data[key] != value:
-                json_data[key] = value
-        try:
-            with open(json_path, "w", encoding="utf-8") as file:
-                json.dump(json_data, file, ensure_ascii=False, indent=4)
-            
-            logger.debug(f"Ghi facebook api vào log thành công {data}")
-        except Exception as e:
-            logger.error(f"Lỗi khi ghi facebook api vào log {data}")
-
     @staticmethod
     def write_json(json_path: str, data: dict) -> None:
         if not os.path.exists(os.path.dirname(json_path)):
@@ -113,43 +87,6 @@ class Utils():
             logger.error(f"Lỗi khi lấy url ngẫu nhiên {file_path} {e}")
             raise Exception("Lỗi khi lấy url ngẫu nhiên", e)
 
-    def is_apis_in_source(json_path: str, api_names: list[str]) -> bool:
-        try:
-            if not os.path.exists(json_path):
-                logger.warning(f"File {json_path} không tồn tại")
-                return False
-
-            api_sources = Utils.load_json(json_path)
-            for api_name in api_names:
-                if api_name not in api_sources.keys():
-                    logger.warning(f"API {api_name} không tồn tại")
-                    return False
-                else:
-                    logger.debug(f"API {api_name} tồn tại")
-            return True
-        except Exception as e:
-            logger.error(f"Lỗi khi kiểm tra api {json_path} {e}")
-
-    @staticmethod
-    def export_api2json(api_path: str, json_path: str, api_names: list[str]) -> None:
-        try:
-            if not os.path.exists(api_path):
-                logger.warning(f"File {api_path} không tồn tại")
-                return
-
-            if not Utils.is_apis_in_source(api_path, api_names):
-                logger.warning(f"Có API không tồn tại trong API SOURCE")
-                return
-
-            api_sources = Utils.load_json(api_path)
-            api_json = dict()
-            for api_name in api_names:
-                api_json[api_name] = api_sources[api_name]
-            
-            Utils.write_json(json_path, api_json)
-        except Exception as e:
-            logger.error(f"Lỗi khi export api {api_path} {e}")
-
     @staticmethod
     def init_requests_variables(after_time: Optional[str] = None, before_time: Optional[str] = None) -> Tuple[dict, dict]:
         time_range = dict()
@@ -181,6 +118,16 @@ class Utils():
     def n_comment2n_iter(n_comment: int) -> int:
         return n_comment // 10
 
+    @staticmethod
+    def count_comments(comment_info: Optional[dict]) -> int:
+        # Tổng số parent comment và DEPTH01 COMMENT của một post
+        if not comment_info:
+            return 0
+        total = 0
+        for comment in comment_info.get('comments', []):
+            total += 1 + len(comment.get('feedback_info', {}).get('comments') or [])
+        return total
+
     @staticmethod
     def remove_file(file_path: str) -> None:
         try: